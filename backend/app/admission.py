@@ -0,0 +1,193 @@
+"""
+Admission control: per-class concurrency limits with bounded wait queues.
+
+Requests are sorted into three classes, each with its own limit, so a
+burst of dashboard analytics cannot take the connections and event loop
+time that interactive writes and cheap lookups need:
+
+    write   any non-GET request
+    heavy   analytics, exports, sync and account statements
+    cheap   every other GET
+
+A request over its class limit waits in a FIFO queue. It is shed with
+429 and a Retry-After hint instead of queueing when the queue is full or
+the expected wait (queued requests times the class's recent service
+time, spread over its slots) is already past the class's target delay,
+and also when it has waited longer than the target. Long-lived streams
+and the stats endpoint itself are never held back.
+"""
+import asyncio
+import math
+import re
+import time
+from collections import deque
+from dataclasses import dataclass
+from typing import Deque, Dict, Optional
+
+from fastapi import status
+from fastapi.responses import JSONResponse
+
+CLASS_WRITE = "write"
+CLASS_CHEAP = "cheap"
+CLASS_HEAVY = "heavy"
+
+EXEMPT_PATHS = ("/api/events", "/api/admission", "/api/health")
+HEAVY_PREFIXES = ("/api/analytics", "/api/export", "/api/sync")
+HEAVY_PATTERN = re.compile(r"^/api/accounts/\d+/statement$")
+
+SERVICE_TIME_WEIGHT = 0.2  # weight of the newest sample in the moving average
+INITIAL_SERVICE_TIME = 0.05
+
+
+@dataclass(frozen=True)
+class ClassLimits:
+    limit: int
+    max_queue: int
+    target_delay: float  # seconds
+
+
+# Heavy reads stay well under the read pool size so cheap reads always find a connection
+DEFAULT_LIMITS: Dict[str, ClassLimits] = {
+    CLASS_WRITE: ClassLimits(limit=16, max_queue=64, target_delay=1.0),
+    CLASS_CHEAP: ClassLimits(limit=32, max_queue=128, target_delay=0.5),
+    CLASS_HEAVY: ClassLimits(limit=4, max_queue=16, target_delay=2.0),
+}
+
+
+class Shed(Exception):
+    def __init__(self, retry_after: float):
+        self.retry_after = retry_after
+
+
+class AdmissionClass:
+    def __init__(self, name: str, limits: ClassLimits):
+        self.name = name
+        self.limits = limits
+        self.active = 0
+        self.service_time = INITIAL_SERVICE_TIME
+        self.admitted = 0
+        self.shed = 0
+        self.waited = 0
+        self.total_wait = 0.0
+        self._waiters: Deque[asyncio.Future] = deque()
+
+    @property
+    def queued(self) -> int:
+        return len(self._waiters)
+
+    def expected_wait(self) -> float:
+        return (len(self._waiters) + 1) * self.service_time / self.limits.limit
+
+    def _shed(self, retry_after: float) -> Shed:
+        self.shed += 1
+        return Shed(retry_after)
+
+    async def acquire(self):
+        if self.active < self.limits.limit and not self._waiters:
+            self.active += 1
+            self.admitted += 1
+            return
+
+        expected = self.expected_wait()
+        if len(self._waiters) >= self.limits.max_queue or expected > self.limits.target_delay:
+            raise self._shed(expected)
+
+        waiter = asyncio.get_running_loop().create_future()
+        self._waiters.append(waiter)
+        started = time.monotonic()
+        try:
+            # shield: a timeout must not cancel a slot that release() handed over meanwhile
+            await asyncio.wait_for(asyncio.shield(waiter), self.limits.target_delay)
+        except (asyncio.TimeoutError, asyncio.CancelledError) as exc:
+            if not waiter.done():
+                waiter.cancel()
+                self._waiters.remove(waiter)
+                if isinstance(exc, asyncio.CancelledError):
+                    raise
+                raise self._shed(self.expected_wait())
+            if isinstance(exc, asyncio.CancelledError):
+                self.release()
+                raise
+        self.admitted += 1
+        self.waited += 1
+        self.total_wait += time.monotonic() - started
+
+    def release(self, service_time: Optional[float] = None):
+        if service_time is not None:
+            self.service_time += SERVICE_TIME_WEIGHT * (service_time - self.service_time)
+        # Hand the slot straight to the oldest waiter, so active stays at the limit
+        while self._waiters:
+            waiter = self._waiters.popleft()
+            if not waiter.done():
+                waiter.set_result(None)
+                return
+        self.active -= 1
+
+    def stats(self) -> dict:
+        return {
+            "name": self.name,
+            "limit": self.limits.limit,
+            "max_queue": self.limits.max_queue,
+            "target_delay_ms": round(self.limits.target_delay * 1000, 1),
+            "active": self.active,
+            "queued": self.queued,
+            "admitted": self.admitted,
+            "shed": self.shed,
+            "avg_wait_ms": round(self.total_wait / self.waited * 1000, 1) if self.waited else 0.0,
+            "service_time_ms": round(self.service_time * 1000, 1),
+        }
+
+
+class AdmissionController:
+    def __init__(self, limits: Dict[str, ClassLimits] = DEFAULT_LIMITS):
+        self.classes = {name: AdmissionClass(name, class_limits) for name, class_limits in limits.items()}
+
+    def classify(self, method: str, path: str) -> Optional[str]:
+        """The class a request belongs to, or None when it bypasses admission control."""
+        if not path.startswith("/api/") or path.startswith(EXEMPT_PATHS):
+            return None
+        if method not in ("GET", "HEAD"):
+            return CLASS_WRITE
+        if path.startswith(HEAVY_PREFIXES) or HEAVY_PATTERN.match(path):
+            return CLASS_HEAVY
+        return CLASS_CHEAP
+
+    def stats(self) -> list:
+        return [admission_class.stats() for admission_class in self.classes.values()]
+
+
+admission = AdmissionController()
+
+
+class AdmissionMiddleware:
+    """ASGI middleware applying an AdmissionController to HTTP requests."""
+
+    def __init__(self, app, controller: AdmissionController = admission):
+        self.app = app
+        self.controller = controller
+
+    async def __call__(self, scope, receive, send):
+        name = None
+        if scope["type"] == "http":
+            name = self.controller.classify(scope["method"], scope["path"])
+        if name is None:
+            await self.app(scope, receive, send)
+            return
+
+        admission_class = self.controller.classes[name]
+        try:
+            await admission_class.acquire()
+        except Shed as shed:
+            response = JSONResponse(
+                {"detail": f"Server busy ({name} requests); retry later"},
+                status_code=status.HTTP_429_TOO_MANY_REQUESTS,
+                headers={"Retry-After": str(max(1, math.ceil(shed.retry_after)))}
+            )
+            await response(scope, receive, send)
+            return
+
+        started = time.monotonic()
+        try:
+            await self.app(scope, receive, send)
+        finally:
+            admission_class.release(time.monotonic() - started)
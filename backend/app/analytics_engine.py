@@ -0,0 +1,227 @@
+"""
+Vectorized spending statistics.
+
+Expense totals for a date range are loaded once into a category x day
+matrix and every statistic is computed for all categories at once with
+NumPy: rolling means via cumulative sums, percentiles along the day axis,
+monthly totals via reduceat, and z-scores against a trailing baseline.
+Matrices and results are cached until the transactions table is written.
+"""
+from datetime import date, timedelta
+from typing import Dict, List, Tuple
+
+import numpy as np
+from sqlalchemy import select, func
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from .models import Transaction, TransactionType
+from .database import ShardLocal
+from .generation import GenerationCache
+from .archive import history
+
+SOURCE_TABLES = ("transactions",)
+
+stats_cache = ShardLocal(GenerationCache)
+
+
+class SpendingMatrix:
+    """Daily expense totals: `values[i, j]` is the spend of `category_ids[i]` on `start + j days`."""
+
+    def __init__(self, start: date, category_ids: List[int], values: np.ndarray):
+        self.start = start
+        self.category_ids = category_ids
+        self.values = values
+
+    @property
+    def days(self) -> int:
+        return self.values.shape[1]
+
+    def dates(self, offset: int = 0) -> List[str]:
+        return [(self.start + timedelta(days=i)).isoformat() for i in range(offset, self.days)]
+
+    @classmethod
+    async def load(cls, db: AsyncSession, start: date, end: date) -> "SpendingMatrix":
+        source = await history(Transaction, start, end)
+        result = await db.execute(
+            select(
+                source.category_id,
+                source.date,
+                func.sum(source.amount)
+            )
+            .where(
+                source.type == TransactionType.expense,
+                source.date >= start,
+                source.date <= end
+            )
+            .group_by(source.category_id, source.date)
+        )
+        rows = result.all()
+
+        category_ids = sorted({row[0] for row in rows})
+        index = {category_id: i for i, category_id in enumerate(category_ids)}
+        values = np.zeros((len(category_ids), (end - start).days + 1))
+        if rows:
+            cats, days, amounts = zip(*rows)
+            values[
+                [index[c] for c in cats],
+                [(d - start).days for d in days]
+            ] = np.asarray(amounts, dtype=float)
+        return cls(start, category_ids, values)
+
+    def _prefix_sums(self, values: np.ndarray) -> np.ndarray:
+        return np.concatenate([np.zeros((values.shape[0], 1)), np.cumsum(values, axis=1)], axis=1)
+
+    def rolling_mean(self, window: int) -> np.ndarray:
+        """Mean over each trailing `window` days, for days window-1 .. end."""
+        sums = self._prefix_sums(self.values)
+        return (sums[:, window:] - sums[:, :-window]) / window
+
+    def trailing_zscores(self, window: int) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+        """
+        Each day's spend scored against the `window` days before it.
+
+        Returns (z, mean, std) for days window .. end. Days whose baseline
+        has no variation get a z-score of NaN.
+        """
+        sums = self._prefix_sums(self.values)
+        squares = self._prefix_sums(self.values ** 2)
+        days = self.days
+        mean = (sums[:, window:days] - sums[:, :days - window]) / window
+        variance = (squares[:, window:days] - squares[:, :days - window]) / window - mean ** 2
+        std = np.sqrt(np.clip(variance, 0, None))
+        with np.errstate(divide="ignore", invalid="ignore"):
+            z = np.where(std > 0, (self.values[:, window:] - mean) / std, np.nan)
+        return z, mean, std
+
+    def monthly_totals(self) -> Tuple[List[str], np.ndarray]:
+        """Totals per calendar month, starting with the month containing `start`."""
+        months: List[str] = []
+        offsets: List[int] = []
+        current = self.start
+        while (current - self.start).days < self.days:
+            months.append(f"{current.year:04d}-{current.month:02d}")
+            offsets.append((current - self.start).days)
+            current = (current.replace(day=1) + timedelta(days=32)).replace(day=1)
+        if not self.category_ids:
+            return months, np.zeros((0, len(months)))
+        return months, np.add.reduceat(self.values, offsets, axis=1)
+
+
+async def load_matrix(db: AsyncSession, start: date, end: date) -> SpendingMatrix:
+    return await stats_cache.get_or_compute(
+        ("matrix", start, end), SOURCE_TABLES, lambda: SpendingMatrix.load(db, start, end)
+    )
+
+
+def _rounded(values: np.ndarray) -> List[float]:
+    return np.round(values, 2).tolist()
+
+
+async def rolling_spending(db: AsyncSession, days: int, window: int) -> Dict:
+    end = date.today()
+    start = end - timedelta(days=days + window - 2)
+
+    async def compute():
+        matrix = await load_matrix(db, start, end)
+        means = matrix.rolling_mean(window)
+        return {
+            "window": window,
+            "dates": matrix.dates(window - 1),
+            "series": [
+                {"category_id": category_id, "mean": _rounded(row)}
+                for category_id, row in zip(matrix.category_ids, means)
+            ],
+        }
+
+    return await stats_cache.get_or_compute(("rolling", end, days, window), SOURCE_TABLES, compute)
+
+
+async def category_stats(db: AsyncSession, days: int) -> List[Dict]:
+    end = date.today()
+    start = end - timedelta(days=days - 1)
+
+    async def compute():
+        matrix = await load_matrix(db, start, end)
+        values = matrix.values
+        if not matrix.category_ids:
+            return []
+        p50, p90, p95 = np.percentile(values, [50, 90, 95], axis=1)
+        totals = values.sum(axis=1)
+        return [
+            {
+                "category_id": category_id,
+                "total": total,
+                "daily_mean": mean,
+                "daily_std": std,
+                "p50": a, "p90": b, "p95": c,
+                "active_days": active,
+            }
+            for category_id, total, mean, std, a, b, c, active in zip(
+                matrix.category_ids,
+                _rounded(totals),
+                _rounded(values.mean(axis=1)),
+                _rounded(values.std(axis=1)),
+                _rounded(p50), _rounded(p90), _rounded(p95),
+                np.count_nonzero(values, axis=1).tolist()
+            )
+        ]
+
+    return await stats_cache.get_or_compute(("categories", end, days), SOURCE_TABLES, compute)
+
+
+async def monthly_spending(db: AsyncSession, months: int) -> Dict:
+    end = date.today()
+    start = end.replace(day=1)
+    for _ in range(months - 1):
+        start = (start - timedelta(days=1)).replace(day=1)
+
+    async def compute():
+        matrix = await load_matrix(db, start, end)
+        labels, totals = matrix.monthly_totals()
+        change = np.diff(totals, axis=1)
+        with np.errstate(divide="ignore", invalid="ignore"):
+            percent = np.where(totals[:, :-1] > 0, change / totals[:, :-1] * 100, np.nan)
+        return {
+            "months": labels,
+            "series": [
+                {
+                    "category_id": category_id,
+                    "totals": _rounded(row),
+                    "change": [None] + _rounded(delta),
+                    "change_percent": [None] + [None if np.isnan(p) else round(p, 1) for p in pct.tolist()],
+                }
+                for category_id, row, delta, pct in zip(matrix.category_ids, totals, change, percent)
+            ],
+        }
+
+    return await stats_cache.get_or_compute(("monthly", end, months), SOURCE_TABLES, compute)
+
+
+async def spending_anomalies(db: AsyncSession, days: int, window: int, threshold: float) -> List[Dict]:
+    end = date.today()
+    start = end - timedelta(days=days + window - 1)
+
+    async def compute():
+        matrix = await load_matrix(db, start, end)
+        z, mean, std = matrix.trailing_zscores(window)
+        recent = matrix.values[:, window:]
+        with np.errstate(invalid="ignore"):
+            flagged = (recent > 0) & (z >= threshold)
+        rows, cols = np.nonzero(flagged)
+        anomalies = [
+            {
+                "date": (matrix.start + timedelta(days=window + int(j))).isoformat(),
+                "category_id": matrix.category_ids[i],
+                "amount": round(float(recent[i, j]), 2),
+                "baseline_mean": round(float(mean[i, j]), 2),
+                "baseline_std": round(float(std[i, j]), 2),
+                "z_score": round(float(z[i, j]), 2),
+            }
+            for i, j in zip(rows.tolist(), cols.tolist())
+        ]
+        anomalies.sort(key=lambda a: (a["date"], a["z_score"]), reverse=True)
+        return anomalies
+
+    return await stats_cache.get_or_compute(
+        ("anomalies", end, days, window, threshold), SOURCE_TABLES, compute
+    )
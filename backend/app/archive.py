@@ -0,0 +1,307 @@
+"""
+Cold history in yearly archive databases.
+
+Closing a year moves its transactions, transfers and goal contributions
+out of the tenant's database into <database>.archive/<year>.db, so the
+hot tables and their indexes only hold the open years. Balances need no
+archived rows: closing first completes the month-end checkpoints through
+the end of the year, and those checkpoints carry every closed year's
+balances forward. Writes dated in a closed year are rejected, which also
+means those checkpoints are never invalidated.
+
+Reads whose date range reaches into archived years use `history()` (or
+`history_table()` for core queries): the model's table unioned with the
+archived tables of those years. The archives are attached to whichever
+connection runs the statement on first use (see app.database), so this
+works on fanned-out read sessions and raw connections alike.
+
+A year is closed in steps (driven by the close_year job): it is marked
+closed, its rows are copied to the archive, and finally the hot rows are
+deleted and the year marked archived. Until then reads keep using the hot
+rows, and writes to it are already rejected, so the copy cannot go stale.
+"""
+import json
+import os
+from datetime import date, datetime, timedelta
+from typing import Dict, List, Optional, Tuple
+
+from fastapi import HTTPException, status
+from sqlalchemy import Column, Connection, Index, MetaData, Table, event, select, delete, update, func, text, union_all
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy.orm import Session, aliased
+from sqlalchemy.orm.attributes import get_history
+
+from .database import ShardLocal, archive_dir, archive_schema, async_session, current_shard, read_session
+from .models import ClosedYear, Transaction, Transfer, GoalContribution
+from .generation import generations, mark_written
+
+ARCHIVED_MODELS = (Transaction, Transfer, GoalContribution)
+CLOSED_YEARS_TABLES = ("closed_years",)
+
+
+class ClosedPeriodError(HTTPException):
+    def __init__(self, through: date):
+        super().__init__(
+            status_code=status.HTTP_409_CONFLICT,
+            detail=f"Entries dated on or before {through} belong to a closed year and can no longer be changed"
+        )
+
+
+_archive_metadata: Dict[int, MetaData] = {}
+
+
+def archive_metadata(year: int) -> MetaData:
+    """Tables of one year's archive: the archived models' columns, without foreign keys."""
+    metadata = _archive_metadata.get(year)
+    if metadata is None:
+        metadata = _archive_metadata[year] = MetaData(schema=archive_schema(year))
+        for model in ARCHIVED_MODELS:
+            table = model.__table__
+            Table(
+                table.name,
+                metadata,
+                *(Column(c.name, c.type.copy(), primary_key=c.primary_key, nullable=c.nullable) for c in table.columns),
+                Index(f"ix_{table.name}_date", "date"),
+                Index(f"ix_{table.name}_version", "version"),
+            )
+    return metadata
+
+
+def archived_table(model, year: int) -> Table:
+    return archive_metadata(year).tables[f"{archive_schema(year)}.{model.__tablename__}"]
+
+
+def history_table(model, years: Tuple[int, ...], include_hot: bool = True):
+    """The model's table plus the archived tables of `years`, or only the latter without `include_hot`."""
+    table = model.__table__
+    if include_hot and not years:
+        return table
+    selects = [select(archived_table(model, year)) for year in years]
+    if include_hot:
+        selects.insert(0, select(table))
+    return union_all(*selects).subquery(f"{table.name}_history")
+
+
+def archived(model, years: Tuple[int, ...]):
+    """
+    ORM alias of `model` over the archived tables of `years` alone.
+
+    Archived entries are all older than the hot ones, so a newest-first
+    listing can page through the hot table and continue here once it runs
+    out, instead of sorting the union.
+    """
+    return aliased(model, history_table(model, years, include_hot=False), adapt_on_names=True)
+
+
+class ClosedYears:
+    """
+    The shard's closed years, reloaded whenever closed_years is written (by any worker).
+
+    `closed` includes years still being archived; `archived` only those
+    whose rows have moved and that had any.
+    """
+
+    def __init__(self):
+        self.closed: Tuple[int, ...] = ()
+        self.archived: Tuple[int, ...] = ()
+        self.id_floors: Dict[str, int] = {}
+        self._generation: Optional[Tuple[int, ...]] = None
+
+    def _is_current(self) -> bool:
+        return self._generation is not None and self._generation == generations.current(CLOSED_YEARS_TABLES)
+
+    def ensure(self, conn: Connection) -> "ClosedYears":
+        if self._is_current():
+            return self
+        generation = generations.current(CLOSED_YEARS_TABLES)
+        rows = conn.execute(select(ClosedYear.__table__).order_by(ClosedYear.year)).all()
+
+        id_floors: Dict[str, int] = {}
+        for row in rows:
+            for table_name, max_id in json.loads(row.max_ids).items():
+                id_floors[table_name] = max(id_floors.get(table_name, 0), max_id)
+        self.closed = tuple(row.year for row in rows)
+        self.archived = tuple(
+            row.year for row in rows
+            if row.archived and row.transactions + row.transfers + row.goal_contributions > 0
+        )
+        self.id_floors = id_floors
+        self._generation = generation
+        return self
+
+    @property
+    def through(self) -> Optional[date]:
+        """Last day of the last closed year."""
+        return date(self.closed[-1], 12, 31) if self.closed else None
+
+    @property
+    def archived_through(self) -> Optional[date]:
+        return date(self.archived[-1], 12, 31) if self.archived else None
+
+    def reaching(self, start: Optional[date], end: Optional[date]) -> Tuple[int, ...]:
+        """Archived years overlapping [start, end]; None leaves that side open."""
+        return tuple(
+            year for year in self.archived
+            if (start is None or year >= start.year) and (end is None or year <= end.year)
+        )
+
+
+closed_years = ShardLocal(ClosedYears)
+
+
+async def load_closed_years() -> ClosedYears:
+    closed = closed_years.get()
+    if not closed._is_current():
+        async with read_session() as db:
+            await db.run_sync(lambda session: closed.ensure(session.connection()))
+    return closed
+
+
+async def archived_years(start: Optional[date] = None, end: Optional[date] = None) -> Tuple[int, ...]:
+    return (await load_closed_years()).reaching(start, end)
+
+
+async def history(model, start: Optional[date] = None, end: Optional[date] = None):
+    """
+    `model`, or an alias of it that also covers the archived years
+    overlapping [start, end], for ORM queries over that date range.
+    """
+    years = await archived_years(start, end)
+    if not years:
+        return model
+    return aliased(model, history_table(model, years))
+
+
+async def balance_archives(checkpoint: Optional[date], as_of: Optional[date]) -> Tuple[int, ...]:
+    """
+    Archived years a balance as of `as_of` has to read, given the
+    checkpoint (period end) it starts from. Checkpoints carry the closed
+    years forward, so only a date inside an archived year needs one.
+    """
+    if as_of is None:
+        return ()
+    closed = await load_closed_years()
+    if closed.archived_through is None or as_of > closed.archived_through:
+        return ()
+    return closed.reaching(checkpoint + timedelta(days=1) if checkpoint else None, as_of)
+
+
+async def ensure_open(day: date):
+    """Reject a set-based write that touches entries dated `day` or later when `day` is in a closed year."""
+    closed = await load_closed_years()
+    if closed.through is not None and day <= closed.through:
+        raise ClosedPeriodError(closed.through)
+
+
+def _dates(obj) -> set:
+    changes = get_history(obj, "date")
+    return {d for d in (*changes.added, *changes.unchanged, *changes.deleted) if d is not None}
+
+
+def _assign_ids_above_archives(session: Session, closed: ClosedYears):
+    """
+    SQLite gives a new row the highest id in its table plus one, so once a
+    table's newest rows have been archived it would hand their ids out
+    again. New rows start above the highest archived id instead.
+    """
+    for model in ARCHIVED_MODELS:
+        floor = closed.id_floors.get(model.__tablename__)
+        new = [obj for obj in session.new if isinstance(obj, model) and obj.id is None]
+        if not floor or not new:
+            continue
+        highest = session.connection().execute(select(func.max(model.id))).scalar() or 0
+        if highest >= floor:
+            continue
+        for next_id, obj in enumerate(new, start=floor + 1):
+            obj.id = next_id
+
+
+@event.listens_for(Session, "before_flush")
+def _guard_closed_years(session: Session, flush_context, instances):
+    touched = [obj for obj in (*session.new, *session.dirty, *session.deleted) if isinstance(obj, ARCHIVED_MODELS)]
+    if not touched:
+        return
+    closed = closed_years.get().ensure(session.connection())
+    through = closed.through
+    if through is not None:
+        for obj in touched:
+            if obj in session.dirty and not session.is_modified(obj, include_collections=False):
+                continue
+            if any(day <= through for day in _dates(obj)):
+                raise ClosedPeriodError(through)
+    _assign_ids_above_archives(session, closed)
+
+
+async def mark_years_closed(db: AsyncSession, through_year: int) -> List[int]:
+    """
+    Mark every year up to `through_year` closed, in the caller's transaction.
+
+    Years follow on from the last closed one (or the first year with any
+    entries). Returns the closed years whose rows are still to be archived,
+    including those of an earlier, interrupted close.
+    """
+    last = (await db.execute(select(func.max(ClosedYear.year)))).scalar()
+    if last is not None:
+        first = last + 1
+    else:
+        firsts = [(await db.execute(select(func.min(model.date)))).scalar() for model in ARCHIVED_MODELS]
+        first = min((day.year for day in firsts if day is not None), default=through_year)
+    for year in range(first, through_year + 1):
+        db.add(ClosedYear(year=year))
+    await db.flush()
+
+    result = await db.execute(select(ClosedYear.year).where(ClosedYear.archived == False).order_by(ClosedYear.year))
+    return list(result.scalars())
+
+
+async def archive_year(year: int) -> Dict[str, int]:
+    """
+    Move one closed year's rows into its archive and mark it archived.
+
+    The copy commits on its own, leaving the main database untouched
+    (SQLite commits attached databases one by one, so one transaction
+    writing both would not be atomic). Repeating it after an interruption
+    replaces the rows copied before. The delete then runs together with
+    the check that the archive holds every row. Returns the row counts.
+    """
+    start, end = date(year, 1, 1), date(year, 12, 31)
+    os.makedirs(archive_dir(current_shard().path), exist_ok=True)
+
+    async with async_session() as db:
+        conn = await db.connection()
+        await conn.run_sync(archive_metadata(year).create_all)
+        await db.execute(text("BEGIN IMMEDIATE"))
+        for model in ARCHIVED_MODELS:
+            table = model.__table__
+            await db.execute(
+                archived_table(model, year).insert().prefix_with("OR REPLACE").from_select(
+                    list(table.c.keys()), select(table).where(table.c.date.between(start, end))
+                )
+            )
+        await db.commit()
+
+    async with async_session() as db:
+        await db.execute(text("BEGIN IMMEDIATE"))
+        counts: Dict[str, int] = {}
+        max_ids: Dict[str, int] = {}
+        for model in ARCHIVED_MODELS:
+            table = model.__table__
+            in_year = table.c.date.between(start, end)
+            count, max_id = (await db.execute(select(func.count(), func.max(table.c.id)).where(in_year))).one()
+            archived = archived_table(model, year)
+            copied = (await db.execute(select(func.count()).select_from(archived).where(archived.c.date.between(start, end)))).scalar()
+            if copied != count:
+                raise RuntimeError(f"Archive of {year} holds {copied} {table.name} rows, expected {count}")
+            await db.execute(delete(table).where(in_year))
+            counts[table.name] = count
+            if max_id is not None:
+                max_ids[table.name] = max_id
+
+        await db.execute(
+            update(ClosedYear).where(ClosedYear.year == year).values(
+                archived=True, max_ids=json.dumps(max_ids), closed_at=datetime.utcnow(), **counts
+            )
+        )
+        mark_written(db, "closed_years", *(model.__tablename__ for model in ARCHIVED_MODELS))
+        await db.commit()
+    return counts
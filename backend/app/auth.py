@@ -1,13 +1,60 @@
+import json
 import os
-from fastapi import Header, HTTPException, status
+from contextlib import asynccontextmanager
+from typing import Dict, Optional
+from fastapi import Header, HTTPException, Query, status
+
+from .shards import DEFAULT_TENANT, TENANT_NAME, shards
 
 API_KEY = os.environ.get("FINANCE_API_KEY", "finance-api-key")
+TENANTS_FILE = os.environ.get("FINANCE_TENANTS_FILE")
 
 
-async def verify_api_key(x_api_key: str = Header(...)):
-    if x_api_key != API_KEY:
+def load_tenants() -> Dict[str, str]:
+    """
+    API key -> tenant. The tenants file is a JSON object mapping every key
+    to the name of its tenant (several keys may share one); without it the
+    single FINANCE_API_KEY belongs to the default tenant.
+    """
+    if not TENANTS_FILE:
+        return {API_KEY: DEFAULT_TENANT}
+    with open(TENANTS_FILE) as f:
+        tenants = json.load(f)
+    for tenant in tenants.values():
+        if not TENANT_NAME.match(tenant):
+            raise ValueError(f"Invalid tenant name in {TENANTS_FILE}: {tenant!r}")
+    return tenants
+
+
+TENANTS = load_tenants()
+
+
+@asynccontextmanager
+async def routed_to_tenant(api_key: Optional[str]):
+    tenant = TENANTS.get(api_key)
+    if tenant is None:
         raise HTTPException(
             status_code=status.HTTP_401_UNAUTHORIZED,
             detail="Invalid API key"
         )
-    return x_api_key
+    # The shard stays current for the rest of the request, but the dependency exits before a
+    # streamed body is sent: streaming endpoints hold the shard themselves (see held_shard_stream)
+    entry = await shards.acquire(tenant)
+    try:
+        yield
+    finally:
+        shards.release(entry)
+
+
+async def verify_api_key(x_api_key: str = Header(...)):
+    async with routed_to_tenant(x_api_key):
+        yield x_api_key
+
+
+async def verify_stream_api_key(
+    x_api_key: Optional[str] = Header(default=None),
+    api_key: Optional[str] = Query(default=None)
+):
+    # EventSource cannot set headers, so streams also accept the key as a query parameter
+    async with routed_to_tenant(x_api_key or api_key):
+        yield x_api_key or api_key
@@ -1,32 +1,36 @@
+from datetime import date
 from decimal import Decimal
+from typing import Dict, Optional, Tuple
 from sqlalchemy.ext.asyncio import AsyncSession
-from sqlalchemy import select, func
 
-from .models import Transaction, TransactionType, GoalContribution
+from .database import fan_out
+from .ledger import AVAILABLE_LEDGER, StatementKey
+from .checkpoints import get_balance_as_of, get_balance_through_key, get_all_account_balances
 
 
-async def get_available_balance(db: AsyncSession) -> Decimal:
+async def get_available_balance(db: AsyncSession, as_of: Optional[date] = None) -> Decimal:
     """
     Calculate available balance: total_income - total_expense - total_goal_contributions
     """
-    # Total income
-    income_result = await db.execute(
-        select(func.coalesce(func.sum(Transaction.amount), 0))
-        .where(Transaction.type == TransactionType.income)
-    )
-    total_income = Decimal(str(income_result.scalar()))
-
-    # Total expense
-    expense_result = await db.execute(
-        select(func.coalesce(func.sum(Transaction.amount), 0))
-        .where(Transaction.type == TransactionType.expense)
-    )
-    total_expense = Decimal(str(expense_result.scalar()))
-
-    # Total goal contributions
-    contributions_result = await db.execute(
-        select(func.coalesce(func.sum(GoalContribution.amount), 0))
-    )
-    total_contributions = Decimal(str(contributions_result.scalar()))
-
-    return total_income - total_expense - total_contributions
+    return await get_balance_as_of(db, AVAILABLE_LEDGER, as_of)
+
+
+async def get_account_balance(db: AsyncSession, account_id: int, as_of: Optional[date] = None) -> Decimal:
+    """Calculate account balance from transactions and transfers."""
+    return await get_balance_as_of(db, account_id, as_of)
+
+
+async def get_account_balances(db: AsyncSession) -> Dict[int, Decimal]:
+    """Balances of every account that has any movement."""
+    return await get_all_account_balances(db)
+
+
+async def get_current_balances() -> Tuple[Decimal, Dict[int, Decimal]]:
+    """Available balance and all account balances, read concurrently on two read connections."""
+    available, accounts = await fan_out(get_available_balance, get_account_balances)
+    return available, accounts
+
+
+async def get_account_balance_through(db: AsyncSession, account_id: int, key: StatementKey) -> Decimal:
+    """Balance of an account after every entry up to and including `key`."""
+    return await get_balance_through_key(db, account_id, key)
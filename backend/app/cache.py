@@ -0,0 +1,79 @@
+import asyncio
+from typing import Dict, Optional, Tuple
+
+from fastapi import Depends
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy import select
+
+from .database import get_db, ShardLocal
+from .models import Category, Account, Settings
+from .schemas import CategoryResponse, AccountResponse
+from .generation import generations
+
+REFERENCE_TABLES = ("categories", "accounts", "settings")
+
+
+class ReferenceCache:
+    """
+    In-memory copy of the reference tables (categories, accounts, settings).
+
+    These rows change rarely, so they are loaded once and kept as response
+    objects that read paths can attach directly instead of joining or
+    issuing loader queries. Writers call invalidate() after committing and
+    the next reader reloads the whole set; a change of the tables' write
+    generations does the same for writes committed by other workers.
+    """
+
+    def __init__(self):
+        self.categories: Dict[int, CategoryResponse] = {}
+        self.accounts: Dict[int, AccountResponse] = {}
+        self.settings: Dict[str, str] = {}
+        self._loaded = False
+        self._invalidations = 0
+        self._generation: Optional[Tuple[int, ...]] = None
+        self._lock = asyncio.Lock()
+
+    def _is_current(self) -> bool:
+        return self._loaded and self._generation == generations.current(REFERENCE_TABLES)
+
+    async def load(self, db: AsyncSession):
+        # Read before the rows: an invalidate() while they load leaves the cache unloaded
+        invalidations = self._invalidations
+        generation = generations.current(REFERENCE_TABLES)
+        categories = (await db.execute(select(Category))).scalars().all()
+        accounts = (await db.execute(select(Account))).scalars().all()
+        settings = (await db.execute(select(Settings))).scalars().all()
+
+        self.categories = {c.id: CategoryResponse.model_validate(c) for c in categories}
+        self.accounts = {a.id: AccountResponse.model_validate(a) for a in accounts}
+        self.settings = {s.key: s.value for s in settings}
+        self._generation = generation
+        self._loaded = invalidations == self._invalidations
+
+    async def ensure(self, db: AsyncSession):
+        if self._is_current():
+            return
+        async with self._lock:
+            if not self._is_current():
+                await self.load(db)
+
+    def invalidate(self):
+        self._invalidations += 1
+        self._loaded = False
+
+    def category(self, category_id: int) -> CategoryResponse:
+        return self.categories[category_id]
+
+    def account(self, account_id: Optional[int]) -> Optional[AccountResponse]:
+        if account_id is None:
+            return None
+        return self.accounts.get(account_id)
+
+
+reference_cache = ShardLocal(ReferenceCache)
+
+
+async def get_reference_cache(db: AsyncSession = Depends(get_db)) -> ReferenceCache:
+    cache = reference_cache.get()
+    await cache.ensure(db)
+    return cache
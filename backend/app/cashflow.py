@@ -0,0 +1,117 @@
+"""
+Projected balances from recurring rules.
+
+Every active RecurringTransaction is expanded over the horizon, the
+occurrences are summed into a daily net-flow array in cents and the
+projected balances are cumulative sums on top of today's balances.
+Occurrences that are already due but not yet processed land on day 0,
+since processing posts them right away.
+"""
+import asyncio
+from datetime import date, timedelta
+from typing import Dict
+
+import numpy as np
+from sqlalchemy import select
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from .models import RecurringTransaction, RecurrenceInterval, TransactionType
+from .balance import get_current_balances
+from .cache import ReferenceCache
+from .database import ShardLocal
+from .generation import GenerationCache
+from .routers.recurring import get_next_date
+
+SOURCE_TABLES = ("recurring_transactions", "transactions", "transfers", "goal_contributions", "accounts")
+
+FIXED_STEPS = {RecurrenceInterval.daily: 1, RecurrenceInterval.weekly: 7}
+
+forecast_cache = ShardLocal(GenerationCache)
+
+
+def occurrence_offsets(next_date: date, interval: RecurrenceInterval, start: date, days: int) -> np.ndarray:
+    """Day offsets from `start` of every occurrence before start + days, overdue ones clamped to 0."""
+    first = (next_date - start).days
+    if first >= days:
+        return np.empty(0, dtype=np.int64)
+
+    step = FIXED_STEPS.get(interval)
+    if step is not None:
+        return np.maximum(np.arange(first, days, step), 0)
+
+    # Calendar steps go through get_next_date one by one so month-end
+    # clamping compounds exactly as it does when rules are processed
+    offsets = []
+    current = next_date
+    while (current - start).days < days:
+        offsets.append(max((current - start).days, 0))
+        following = get_next_date(current, interval)
+        if following == current:
+            break
+        current = following
+    return np.asarray(offsets, dtype=np.int64)
+
+
+def _to_cents(amount) -> int:
+    return int(round(amount * 100))
+
+
+def _series(opening_cents: int, flows: np.ndarray) -> Dict:
+    balance = opening_cents + np.cumsum(flows)
+    return {"opening": opening_cents / 100, "balance": (balance / 100).tolist()}
+
+
+async def compute_forecast(db: AsyncSession, refs: ReferenceCache, days: int) -> Dict:
+    start = date.today()
+    result, (available, account_balances) = await asyncio.gather(
+        db.execute(
+            select(RecurringTransaction).where(
+                RecurringTransaction.is_active == True,
+                RecurringTransaction.next_date < start + timedelta(days=days)
+            )
+        ),
+        get_current_balances()
+    )
+
+    income = np.zeros(days, dtype=np.int64)
+    expense = np.zeros(days, dtype=np.int64)
+    for recurring in result.scalars():
+        offsets = occurrence_offsets(recurring.next_date, recurring.interval, start, days)
+        target = income if recurring.type == TransactionType.income else expense
+        np.add.at(target, offsets, _to_cents(recurring.amount))
+
+    available = _to_cents(available)
+    account_balances = {account_id: _to_cents(balance) for account_id, balance in account_balances.items()}
+    in_accounts = sum(account_balances.get(account_id, 0) for account_id in refs.accounts)
+
+    # Recurring rules carry no account, so their flows land in the unassigned part of the balance
+    net = income - expense
+    overall = _series(available, net)
+    lowest = int(np.argmin(overall["balance"]))
+    no_flows = np.zeros(days, dtype=np.int64)
+
+    return {
+        "start_date": start,
+        "days": days,
+        "dates": [(start + timedelta(days=i)).isoformat() for i in range(days)],
+        "income": (income / 100).tolist(),
+        "expense": (expense / 100).tolist(),
+        "overall": overall,
+        "unassigned": _series(available - in_accounts, net),
+        "accounts": [
+            {
+                "account_id": account.id,
+                "account_name": account.name,
+                **_series(account_balances.get(account.id, 0), no_flows)
+            }
+            for account in refs.accounts.values()
+        ],
+        "lowest_balance": overall["balance"][lowest],
+        "lowest_balance_date": start + timedelta(days=lowest),
+    }
+
+
+async def get_cash_flow_forecast(db: AsyncSession, refs: ReferenceCache, days: int) -> Dict:
+    return await forecast_cache.get_or_compute(
+        (date.today(), days), SOURCE_TABLES, lambda: compute_forecast(db, refs, days)
+    )
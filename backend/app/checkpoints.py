@@ -0,0 +1,273 @@
+"""
+Month-end balance checkpoints.
+
+balance_checkpoints holds the closing balance of every account (and of
+the available balance, ledger 0) at the end of each completed month, so a
+balance at any date is the nearest earlier checkpoint plus the entries
+since. A write dated before the current month deletes the affected
+ledgers' checkpoints from that month on, in the same transaction, and the
+builder fills the gap again afterwards. Once a year is closed, the
+checkpoints through its end are all that is left of its entries in this
+database (see app.archive).
+"""
+import asyncio
+from datetime import date, timedelta
+from decimal import Decimal
+from typing import Dict, Optional, Tuple
+
+from sqlalchemy import event, select, insert, delete, func, and_, or_, text
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy.orm import Session
+from sqlalchemy.orm.attributes import get_history
+
+from .database import async_session, ShardLocal
+from .models import BalanceCheckpoint, Account, Transaction, Transfer, GoalContribution
+from .ledger import AVAILABLE_LEDGER, StatementKey, ledger_entries, all_account_entries, entries_after
+from .archive import balance_archives
+
+STALE_CHECKPOINTS_KEY = "stale_balance_checkpoints"
+
+CENTS = Decimal("0.01")
+
+
+def last_closed_month_end(today: date) -> date:
+    return today.replace(day=1) - timedelta(days=1)
+
+
+def _month_ends(first: date, last: date):
+    """Month-end dates from the month containing `first` through `last`."""
+    current = first.replace(day=1)
+    while current <= last:
+        following = (current + timedelta(days=32)).replace(day=1)
+        yield following - timedelta(days=1)
+        current = following
+
+
+async def _checkpoint_before(db: AsyncSession, ledger_id: int, before: Optional[date]) -> Tuple[Optional[date], Decimal]:
+    """Latest checkpoint ending before `before` (or the latest at all), as (period_end, balance)."""
+    query = select(BalanceCheckpoint.period_end, BalanceCheckpoint.balance).where(
+        BalanceCheckpoint.account_id == ledger_id
+    )
+    if before is not None:
+        query = query.where(BalanceCheckpoint.period_end < before)
+    result = await db.execute(query.order_by(BalanceCheckpoint.period_end.desc()).limit(1))
+    row = result.first()
+    if row is None:
+        return None, Decimal("0")
+    return row.period_end, Decimal(str(row.balance))
+
+
+async def get_balance_as_of(db: AsyncSession, ledger_id: int, as_of: Optional[date] = None) -> Decimal:
+    """Balance of a ledger after every entry dated on or before `as_of` (everything when None)."""
+    checkpoint_builder.refresh_if_stale()
+    before = as_of + timedelta(days=1) if as_of is not None else None
+    period_end, balance = await _checkpoint_before(db, ledger_id, before)
+
+    entries = ledger_entries(ledger_id, await balance_archives(period_end, as_of))
+    query = select(func.coalesce(func.sum(entries.c.amount), 0))
+    if period_end is not None:
+        query = query.where(entries.c.date > period_end)
+    if as_of is not None:
+        query = query.where(entries.c.date <= as_of)
+    return balance + Decimal(str((await db.execute(query)).scalar()))
+
+
+async def get_balance_through_key(db: AsyncSession, account_id: int, key: StatementKey) -> Decimal:
+    """Balance of an account after every statement entry up to and including `key`."""
+    checkpoint_builder.refresh_if_stale()
+    period_end, balance = await _checkpoint_before(db, account_id, key[0])
+
+    entries = ledger_entries(account_id, await balance_archives(period_end, key[0]))
+    query = select(func.coalesce(func.sum(entries.c.amount), 0)).where(~entries_after(entries, key))
+    if period_end is not None:
+        query = query.where(entries.c.date > period_end)
+    return balance + Decimal(str((await db.execute(query)).scalar()))
+
+
+async def get_all_account_balances(db: AsyncSession) -> Dict[int, Decimal]:
+    """Current balance of every account with any movement: latest checkpoints plus one grouped delta query."""
+    checkpoint_builder.refresh_if_stale()
+    latest = (
+        select(BalanceCheckpoint.account_id, func.max(BalanceCheckpoint.period_end).label("period_end"))
+        .where(BalanceCheckpoint.account_id != AVAILABLE_LEDGER)
+        .group_by(BalanceCheckpoint.account_id)
+        .subquery()
+    )
+    result = await db.execute(
+        select(BalanceCheckpoint.account_id, BalanceCheckpoint.balance).join(
+            latest,
+            and_(
+                BalanceCheckpoint.account_id == latest.c.account_id,
+                BalanceCheckpoint.period_end == latest.c.period_end
+            )
+        )
+    )
+    balances = {row.account_id: Decimal(str(row.balance)) for row in result}
+
+    entries = all_account_entries()
+    result = await db.execute(
+        select(entries.c.account_id, func.sum(entries.c.amount).label("delta"))
+        .outerjoin(latest, latest.c.account_id == entries.c.account_id)
+        .where(or_(latest.c.period_end.is_(None), entries.c.date > latest.c.period_end))
+        .group_by(entries.c.account_id)
+    )
+    for row in result:
+        balances[row.account_id] = balances.get(row.account_id, Decimal("0")) + Decimal(str(row.delta))
+    return balances
+
+
+async def build_checkpoints(db: AsyncSession, through: date) -> int:
+    """
+    Add the missing month-end checkpoints up to `through` for every ledger.
+
+    Runs under the write lock so no write can land between summing the
+    entries and storing the result. Returns the number of rows added.
+    """
+    await db.execute(text("BEGIN IMMEDIATE"))
+    added = await add_missing_checkpoints(db, through)
+    await db.commit()
+    return added
+
+
+async def add_missing_checkpoints(db: AsyncSession, through: date) -> int:
+    """build_checkpoints within the caller's transaction, which must hold the write lock."""
+    ledger_ids = [AVAILABLE_LEDGER] + list((await db.execute(select(Account.id))).scalars())
+
+    added = 0
+    for ledger_id in ledger_ids:
+        period_end, balance = await _checkpoint_before(db, ledger_id, None)
+        entries = ledger_entries(ledger_id)
+        month = func.strftime("%Y-%m", entries.c.date)
+        query = (
+            select(month.label("month"), func.sum(entries.c.amount).label("total"), func.min(entries.c.date))
+            .where(entries.c.date <= through)
+            .group_by(month)
+        )
+        if period_end is not None:
+            query = query.where(entries.c.date > period_end)
+        totals = {row.month: (Decimal(str(row.total)).quantize(CENTS), row[2]) for row in await db.execute(query)}
+
+        if period_end is not None:
+            first = period_end + timedelta(days=1)
+        elif totals:
+            first = min(first_date for _, first_date in totals.values())
+        else:
+            continue
+
+        rows = []
+        for month_end in _month_ends(first, through):
+            balance += totals.get(month_end.strftime("%Y-%m"), (Decimal("0"), None))[0]
+            rows.append({"account_id": ledger_id, "period_end": month_end, "balance": balance})
+        if rows:
+            await db.execute(insert(BalanceCheckpoint), rows)
+            added += len(rows)
+    return added
+
+
+class CheckpointBuilder:
+    """
+    Keeps checkpoints complete through the last closed month.
+
+    Readers call refresh_if_stale(); a rebuild is started in the background
+    (in its own session) after a backdated write and at month rollover.
+    """
+
+    def __init__(self):
+        self.built_through: Optional[date] = None
+        self._invalidations = 0
+        self._task: Optional[asyncio.Task] = None
+
+    def mark_stale(self):
+        self._invalidations += 1
+        self.built_through = None
+
+    def refresh_if_stale(self):
+        target = last_closed_month_end(date.today())
+        if self.built_through == target or (self._task and not self._task.done()):
+            return
+        self._task = asyncio.get_running_loop().create_task(self.refresh(target))
+
+    async def refresh(self, target: Optional[date] = None):
+        target = target or last_closed_month_end(date.today())
+        invalidations = self._invalidations
+        async with async_session() as db:
+            await build_checkpoints(db, target)
+        # A backdated write that committed after the build leaves the checkpoints stale
+        if invalidations == self._invalidations:
+            self.built_through = target
+
+    async def wait(self):
+        if self._task:
+            await asyncio.shield(self._task)
+
+
+checkpoint_builder = ShardLocal(CheckpointBuilder)
+
+
+def invalidate_checkpoints(conn, earliest: Dict[int, date]):
+    """Delete checkpoints of each ledger from the month of its earliest changed date on."""
+    if not earliest:
+        return
+    conn.execute(delete(BalanceCheckpoint).where(or_(*[
+        and_(BalanceCheckpoint.account_id == ledger_id, BalanceCheckpoint.period_end >= changed)
+        for ledger_id, changed in earliest.items()
+    ])))
+
+
+async def invalidate_backdated(db: AsyncSession, earliest: Dict[int, date]):
+    """Invalidation for set-based statements, which bypass the flush hook below."""
+    open_month = date.today().replace(day=1)
+    earliest = {ledger_id: changed for ledger_id, changed in earliest.items() if changed < open_month}
+    if earliest:
+        conn = await db.connection()
+        await conn.run_sync(invalidate_checkpoints, earliest)
+        db.info[STALE_CHECKPOINTS_KEY] = True
+
+
+def _touched_dates(obj, *attrs) -> set:
+    """Current and previous values of the given attributes."""
+    values = set()
+    for attr in attrs:
+        history = get_history(obj, attr)
+        values.update(v for v in (*history.added, *history.unchanged, *history.deleted) if v is not None)
+    return values
+
+
+@event.listens_for(Session, "before_flush")
+def _invalidate_backdated(session: Session, flush_context, instances):
+    open_month = date.today().replace(day=1)
+    earliest: Dict[int, date] = {}
+
+    for obj in (*session.new, *session.dirty, *session.deleted):
+        if isinstance(obj, Transaction):
+            ledgers = {AVAILABLE_LEDGER} | _touched_dates(obj, "account_id")
+        elif isinstance(obj, Transfer):
+            ledgers = _touched_dates(obj, "from_account_id", "to_account_id")
+        elif isinstance(obj, GoalContribution):
+            ledgers = {AVAILABLE_LEDGER}
+        else:
+            continue
+        if obj in session.dirty and not session.is_modified(obj, include_collections=False):
+            continue
+
+        # Checkpoints only exist for closed months, so writes dated this month or later touch none
+        dates = [d for d in _touched_dates(obj, "date") if d < open_month]
+        if not dates:
+            continue
+        for ledger_id in ledgers:
+            earliest[ledger_id] = min(earliest.get(ledger_id, dates[0]), *dates)
+
+    if earliest:
+        invalidate_checkpoints(session.connection(), earliest)
+        session.info[STALE_CHECKPOINTS_KEY] = True
+
+
+@event.listens_for(Session, "after_commit")
+def _rebuild_after_commit(session: Session):
+    if session.info.pop(STALE_CHECKPOINTS_KEY, False):
+        checkpoint_builder.mark_stale()
+
+
+@event.listens_for(Session, "after_rollback")
+def _discard_stale_flag(session: Session):
+    session.info.pop(STALE_CHECKPOINTS_KEY, None)
@@ -0,0 +1,54 @@
+import enum
+import json
+from typing import Any, Callable, Dict, Hashable, Iterable, List, Optional, Sequence, Tuple
+
+from fastapi.responses import JSONResponse
+from pydantic import BaseModel
+
+from .serialization import json_value
+
+
+class ResponseFormat(str, enum.Enum):
+    rows = "rows"
+    columnar = "columnar"
+
+
+class CompactJSONResponse(JSONResponse):
+    def render(self, content: Any) -> bytes:
+        return json.dumps(content, ensure_ascii=False, allow_nan=False, separators=(",", ":")).encode("utf-8")
+
+
+def to_columns(rows: Sequence[Sequence[Any]], names: Sequence[str]) -> Dict[str, List[Any]]:
+    """Transpose result rows into one list per column, values encoded like the row responses."""
+    if not rows:
+        return {name: [] for name in names}
+    return {name: [json_value(v) for v in values] for name, values in zip(names, zip(*rows))}
+
+
+def dictionary_encode(
+    keys: Iterable[Optional[Hashable]],
+    lookup: Callable[[Hashable], Optional[BaseModel]],
+    attrs: Sequence[str]
+) -> Tuple[List[Optional[int]], Dict[str, List[Any]]]:
+    """
+    Replace each key with a small code into a table of the distinct referenced objects.
+
+    Returns the code column and the table as one list per attribute.
+    Missing keys (None, or not found by lookup) encode as None.
+    """
+    codes: List[Optional[int]] = []
+    index: Dict[Hashable, Optional[int]] = {}
+    entries: List[BaseModel] = []
+
+    for key in keys:
+        if key not in index:
+            entry = lookup(key) if key is not None else None
+            if entry is None:
+                index[key] = None
+            else:
+                index[key] = len(entries)
+                entries.append(entry)
+        codes.append(index[key])
+
+    table = {attr: [json_value(getattr(entry, attr)) for entry in entries] for attr in attrs}
+    return codes, table
@@ -1,10 +1,178 @@
+import asyncio
+import enum
+import os
+import re
+from contextvars import ContextVar
+from decimal import Decimal
+from typing import Any, Awaitable, Callable, Dict, Generic, List, Optional, TypeVar
+from sqlalchemy import event, inspect, text
 from sqlalchemy.ext.asyncio import create_async_engine, async_sessionmaker, AsyncSession
 from sqlalchemy.orm import DeclarativeBase
+from sqlalchemy.pool import AsyncAdaptedQueuePool
 
-DATABASE_URL = "sqlite+aiosqlite:///./finance.db"
+from .timeouts import install_budget_handler, attach_budget
 
-engine = create_async_engine(DATABASE_URL, echo=False)
-async_session = async_sessionmaker(engine, class_=AsyncSession, expire_on_commit=False)
+DATABASE_PATH = "./finance.db"
+
+READ_POOL_SIZE = 8
+READ_MAX_OVERFLOW = 8
+READ_CACHE_SIZE_KIB = 32 * 1024  # page cache per read connection
+
+# Closed years live in <database>.archive/<year>.db, attached as archive_<year> (see app.archive)
+ARCHIVE_REFERENCE = re.compile(r'\barchive_(\d{4})"?\.')
+ATTACHED_ARCHIVES_KEY = "attached_archives"
+MAX_ATTACHED_ARCHIVES = 10  # SQLite's default SQLITE_MAX_ATTACHED
+
+T = TypeVar("T")
+
+
+def _configure_write_connection(dbapi_connection, connection_record):
+    cursor = dbapi_connection.cursor()
+    cursor.execute("PRAGMA journal_mode=WAL")
+    cursor.close()
+
+
+def _configure_read_connection(dbapi_connection, connection_record):
+    cursor = dbapi_connection.cursor()
+    cursor.execute("PRAGMA query_only=ON")
+    cursor.execute(f"PRAGMA cache_size=-{READ_CACHE_SIZE_KIB}")
+    cursor.close()
+
+
+def archive_dir(database_path: str) -> str:
+    return os.path.splitext(database_path)[0] + ".archive"
+
+
+def archive_path(database_path: str, year: int) -> str:
+    return os.path.join(archive_dir(database_path), f"{year}.db")
+
+
+def archive_schema(year: int) -> str:
+    return f"archive_{year}"
+
+
+def _attach_archives(conn, cursor, statement, parameters, context, executemany):
+    """
+    Attach the yearly archives a statement refers to, on first use by its connection.
+
+    Attachments stay with the connection, so pooled read connections
+    attach each archive once. SQLite caps their number; archives the
+    statement does not need are detached first when there is no room
+    (DETACH is impossible inside a transaction, ATTACH is not).
+    """
+    if "archive_" not in statement:
+        return
+    years = {int(year) for year in ARCHIVE_REFERENCE.findall(statement)}
+    attached = conn.connection.info.setdefault(ATTACHED_ARCHIVES_KEY, set())
+    missing = years - attached
+    if not missing:
+        return
+
+    dbapi_connection = conn.connection.dbapi_connection
+    database_path = conn.engine.url.database
+    archive_cursor = dbapi_connection.cursor()
+    try:
+        excess = len(attached) + len(missing) - MAX_ATTACHED_ARCHIVES
+        if excess > 0 and not dbapi_connection.driver_connection.in_transaction:
+            for year in sorted(attached - years)[:excess]:
+                archive_cursor.execute(f"DETACH DATABASE {archive_schema(year)}")
+                attached.discard(year)
+        for year in sorted(missing):
+            archive_cursor.execute(f"ATTACH DATABASE ? AS {archive_schema(year)}", (archive_path(database_path, year),))
+            attached.add(year)
+    finally:
+        archive_cursor.close()
+
+
+class Shard:
+    """
+    One tenant's SQLite database: its engines, session factories and the
+    per-tenant instances of ShardLocal singletons.
+
+    Writes go through `engine` (NullPool, the aiosqlite default for files).
+    Analytics, list and export reads use `read_engine`, a pool of
+    query-only connections, so long scans never hold a connection a write
+    is waiting for. With the database in WAL mode they also read a
+    consistent snapshot without blocking the writer's commit, and the
+    pooled connections keep their page caches warm between requests.
+    """
+
+    def __init__(self, tenant: str, path: str):
+        self.tenant = tenant
+        self.path = path
+        url = f"sqlite+aiosqlite:///{path}"
+
+        self.engine = create_async_engine(url, echo=False)
+        self.read_engine = create_async_engine(
+            url,
+            echo=False,
+            poolclass=AsyncAdaptedQueuePool,
+            pool_size=READ_POOL_SIZE,
+            max_overflow=READ_MAX_OVERFLOW
+        )
+        event.listen(self.engine.sync_engine, "connect", _configure_write_connection)
+        event.listen(self.read_engine.sync_engine, "connect", _configure_read_connection)
+        event.listen(self.read_engine.sync_engine, "connect", install_budget_handler)
+        event.listen(self.read_engine.sync_engine, "before_cursor_execute", attach_budget)
+        for engine in (self.engine, self.read_engine):
+            event.listen(engine.sync_engine, "before_cursor_execute", _attach_archives)
+
+        self.session = async_sessionmaker(self.engine, class_=AsyncSession, expire_on_commit=False)
+        self.read_session = async_sessionmaker(self.read_engine, class_=AsyncSession, expire_on_commit=False)
+        self.locals: Dict["ShardLocal", Any] = {}
+
+    async def dispose(self):
+        await self.engine.dispose()
+        await self.read_engine.dispose()
+
+
+_current_shard: ContextVar[Optional[Shard]] = ContextVar("current_shard", default=None)
+
+
+def current_shard() -> Shard:
+    shard = _current_shard.get()
+    if shard is None:
+        raise RuntimeError("No tenant database selected for this context")
+    return shard
+
+
+def use_shard(shard: Shard):
+    """Route this context (and tasks created from it) to `shard`."""
+    _current_shard.set(shard)
+
+
+class ShardLocal(Generic[T]):
+    """
+    A module-level singleton that is really one instance per shard.
+
+    The instance for the current shard is created on first use; attribute
+    access is forwarded to it, so call sites read like a plain singleton.
+    """
+
+    def __init__(self, factory: Callable[[], T]):
+        self._factory = factory
+
+    def get(self) -> T:
+        shard = current_shard()
+        instance = shard.locals.get(self)
+        if instance is None:
+            instance = shard.locals[self] = self._factory()
+        return instance
+
+    def peek(self, shard: Shard) -> Optional[T]:
+        """The shard's instance, if it was ever created."""
+        return shard.locals.get(self)
+
+    def __getattr__(self, name: str):
+        return getattr(self.get(), name)
+
+
+def async_session() -> AsyncSession:
+    return current_shard().session()
+
+
+def read_session() -> AsyncSession:
+    return current_shard().read_session()
 
 
 class Base(DeclarativeBase):
@@ -16,6 +184,79 @@ async def get_db():
         yield session
 
 
+async def get_read_db():
+    """Session on the read-only pool, for endpoints that never write."""
+    async with read_session() as session:
+        yield session
+
+
+async def _on_read_session(read: Callable[[AsyncSession], Awaitable[Any]]) -> Any:
+    async with read_session() as session:
+        return await read(session)
+
+
+async def fan_out(*reads: Callable[[AsyncSession], Awaitable[Any]]) -> List[Any]:
+    """
+    Run independent reads concurrently, each on its own read-pool session.
+
+    Every read is called with a fresh session and results come back in
+    argument order. Each session reads its own snapshot, so only combine
+    reads that need not agree to the same commit; reads that must (say a
+    checkpoint and the entries after it) belong inside one callable.
+    """
+    return list(await asyncio.gather(*(_on_read_session(read) for read in reads)))
+
+
+async def fan_out_scalars(*statements) -> List[Any]:
+    """fan_out for single-value SELECTs: the scalar result of each statement."""
+
+    def scalar_of(statement):
+        async def read(session: AsyncSession):
+            return (await session.execute(statement)).scalar()
+        return read
+
+    return await fan_out(*(scalar_of(statement) for statement in statements))
+
+
+def _sql_literal(value) -> str:
+    if isinstance(value, enum.Enum):
+        value = value.value
+    if isinstance(value, bool):
+        return str(int(value))
+    if isinstance(value, (int, float, Decimal)):
+        return str(value)
+    return "'" + str(value).replace("'", "''") + "'"
+
+
+def upgrade_schema(conn):
+    """
+    Bring tables created by an older version up to date.
+
+    create_all only creates missing tables, so columns and indexes added to
+    existing models later are applied here. Only additive changes are
+    supported: new columns get their scalar default (or NULL) for old rows.
+    """
+    inspector = inspect(conn)
+    for table in Base.metadata.sorted_tables:
+        existing = {c["name"] for c in inspector.get_columns(table.name)}
+        for column in table.columns:
+            if column.name in existing:
+                continue
+            ddl = f"ALTER TABLE {table.name} ADD COLUMN {column.name} {column.type.compile(conn.dialect)}"
+            if column.default is not None and column.default.is_scalar:
+                if not column.nullable:
+                    ddl += " NOT NULL"
+                ddl += f" DEFAULT {_sql_literal(column.default.arg)}"
+            conn.execute(text(ddl))
+
+        for index in table.indexes:
+            index.create(conn, checkfirst=True)
+
+
 async def init_db():
-    async with engine.begin() as conn:
+    async with current_shard().engine.begin() as conn:
+        # Take the write lock before inspecting the schema, so processes
+        # opening the same new database at once create it only once
+        await conn.execute(text("BEGIN IMMEDIATE"))
         await conn.run_sync(Base.metadata.create_all)
+        await conn.run_sync(upgrade_schema)
@@ -0,0 +1,211 @@
+import asyncio
+import json
+import os
+from dataclasses import dataclass
+from decimal import Decimal
+from typing import Dict, Optional, Set
+
+from sqlalchemy import event, select, insert, delete, func
+from sqlalchemy.exc import OperationalError
+from sqlalchemy.orm import Session
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from .database import read_session, ShardLocal
+from .models import ChangeEventRecord
+
+PENDING_EVENTS_KEY = "pending_change_events"
+
+RELAY_INTERVAL = 0.5
+CHANGE_EVENT_RETENTION = 10000  # rows kept in change_events for relays that fall behind
+
+
+@dataclass
+class ChangeEvent:
+    entity: str
+    id: Optional[int]
+    op: str  # "create", "update", "delete" or "resync"
+    balance: Optional[Decimal] = None
+    accounts: Optional[Dict[int, Decimal]] = None
+    seq: int = 0
+
+    def to_json(self) -> str:
+        payload = {"entity": self.entity, "id": self.id, "op": self.op}
+        if self.balance is not None:
+            payload["balance"] = str(self.balance)
+        if self.accounts:
+            payload["accounts"] = {str(k): str(v) for k, v in self.accounts.items()}
+        return json.dumps(payload, separators=(",", ":"))
+
+    @classmethod
+    def from_json(cls, data: str) -> "ChangeEvent":
+        payload = json.loads(data)
+        balance = payload.get("balance")
+        accounts = payload.get("accounts")
+        return cls(
+            entity=payload["entity"],
+            id=payload["id"],
+            op=payload["op"],
+            balance=Decimal(balance) if balance is not None else None,
+            accounts={int(k): Decimal(v) for k, v in accounts.items()} if accounts else None
+        )
+
+
+class Subscription:
+    """
+    One client's bounded event queue.
+
+    When a subscriber falls behind and its queue fills up, further events are
+    dropped instead of blocking writers; the subscriber then receives a single
+    "resync" event telling it to refetch rather than patch.
+    """
+
+    def __init__(self, maxsize: int):
+        self.queue: asyncio.Queue = asyncio.Queue(maxsize=maxsize)
+        self.overflowed = False
+
+    def offer(self, change: ChangeEvent):
+        if self.overflowed:
+            return
+        try:
+            self.queue.put_nowait(change)
+        except asyncio.QueueFull:
+            self.overflowed = True
+
+    async def get(self) -> ChangeEvent:
+        if self.overflowed:
+            while not self.queue.empty():
+                self.queue.get_nowait()
+            self.overflowed = False
+            return ChangeEvent(entity="*", id=None, op="resync")
+        return await self.queue.get()
+
+
+class EventBroker:
+    """In-process fan-out of committed changes to SSE subscribers."""
+
+    def __init__(self, queue_size: int = 256):
+        self.queue_size = queue_size
+        self.subscribers: Set[Subscription] = set()
+        self._seq = 0
+
+    def subscribe(self) -> Subscription:
+        subscription = Subscription(self.queue_size)
+        self.subscribers.add(subscription)
+        return subscription
+
+    def unsubscribe(self, subscription: Subscription):
+        self.subscribers.discard(subscription)
+
+    def publish(self, change: ChangeEvent):
+        self._seq += 1
+        change.seq = self._seq
+        for subscription in self.subscribers:
+            subscription.offer(change)
+
+
+broker = ShardLocal(EventBroker)
+
+
+def record_change(
+    db: AsyncSession,
+    entity: str,
+    id: Optional[int],
+    op: str,
+    balance: Optional[Decimal] = None,
+    accounts: Optional[Dict[int, Decimal]] = None
+):
+    """Queue a change event on the session; it is published only if the session commits."""
+    db.info.setdefault(PENDING_EVENTS_KEY, []).append(
+        ChangeEvent(entity=entity, id=id, op=op, balance=balance, accounts=accounts)
+    )
+
+
+# Session commit and rollback events also fire for SAVEPOINTs; only the outermost transaction counts
+
+
+@event.listens_for(Session, "before_commit")
+def _store_pending(session: Session):
+    # Stored in the committing transaction, so other workers relay exactly the committed events
+    changes = session.info.get(PENDING_EVENTS_KEY)
+    if not changes or session.in_nested_transaction():
+        return
+    conn = session.connection()
+    conn.execute(insert(ChangeEventRecord), [{"origin": os.getpid(), "payload": c.to_json()} for c in changes])
+    newest = select(func.max(ChangeEventRecord.id)).scalar_subquery()
+    conn.execute(delete(ChangeEventRecord).where(ChangeEventRecord.id <= newest - CHANGE_EVENT_RETENTION))
+
+
+@event.listens_for(Session, "after_commit")
+def _publish_pending(session: Session):
+    if session.in_nested_transaction():
+        return
+    for change in session.info.pop(PENDING_EVENTS_KEY, []):
+        broker.publish(change)
+
+
+@event.listens_for(Session, "after_transaction_end")
+def _discard_pending(session: Session, transaction):
+    # Anything still pending when the outermost transaction ends was rolled back
+    if transaction.parent is None:
+        session.info.pop(PENDING_EVENTS_KEY, None)
+
+
+class EventRelay:
+    """
+    Publishes change events committed by other worker processes.
+
+    Every process stores its committed events in change_events; the relay
+    polls that table while this process has subscribers and publishes the
+    rows that originated elsewhere. If it fell so far behind that rows were
+    pruned, subscribers get a resync instead.
+    """
+
+    def __init__(self):
+        self._task: Optional[asyncio.Task] = None
+        self._last_id: Optional[int] = None
+
+    def start(self):
+        if self._task is None or self._task.done():
+            self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+    async def _run(self):
+        while True:
+            await asyncio.sleep(RELAY_INTERVAL)
+            if not broker.subscribers:
+                self._last_id = None
+                continue
+            try:
+                await self.poll()
+            except OperationalError:
+                continue  # busy or interrupted; the next poll picks the rows up
+
+    async def poll(self):
+        async with read_session() as db:
+            if self._last_id is None:
+                self._last_id = (await db.execute(select(func.max(ChangeEventRecord.id)))).scalar() or 0
+                return
+            result = await db.execute(
+                select(ChangeEventRecord).where(ChangeEventRecord.id > self._last_id).order_by(ChangeEventRecord.id)
+            )
+            records = result.scalars().all()
+
+        if records and records[0].id > self._last_id + 1:
+            broker.publish(ChangeEvent(entity="*", id=None, op="resync"))
+        pid = os.getpid()
+        for record in records:
+            if record.origin != pid:
+                broker.publish(ChangeEvent.from_json(record.payload))
+        if records:
+            self._last_id = records[-1].id
+
+
+event_relay = ShardLocal(EventRelay)
@@ -0,0 +1,368 @@
+"""
+Columnar bulk export of the ledger as Arrow IPC streams or Parquet files.
+
+Rows are streamed from SQLite in chunks and turned into record batches
+straight from the raw column values: dates and timestamps are selected
+untyped and amounts as integer cents, all converted by Arrow compute
+kernels (amounts never pass through a float), and names are
+dictionary-encoded against tables loaded once per export. No ORM objects
+are built.
+
+Usage from the backend directory:
+
+    python -m app.export transactions transactions.parquet --tenant default
+    python -m app.export transfers transfers.arrow --format arrow --tenant household-2
+"""
+import argparse
+import asyncio
+import enum
+import os
+from datetime import date
+from decimal import Decimal
+from typing import AsyncIterator, Awaitable, Callable, Dict, List, Optional, Sequence
+
+import pyarrow as pa
+import pyarrow.compute as pc
+import pyarrow.parquet as pq
+from sqlalchemy import select, func, cast, type_coerce, Integer, String
+from sqlalchemy.ext.asyncio import AsyncConnection
+
+from .database import current_shard
+from .models import Transaction, Transfer, GoalContribution, Category, Account, Goal
+from .archive import history
+
+EXPORT_CHUNK_ROWS = 50_000
+
+AMOUNT_TYPE = pa.decimal128(12, 2)
+CENTS_TYPE = pa.decimal128(19, 0)  # every int64 fits
+ONE_CENT = pa.scalar(Decimal("0.01"), pa.decimal128(3, 2))
+NAME_DICT_TYPE = pa.dictionary(pa.int32(), pa.string())
+
+
+class ExportFormat(str, enum.Enum):
+    arrow = "arrow"
+    parquet = "parquet"
+
+
+class ExportDataset(str, enum.Enum):
+    transactions = "transactions"
+    transfers = "transfers"
+    goal_contributions = "goal_contributions"
+
+
+def _cents(amount):
+    """SELECT expression for an amount as integer cents, exact for the REAL values SQLite stores."""
+    return cast(func.round(amount * 100), Integer)
+
+
+def _amounts(cents: Sequence[Optional[int]]) -> pa.Array:
+    # Exact decimal arithmetic: cents x 0.01 has scale 2 and the cast only checks the precision
+    return pc.multiply(pa.array(cents, pa.int64()).cast(CENTS_TYPE), ONE_CENT).cast(AMOUNT_TYPE)
+
+
+def _dates(values: Sequence[Optional[str]]) -> pa.Array:
+    return pa.array(values, pa.string()).cast(pa.timestamp("s")).cast(pa.date32())
+
+
+def _timestamps(values: Sequence[Optional[str]]) -> pa.Array:
+    return pa.array(values, pa.string()).cast(pa.timestamp("us"))
+
+
+class _NameDictionary:
+    """Fixed id -> name dictionary shared by every batch, so dictionary-encoded columns stay stable."""
+
+    def __init__(self, rows):
+        ids, names = zip(*rows) if rows else ((), ())
+        self.ids = pa.array(ids, pa.int64())
+        self.names = pa.array(names, pa.string())
+
+    def encode(self, ids: pa.Array) -> pa.DictionaryArray:
+        indices = pc.index_in(ids, value_set=self.ids).cast(pa.int32())
+        return pa.DictionaryArray.from_arrays(indices, self.names)
+
+
+class _DatasetSpec:
+    """Export of one dataset; `model` is the model read from, or its history() alias."""
+
+    def __init__(self, model, schema: pa.Schema, query, build: Callable[[List[tuple], Dict[str, _NameDictionary]], List[pa.Array]]):
+        self.model = model
+        self.schema = schema
+        self.query = query
+        self.build = build
+
+
+def _transactions_spec(source=Transaction) -> _DatasetSpec:
+    schema = pa.schema([
+        ("id", pa.int64()),
+        ("date", pa.date32()),
+        ("type", NAME_DICT_TYPE),
+        ("amount", AMOUNT_TYPE),
+        ("category_id", pa.int64()),
+        ("category", NAME_DICT_TYPE),
+        ("account_id", pa.int64()),
+        ("account", NAME_DICT_TYPE),
+        ("description", pa.string()),
+        ("created_at", pa.timestamp("us")),
+    ])
+    query = select(
+        source.id,
+        type_coerce(source.date, String),
+        type_coerce(source.type, String),
+        _cents(source.amount),
+        source.category_id,
+        source.account_id,
+        source.description,
+        type_coerce(source.created_at, String),
+    ).order_by(source.id)
+
+    def build(cols, dicts):
+        category_ids = pa.array(cols[4], pa.int64())
+        account_ids = pa.array(cols[5], pa.int64())
+        return [
+            pa.array(cols[0], pa.int64()),
+            _dates(cols[1]),
+            pa.array(cols[2], pa.string()).dictionary_encode(),
+            _amounts(cols[3]),
+            category_ids,
+            dicts["categories"].encode(category_ids),
+            account_ids,
+            dicts["accounts"].encode(account_ids),
+            pa.array(cols[6], pa.string()),
+            _timestamps(cols[7]),
+        ]
+
+    return _DatasetSpec(source, schema, query, build)
+
+
+def _transfers_spec(source=Transfer) -> _DatasetSpec:
+    schema = pa.schema([
+        ("id", pa.int64()),
+        ("date", pa.date32()),
+        ("amount", AMOUNT_TYPE),
+        ("from_account_id", pa.int64()),
+        ("from_account", NAME_DICT_TYPE),
+        ("to_account_id", pa.int64()),
+        ("to_account", NAME_DICT_TYPE),
+        ("note", pa.string()),
+        ("created_at", pa.timestamp("us")),
+    ])
+    query = select(
+        source.id,
+        type_coerce(source.date, String),
+        _cents(source.amount),
+        source.from_account_id,
+        source.to_account_id,
+        source.note,
+        type_coerce(source.created_at, String),
+    ).order_by(source.id)
+
+    def build(cols, dicts):
+        from_ids = pa.array(cols[3], pa.int64())
+        to_ids = pa.array(cols[4], pa.int64())
+        return [
+            pa.array(cols[0], pa.int64()),
+            _dates(cols[1]),
+            _amounts(cols[2]),
+            from_ids,
+            dicts["accounts"].encode(from_ids),
+            to_ids,
+            dicts["accounts"].encode(to_ids),
+            pa.array(cols[5], pa.string()),
+            _timestamps(cols[6]),
+        ]
+
+    return _DatasetSpec(source, schema, query, build)
+
+
+def _goal_contributions_spec(source=GoalContribution) -> _DatasetSpec:
+    schema = pa.schema([
+        ("id", pa.int64()),
+        ("date", pa.date32()),
+        ("amount", AMOUNT_TYPE),
+        ("goal_id", pa.int64()),
+        ("goal", NAME_DICT_TYPE),
+        ("note", pa.string()),
+        ("created_at", pa.timestamp("us")),
+    ])
+    query = select(
+        source.id,
+        type_coerce(source.date, String),
+        _cents(source.amount),
+        source.goal_id,
+        source.note,
+        type_coerce(source.created_at, String),
+    ).order_by(source.id)
+
+    def build(cols, dicts):
+        goal_ids = pa.array(cols[3], pa.int64())
+        return [
+            pa.array(cols[0], pa.int64()),
+            _dates(cols[1]),
+            _amounts(cols[2]),
+            goal_ids,
+            dicts["goals"].encode(goal_ids),
+            pa.array(cols[4], pa.string()),
+            _timestamps(cols[5]),
+        ]
+
+    return _DatasetSpec(source, schema, query, build)
+
+
+DATASETS = {
+    ExportDataset.transactions: _transactions_spec,
+    ExportDataset.transfers: _transfers_spec,
+    ExportDataset.goal_contributions: _goal_contributions_spec,
+}
+
+
+def export_schema(dataset: ExportDataset) -> pa.Schema:
+    return DATASETS[dataset]().schema
+
+
+async def _load_dictionaries(conn: AsyncConnection) -> Dict[str, _NameDictionary]:
+    dicts = {}
+    for key, model in (("categories", Category), ("accounts", Account), ("goals", Goal)):
+        result = await conn.execute(select(model.id, model.name).order_by(model.id))
+        dicts[key] = _NameDictionary(result.all())
+    return dicts
+
+
+def _filtered(query, model, start_date: Optional[date], end_date: Optional[date]):
+    if start_date:
+        query = query.where(model.date >= start_date)
+    if end_date:
+        query = query.where(model.date <= end_date)
+    return query
+
+
+async def count_rows(
+    dataset: ExportDataset,
+    start_date: Optional[date] = None,
+    end_date: Optional[date] = None
+) -> int:
+    model = await history(DATASETS[dataset]().model, start_date, end_date)
+    async with current_shard().read_engine.connect() as conn:
+        query = _filtered(select(func.count(model.id)), model, start_date, end_date)
+        return (await conn.execute(query)).scalar()
+
+
+async def iter_record_batches(
+    dataset: ExportDataset,
+    start_date: Optional[date] = None,
+    end_date: Optional[date] = None,
+    chunk_rows: int = EXPORT_CHUNK_ROWS
+) -> AsyncIterator[pa.RecordBatch]:
+    """Record batches of at most `chunk_rows` rows, read with a server-side cursor."""
+    spec = DATASETS[dataset](await history(DATASETS[dataset]().model, start_date, end_date))
+    query = _filtered(spec.query, spec.model, start_date, end_date)
+
+    async with current_shard().read_engine.connect() as conn:
+        dicts = await _load_dictionaries(conn)
+        result = await conn.stream(query.execution_options(yield_per=chunk_rows))
+        async for rows in result.partitions(chunk_rows):
+            # sqlite3 hands rows over as tuples; one transpose per batch, then Arrow takes each column as is
+            columns = list(zip(*rows))
+            yield pa.RecordBatch.from_arrays(spec.build(columns, dicts), schema=spec.schema)
+
+
+class _ChunkSink:
+    """Minimal writable file object that hands back whatever was written since the last take()."""
+
+    def __init__(self):
+        self._chunks: List[bytes] = []
+        self.closed = False
+
+    def write(self, data) -> int:
+        self._chunks.append(bytes(data))
+        return len(data)
+
+    def flush(self):
+        pass
+
+    def close(self):
+        self.closed = True
+
+    def take(self) -> bytes:
+        data = b"".join(self._chunks)
+        self._chunks.clear()
+        return data
+
+
+async def stream_arrow(
+    dataset: ExportDataset,
+    start_date: Optional[date] = None,
+    end_date: Optional[date] = None
+) -> AsyncIterator[bytes]:
+    """Arrow IPC stream bytes, one chunk per record batch."""
+    sink = _ChunkSink()
+    writer = pa.ipc.new_stream(sink, export_schema(dataset))
+    async for batch in iter_record_batches(dataset, start_date, end_date):
+        writer.write_batch(batch)
+        yield sink.take()
+    writer.close()
+    yield sink.take()
+
+
+async def write_export(
+    dataset: ExportDataset,
+    path: str,
+    format: ExportFormat,
+    start_date: Optional[date] = None,
+    end_date: Optional[date] = None,
+    on_batch: Optional[Callable[[int], Awaitable[None]]] = None
+) -> int:
+    """
+    Write a full export to `path` and return the number of rows written.
+
+    `on_batch` is awaited with the running row count after every batch.
+    """
+    schema = export_schema(dataset)
+    rows = 0
+    if format == ExportFormat.parquet:
+        writer = pq.ParquetWriter(path, schema)
+    else:
+        writer = pa.ipc.new_stream(path, schema)
+    try:
+        async for batch in iter_record_batches(dataset, start_date, end_date):
+            writer.write_batch(batch)
+            rows += batch.num_rows
+            if on_batch is not None:
+                await on_batch(rows)
+    finally:
+        writer.close()
+    return rows
+
+
+def main():
+    # Imported here because app.shards imports the job handlers, which import this module
+    from .shards import TENANT_NAME, OpenShard, shard_path
+
+    parser = argparse.ArgumentParser(description="Export ledger tables as Arrow IPC or Parquet")
+    parser.add_argument("dataset", choices=[d.value for d in ExportDataset])
+    parser.add_argument("path")
+    parser.add_argument("--tenant", required=True, help="tenant whose database to export")
+    parser.add_argument("--format", choices=[f.value for f in ExportFormat], default=ExportFormat.parquet.value)
+    parser.add_argument("--start-date", type=date.fromisoformat)
+    parser.add_argument("--end-date", type=date.fromisoformat)
+    args = parser.parse_args()
+    if not TENANT_NAME.match(args.tenant):
+        parser.error(f"invalid tenant name: {args.tenant!r}")
+    if not os.path.exists(shard_path(args.tenant)):
+        parser.error(f"no database for tenant {args.tenant!r} at {shard_path(args.tenant)}")
+
+    async def export_tenant() -> int:
+        # Routed to the tenant's shard like a request, without starting its background tasks
+        entry = OpenShard(args.tenant)
+        try:
+            return await entry.run(write_export(
+                ExportDataset(args.dataset), args.path, ExportFormat(args.format), args.start_date, args.end_date
+            ))
+        finally:
+            await entry.shard.dispose()
+
+    rows = asyncio.run(export_tenant())
+    print(f"Exported {rows} rows to {args.path}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,90 @@
+from typing import Any, Dict, Iterable, List, Mapping, Optional, Sequence, Set
+
+from fastapi import HTTPException, status
+from pydantic import BaseModel
+
+from .serialization import json_value
+
+
+def _split(value: Optional[str]) -> List[str]:
+    if not value:
+        return []
+    return [part.strip() for part in value.split(",") if part.strip()]
+
+
+class Fieldset:
+    """
+    Parsed `fields=` / `expand=` selection for a list endpoint.
+
+    `fields` names top-level columns and may reach into an expandable
+    relation with a dotted name (`category.name`); `expand` names relations
+    to embed in full. If only `expand` is given, every column is returned.
+    Relations that are neither expanded nor referenced are left out, and
+    `id` is always included.
+    """
+
+    def __init__(self, columns: List[str], relations: Dict[str, Optional[Set[str]]]):
+        self.columns = columns
+        self.relations = relations  # relation name -> subfields, None for the whole object
+
+    @classmethod
+    def parse(
+        cls,
+        fields: Optional[str],
+        expand: Optional[str],
+        columns: Sequence[str],
+        relations: Sequence[str]
+    ) -> Optional["Fieldset"]:
+        """Returns None when neither parameter is given, meaning the full default response."""
+        if fields is None and expand is None:
+            return None
+
+        selected: List[str] = []
+        subfields: Dict[str, Optional[Set[str]]] = {}
+        unknown: List[str] = []
+
+        for name in _split(fields):
+            relation, _, attr = name.partition(".")
+            if attr and relation in relations:
+                if subfields.get(relation, set()) is not None:
+                    subfields.setdefault(relation, set()).add(attr)
+            elif name in columns:
+                if name not in selected:
+                    selected.append(name)
+            else:
+                unknown.append(name)
+
+        for relation in _split(expand):
+            if relation in relations:
+                subfields[relation] = None
+            else:
+                unknown.append(relation)
+
+        if unknown:
+            raise HTTPException(
+                status_code=status.HTTP_400_BAD_REQUEST,
+                detail=f"Unknown fields: {', '.join(unknown)}"
+            )
+
+        if fields is None:
+            selected = list(columns)
+        return cls(["id"] + [c for c in selected if c != "id"], subfields)
+
+    def wants(self, name: str) -> bool:
+        return name in self.columns or name in self.relations
+
+    def wants_any(self, names: Iterable[str]) -> bool:
+        return any(self.wants(name) for name in names)
+
+    def select_columns(self, model, required: Iterable[str] = ()) -> list:
+        """Mapped attributes to SELECT: requested columns that exist on the model, plus `required`."""
+        names = [c for c in self.columns if hasattr(model, c)]
+        names += [c for c in required if c not in names]
+        return [getattr(model, name) for name in names]
+
+    def project(self, values: Mapping[str, Any], related: Mapping[str, Optional[BaseModel]]) -> Dict[str, Any]:
+        item = {name: json_value(values[name]) for name in self.columns}
+        for name, attrs in self.relations.items():
+            obj = related.get(name)
+            item[name] = None if obj is None else obj.model_dump(mode="json", include=attrs)
+        return item
@@ -0,0 +1,138 @@
+import os
+import sqlite3
+from collections import OrderedDict
+from typing import Any, Awaitable, Callable, Dict, Hashable, Iterable, Optional, Set, Tuple
+
+from sqlalchemy import event
+from sqlalchemy.dialects.sqlite import insert
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy.orm import Session
+
+from .database import ShardLocal, current_shard
+from .models import WriteGeneration
+
+PENDING_TABLES_KEY = "pending_write_tables"
+
+
+class WriteGenerations:
+    """
+    Per-table counters bumped every time a commit writes to the table.
+
+    Derived results (analytics, forecasts, matrices) remember the
+    generations of the tables they were computed from and are reused
+    until one of those tables is written again.
+
+    The counters live in the write_generations table and are bumped inside
+    the writing transaction, so every worker process sees the same values
+    and a cache in one worker is invalidated by a write served by another.
+    Each process keeps a copy and re-reads it only when SQLite's
+    data_version shows that some connection has committed since the last
+    look. Both statements run on a small dedicated connection; in WAL mode
+    they never wait for the writer, so they are cheap enough to run on the
+    event loop for every lookup.
+    """
+
+    def __init__(self):
+        self.path = current_shard().path
+        self._counters: Dict[str, int] = {}
+        self._conn: Optional[sqlite3.Connection] = None
+        self._pid: Optional[int] = None
+        self._data_version: Optional[int] = None
+
+    def _connection(self) -> sqlite3.Connection:
+        # A worker forked from a preloaded master must not reuse the master's connection
+        if self._conn is None or self._pid != os.getpid():
+            self._conn = sqlite3.connect(self.path, isolation_level=None, check_same_thread=False)
+            self._conn.execute("PRAGMA query_only=ON")
+            self._pid = os.getpid()
+            self._data_version = None
+        return self._conn
+
+    def close(self):
+        if self._conn is not None and self._pid == os.getpid():
+            self._conn.close()
+        self._conn = None
+
+    def refresh(self):
+        conn = self._connection()
+        data_version = conn.execute("PRAGMA data_version").fetchone()[0]
+        if data_version == self._data_version:
+            return
+        self._data_version = data_version
+        self._counters = dict(conn.execute("SELECT table_name, generation FROM write_generations"))
+
+    def current(self, tables: Iterable[str]) -> Tuple[int, ...]:
+        self.refresh()
+        return tuple(self._counters.get(table, 0) for table in tables)
+
+
+generations = ShardLocal(WriteGenerations)
+
+
+def mark_written(db: AsyncSession, *tables: str):
+    """Record writes that bypass the ORM unit of work (bulk UPDATE/DELETE, INSERT ... SELECT)."""
+    db.info.setdefault(PENDING_TABLES_KEY, set()).update(tables)
+
+
+def _bump_shared(session: Session, tables: Set[str]):
+    statement = insert(WriteGeneration).values([{"table_name": table, "generation": 1} for table in sorted(tables)])
+    session.connection().execute(statement.on_conflict_do_update(
+        index_elements=[WriteGeneration.table_name],
+        set_={"generation": WriteGeneration.generation + 1}
+    ))
+
+
+@event.listens_for(Session, "after_flush")
+def _bump_written_tables(session: Session, flush_context):
+    tables = session.info.pop(PENDING_TABLES_KEY, set())
+    for obj in (*session.new, *session.dirty, *session.deleted):
+        table = getattr(obj, "__tablename__", None)
+        if table:
+            tables.add(table)
+    if tables:
+        _bump_shared(session, tables)
+
+
+@event.listens_for(Session, "before_commit")
+def _bump_marked_tables(session: Session):
+    # Tables marked after the last flush; the commit's own flush is covered by after_flush
+    tables = session.info.pop(PENDING_TABLES_KEY, None)
+    if tables:
+        _bump_shared(session, tables)
+
+
+@event.listens_for(Session, "after_rollback")
+def _discard_written_tables(session: Session):
+    session.info.pop(PENDING_TABLES_KEY, None)
+
+
+class GenerationCache:
+    """Small LRU of computed values, each valid while its source tables keep the same generations."""
+
+    def __init__(self, maxsize: int = 128):
+        self.maxsize = maxsize
+        self._entries: "OrderedDict[Hashable, Tuple[Tuple[int, ...], Any]]" = OrderedDict()
+
+    async def get_or_compute(
+        self,
+        key: Hashable,
+        tables: Tuple[str, ...],
+        compute: Callable[[], Awaitable[Any]]
+    ) -> Any:
+        # Take the generation before computing, so a write that lands
+        # meanwhile leaves the entry stale rather than hiding the write
+        generation = generations.current(tables)
+        entry = self._entries.get(key)
+        if entry is not None and entry[0] == generation:
+            self._entries.move_to_end(key)
+            return entry[1]
+
+        value = await compute()
+        self._entries[key] = (generation, value)
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.maxsize:
+            self._entries.popitem(last=False)
+        return value
+
+    def clear(self):
+        self._entries.clear()
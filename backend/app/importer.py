@@ -0,0 +1,81 @@
+"""
+CSV parsing for transaction imports.
+
+Runs in a worker process, so it only depends on the standard library and
+returns plain tuples; category and account names are resolved to ids by
+the caller. Expected columns (header names are case-insensitive):
+
+    date, amount, category           required
+    type, account, description       optional
+
+Without a type column the sign decides: negative amounts are expenses.
+"""
+import csv
+from datetime import date
+from decimal import Decimal, InvalidOperation
+from typing import Dict, List, Optional, Tuple
+
+REQUIRED_COLUMNS = ("date", "amount", "category")
+TRANSACTION_TYPES = ("income", "expense")
+
+# (line, ISO date, amount, type, category, account, description)
+ParsedRow = Tuple[int, str, str, str, str, Optional[str], Optional[str]]
+
+CENTS = Decimal("0.01")
+
+
+def _parse_row(values: Dict[str, str]) -> Tuple[str, str, str, str, Optional[str], Optional[str]]:
+    try:
+        day = date.fromisoformat(values.get("date", ""))
+    except ValueError:
+        raise ValueError(f"Invalid date: {values.get('date')!r}")
+
+    try:
+        amount = Decimal(values.get("amount", "").replace(",", ""))
+        # Rounded before the zero check, so sub-cent amounts are rejected rather than imported as 0.00
+        if amount.is_finite():
+            amount = amount.quantize(CENTS)
+    except InvalidOperation:
+        raise ValueError(f"Invalid amount: {values.get('amount')!r}")
+    if not amount.is_finite() or amount == 0:
+        raise ValueError(f"Invalid amount: {values.get('amount')!r}")
+
+    type = values.get("type", "").lower()
+    if not type:
+        type = "expense" if amount < 0 else "income"
+    elif type not in TRANSACTION_TYPES:
+        raise ValueError(f"Invalid type: {values['type']!r}")
+
+    if not values.get("category"):
+        raise ValueError("Missing category")
+
+    return (
+        day.isoformat(),
+        str(abs(amount)),
+        type,
+        values["category"],
+        values.get("account") or None,
+        values.get("description") or None,
+    )
+
+
+def parse_transactions_csv(path: str) -> Tuple[List[ParsedRow], List[Dict]]:
+    """Parse the file at `path` into rows plus a list of {"line", "error"} for the rows that were skipped."""
+    rows: List[ParsedRow] = []
+    errors: List[Dict] = []
+    with open(path, newline="", encoding="utf-8-sig") as f:
+        reader = csv.reader(f)
+        header = [name.strip().lower() for name in next(reader, [])]
+        missing = [name for name in REQUIRED_COLUMNS if name not in header]
+        if missing:
+            raise ValueError(f"Missing columns: {', '.join(missing)}")
+
+        for values in reader:
+            if not any(v.strip() for v in values):
+                continue
+            line = reader.line_num
+            try:
+                rows.append((line, *_parse_row({k: v.strip() for k, v in zip(header, values)})))
+            except ValueError as exc:
+                errors.append({"line": line, "error": str(exc)})
+    return rows, errors
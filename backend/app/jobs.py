@@ -0,0 +1,443 @@
+"""
+Durable background jobs for work too long for a request: CSV imports,
+full exports, recomputing goal totals and closing years.
+
+Jobs are rows in the jobs table, so they outlive the process. Workers
+claim the oldest queued job with a single UPDATE ... RETURNING and store
+the outcome when the handler returns. A runner that stops puts its
+running jobs back in the queue, and jobs still marked running at startup
+(left by a crash) are queued again; either way they resume from their
+stored progress, possibly in another worker process.
+Handlers report progress as they go, which is also how they learn that
+cancellation was requested. CPU-bound parsing runs in a process pool so
+the event loop keeps serving requests.
+"""
+import asyncio
+import json
+import multiprocessing
+import os
+from concurrent.futures import ProcessPoolExecutor
+from datetime import date, datetime
+from decimal import Decimal
+from typing import Any, Awaitable, Callable, Dict, Iterable, List, Optional, Set
+
+from sqlalchemy import select, update, func, text
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from .database import async_session, current_shard, ShardLocal
+from .models import Job, JobKind, JobStatus, Transaction, TransactionType, Goal, GoalContribution
+from .cache import reference_cache
+from .write_queue import BalanceState, write_queue
+from .importer import parse_transactions_csv
+from .export import ExportDataset, ExportFormat, count_rows, write_export
+from .archive import archive_year, history, load_closed_years, mark_years_closed
+from .checkpoints import add_missing_checkpoints, last_closed_month_end
+
+JOBS_DIR = "./jobs"  # one subdirectory per tenant
+CPU_WORKERS = 2
+
+# How often idle workers look for jobs queued by another process
+POLL_INTERVAL = 5.0
+
+IMPORT_CHUNK_ROWS = 500
+
+# Pause between import chunks. Writers outside the write queue wait for the
+# lock in SQLite's busy handler, which sleeps up to 100 ms between retries;
+# without a longer gap back-to-back chunks would starve them.
+IMPORT_CHUNK_PAUSE = 0.15
+
+# Skipped and rejected rows listed in a job result; the counts are always exact
+MAX_REPORTED_ROWS = 100
+
+CENTS = Decimal("0.01")
+
+FINISHED_STATUSES = (JobStatus.succeeded, JobStatus.failed, JobStatus.cancelled)
+
+_process_pool: Optional[ProcessPoolExecutor] = None
+
+
+def get_process_pool() -> ProcessPoolExecutor:
+    """The process pool for CPU work, shared by the job runners of all tenants."""
+    global _process_pool
+    if _process_pool is None:
+        # spawn rather than fork: the parent has the event loop and SQLite threads running
+        _process_pool = ProcessPoolExecutor(max_workers=CPU_WORKERS, mp_context=multiprocessing.get_context("spawn"))
+    return _process_pool
+
+
+def shutdown_process_pool():
+    global _process_pool
+    if _process_pool is not None:
+        _process_pool.shutdown(wait=False, cancel_futures=True)
+        _process_pool = None
+
+
+def jobs_dir() -> str:
+    """Where the current tenant's job inputs and artifacts are stored."""
+    return os.path.abspath(os.path.join(JOBS_DIR, current_shard().tenant))
+
+
+class JobCancelled(Exception):
+    pass
+
+
+class JobContext:
+    """What a handler gets: its parameters, the stored progress to resume from and ways to report."""
+
+    def __init__(self, job: Job):
+        self.job_id = job.id
+        self.params: Dict[str, Any] = json.loads(job.params)
+        self.processed = job.processed
+        self.result: Dict[str, Any] = json.loads(job.result) if job.result else {}
+        self.artifact_path: Optional[str] = None
+        self.cancel_requested = False
+
+    def path(self, suffix: str) -> str:
+        return os.path.join(jobs_dir(), f"job-{self.job_id}{suffix}")
+
+    async def run_cpu(self, fn: Callable, *args) -> Any:
+        return await asyncio.get_running_loop().run_in_executor(get_process_pool(), fn, *args)
+
+    async def report(
+        self,
+        processed: int,
+        total: Optional[int] = None,
+        result: Optional[Dict[str, Any]] = None,
+        db: Optional[AsyncSession] = None
+    ):
+        """
+        Store progress (and the result so far) and pick up a cancellation request.
+
+        Pass `db` to make the update part of that session's transaction, so
+        the progress commits together with the work it describes.
+        """
+        values = {"processed": processed, "result": json.dumps(result if result is not None else self.result)}
+        if total is not None:
+            values["total"] = total
+        statement = update(Job).where(Job.id == self.job_id).values(**values).returning(Job.cancel_requested)
+
+        if db is None:
+            async with async_session() as session:
+                self.cancel_requested = (await session.execute(statement)).scalar_one()
+                await session.commit()
+        else:
+            self.cancel_requested = (await db.execute(statement)).scalar_one()
+        self.processed = processed
+
+    def raise_if_cancelled(self):
+        if self.cancel_requested:
+            raise JobCancelled()
+
+
+JobHandler = Callable[[JobContext], Awaitable[None]]
+
+
+def _reported(rows: List[Dict]) -> List[Dict]:
+    return rows[:MAX_REPORTED_ROWS]
+
+
+def _lookup(names: Dict[int, Any]) -> Dict[str, int]:
+    """Ids by id string and by lower-cased name, for resolving CSV references."""
+    keys = {item.name.lower(): item_id for item_id, item in names.items()}
+    keys.update({str(item_id): item_id for item_id in names})
+    return keys
+
+
+async def import_transactions(ctx: JobContext):
+    """
+    Import transactions from an uploaded CSV file.
+
+    Rows are inserted through the write queue in chunks, each chunk
+    committed together with the job's progress, so an interrupted import
+    resumes after the last committed row. Expenses are balance-checked row
+    by row like single creates; rows that fail are reported, not fatal.
+    """
+    rows, errors = await ctx.run_cpu(parse_transactions_csv, ctx.params["input_path"])
+    if not ctx.result:
+        ctx.result = {"imported": 0, "skipped": len(errors), "errors": _reported(errors), "rejected": 0, "rejections": []}
+    await ctx.report(ctx.processed, len(rows))
+
+    for offset in range(ctx.processed, len(rows), IMPORT_CHUNK_ROWS):
+        ctx.raise_if_cancelled()
+        chunk = rows[offset:offset + IMPORT_CHUNK_ROWS]
+
+        async def op(db: AsyncSession, balances: BalanceState, chunk=chunk, end=offset + len(chunk)) -> Dict[str, Any]:
+            await reference_cache.ensure(db)
+            categories = _lookup(reference_cache.categories)
+            accounts = _lookup(reference_cache.accounts)
+            closed_through = (await load_closed_years()).through
+
+            added: List[Transaction] = []
+            rejections: List[Dict] = []
+            for line, day, amount, type, category, account, description in chunk:
+                category_id = categories.get(category.lower())
+                account_id = accounts.get(account.lower()) if account else None
+                amount = Decimal(amount)
+                if category_id is None:
+                    rejections.append({"line": line, "error": f"Unknown category: {category!r}"})
+                    continue
+                if account and account_id is None:
+                    rejections.append({"line": line, "error": f"Unknown account: {account!r}"})
+                    continue
+                if closed_through is not None and date.fromisoformat(day) <= closed_through:
+                    rejections.append({"line": line, "error": f"Dated in a closed year (through {closed_through})"})
+                    continue
+                if type == TransactionType.expense.value and amount > balances.available:
+                    rejections.append({
+                        "line": line,
+                        "error": f"Insufficient balance. Available: {balances.available}, requested: {amount}"
+                    })
+                    continue
+
+                transaction = Transaction(
+                    amount=amount,
+                    type=TransactionType(type),
+                    description=description,
+                    date=date.fromisoformat(day),
+                    category_id=category_id,
+                    account_id=account_id
+                )
+                db.add(transaction)
+                added.append(transaction)
+                balances.add_transaction(transaction.type, amount, account_id)
+
+            await db.flush()
+            for transaction in added:
+                balances.record(db, "transaction", transaction.id, "create", transaction.account_id)
+
+            result = dict(ctx.result)
+            result["imported"] += len(added)
+            result["rejected"] += len(rejections)
+            result["rejections"] = _reported(result["rejections"] + rejections)
+            await ctx.report(end, result=result, db=db)
+            return result
+
+        ctx.result = await write_queue.submit(op)
+        await asyncio.sleep(IMPORT_CHUNK_PAUSE)
+
+
+async def export_dataset(ctx: JobContext):
+    """Write a full Arrow or Parquet export as the job's artifact."""
+    dataset = ExportDataset(ctx.params["dataset"])
+    format = ExportFormat(ctx.params["format"])
+    start_date = date.fromisoformat(ctx.params["start_date"]) if ctx.params.get("start_date") else None
+    end_date = date.fromisoformat(ctx.params["end_date"]) if ctx.params.get("end_date") else None
+
+    await ctx.report(0, await count_rows(dataset, start_date, end_date))
+
+    async def on_batch(rows: int):
+        await ctx.report(rows)
+        ctx.raise_if_cancelled()
+
+    path = ctx.path(f".{format.value}")
+    try:
+        rows = await write_export(dataset, path, format, start_date, end_date, on_batch=on_batch)
+    except BaseException:
+        if os.path.exists(path):
+            os.unlink(path)
+        raise
+    ctx.result = {"dataset": dataset.value, "format": format.value, "rows": rows}
+    ctx.artifact_path = path
+
+
+async def recompute_goals(ctx: JobContext):
+    """Reset every goal's current amount and completion from the sum of its contributions."""
+
+    async def op(db: AsyncSession, balances: BalanceState) -> Dict[str, Any]:
+        contributions = await history(GoalContribution)
+        result = await db.execute(
+            select(contributions.goal_id, func.sum(contributions.amount)).group_by(contributions.goal_id)
+        )
+        totals = {goal_id: Decimal(str(total)).quantize(CENTS) for goal_id, total in result}
+        goals = (await db.execute(select(Goal))).scalars().all()
+
+        changed = []
+        for goal in goals:
+            current = totals.get(goal.id, Decimal("0.00"))
+            completed = current >= goal.target_amount
+            if goal.current_amount != current or goal.completed != completed:
+                goal.current_amount = current
+                goal.completed = completed
+                changed.append(goal)
+
+        await db.flush()
+        for goal in changed:
+            balances.record(db, "goal", goal.id, "update")
+        result = {"goals": len(goals), "updated": len(changed)}
+        await ctx.report(len(goals), len(goals), result=result, db=db)
+        return result
+
+    ctx.result = await write_queue.submit(op)
+
+
+async def close_year(ctx: JobContext):
+    """
+    Close every year up to `through_year` and move its entries to the archives.
+
+    The years are marked closed under the write lock, together with
+    completing the checkpoints through the last closed month: from then on
+    their balances are carried forward by those checkpoints and writes
+    dated in them are rejected. Each year is then archived on its own (see
+    app.archive.archive_year); a resumed job picks up the years not yet
+    archived.
+    """
+    through_year = ctx.params["through_year"]
+    async with async_session() as db:
+        await db.execute(text("BEGIN IMMEDIATE"))
+        years = await mark_years_closed(db, through_year)
+        await add_missing_checkpoints(db, last_closed_month_end(date.today()))
+        if not ctx.result:
+            ctx.result = {"through_year": through_year, "years": {}}
+        await ctx.report(ctx.processed, ctx.processed + len(years), db=db)
+        await db.commit()
+
+    for year in years:
+        ctx.raise_if_cancelled()
+        counts = await archive_year(year)
+        result = dict(ctx.result)
+        result["years"] = {**result["years"], str(year): counts}
+        await ctx.report(ctx.processed + 1, result=result)
+        ctx.result = result
+
+
+HANDLERS: Dict[JobKind, JobHandler] = {
+    JobKind.import_transactions: import_transactions,
+    JobKind.export: export_dataset,
+    JobKind.recompute_goals: recompute_goals,
+    JobKind.close_year: close_year,
+}
+
+
+async def create_job(db: AsyncSession, kind: JobKind, params: Dict[str, Any]) -> Job:
+    job = Job(kind=kind, status=JobStatus.queued, params=json.dumps(params))
+    db.add(job)
+    await db.flush()
+    return job
+
+
+async def cancel_job(db: AsyncSession, job_id: int) -> bool:
+    """
+    Cancel a queued job outright, or ask a running one to stop at its next progress report.
+
+    Both are conditional updates issued before anything is read, so a
+    worker claiming the job in between cannot be overwritten and the
+    session never has to upgrade a read transaction to a write. Returns
+    False when the job is missing or already finished.
+    """
+    result = await db.execute(
+        update(Job)
+        .where(Job.id == job_id, Job.status == JobStatus.queued)
+        .values(status=JobStatus.cancelled, finished_at=datetime.utcnow())
+    )
+    if result.rowcount == 0:
+        result = await db.execute(
+            update(Job).where(Job.id == job_id, Job.status == JobStatus.running).values(cancel_requested=True)
+        )
+    await db.commit()
+    return result.rowcount > 0
+
+
+async def claim_next_job() -> Optional[Job]:
+    async with async_session() as db:
+        next_id = (
+            select(Job.id).where(Job.status == JobStatus.queued).order_by(Job.id).limit(1).scalar_subquery()
+        )
+        result = await db.execute(
+            update(Job)
+            .where(Job.id == next_id, Job.status == JobStatus.queued)
+            .values(status=JobStatus.running, started_at=datetime.utcnow())
+            .returning(Job)
+        )
+        job = result.scalar_one_or_none()
+        await db.commit()
+        return job
+
+
+async def requeue_interrupted(job_ids: Optional[Iterable[int]] = None):
+    """
+    Put running jobs back in the queue: those in `job_ids`, or all of them.
+
+    Requeueing every running job is only safe while no worker process is
+    running jobs, i.e. once at startup before the workers start.
+    """
+    query = update(Job).where(Job.status == JobStatus.running)
+    if job_ids is not None:
+        query = query.where(Job.id.in_(list(job_ids)))
+    async with async_session() as db:
+        await db.execute(query.values(status=JobStatus.queued))
+        await db.commit()
+
+
+class JobRunner:
+    """A few worker tasks draining one tenant's jobs table; CPU work goes to the shared process pool."""
+
+    def __init__(self, workers: int = 2):
+        self.workers = workers
+        self._tasks: List[asyncio.Task] = []
+        self._wakeup: Optional[asyncio.Event] = None
+        self._running: Set[int] = set()
+
+    async def start(self):
+        os.makedirs(jobs_dir(), exist_ok=True)
+        self._wakeup = asyncio.Event()
+        self._tasks = [asyncio.create_task(self._work()) for _ in range(self.workers)]
+
+    async def stop(self):
+        """Stop the workers and put the jobs they were running back in the queue, to be resumed by any worker."""
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        self._tasks = []
+        if self._running:
+            await requeue_interrupted(self._running)
+            self._running.clear()
+
+    @property
+    def busy(self) -> bool:
+        return bool(self._running)
+
+    def notify(self):
+        """Wake idle workers after a job was queued."""
+        if self._wakeup is not None:
+            self._wakeup.set()
+
+    async def _work(self):
+        while True:
+            self._wakeup.clear()
+            job = await claim_next_job()
+            if job is None:
+                try:
+                    await asyncio.wait_for(self._wakeup.wait(), POLL_INTERVAL)
+                except asyncio.TimeoutError:
+                    pass
+                continue
+            self._running.add(job.id)
+            await self._run(job)
+            self._running.discard(job.id)
+
+    async def _run(self, job: Job):
+        ctx = JobContext(job)
+        error = None
+        try:
+            await HANDLERS[job.kind](ctx)
+            status = JobStatus.succeeded
+        except JobCancelled:
+            status = JobStatus.cancelled
+        except Exception as exc:
+            status = JobStatus.failed
+            error = f"{type(exc).__name__}: {exc}"
+
+        async with async_session() as db:
+            await db.execute(
+                update(Job).where(Job.id == job.id).values(
+                    status=status,
+                    result=json.dumps(ctx.result),
+                    error=error,
+                    artifact_path=ctx.artifact_path,
+                    finished_at=datetime.utcnow()
+                )
+            )
+            await db.commit()
+
+
+job_runner = ShardLocal(JobRunner)
@@ -0,0 +1,101 @@
+"""
+Ledger entries as signed (date, amount) movements.
+
+Balances, statements and checkpoints are all sums over these subqueries,
+so what counts towards a balance is defined in one place.
+"""
+from datetime import date
+from typing import Tuple
+
+from sqlalchemy import select, case, union_all, literal, null, and_, or_
+
+from .models import Transaction, TransactionType, GoalContribution, Transfer
+from .archive import history_table
+
+# Ledger id of the available balance (all transactions minus goal contributions)
+AVAILABLE_LEDGER = 0
+
+# Statement entries are ordered by (date, kind, id); transactions sort before transfers on the same day
+ENTRY_TRANSACTION = 0
+ENTRY_TRANSFER = 1
+
+StatementKey = Tuple[date, int, int]
+
+
+def signed_transaction_amount(transactions=Transaction.__table__):
+    return case(
+        (transactions.c.type == TransactionType.income, transactions.c.amount),
+        else_=-transactions.c.amount
+    )
+
+
+def account_entries(account_id: int, years: Tuple[int, ...] = ()):
+    """
+    Every movement of one account with a signed amount, as a subquery.
+
+    Columns: kind, id, date, amount, description, category_id, counterparty_id.
+    `years` adds those archived years' movements (see app.archive).
+    """
+    transactions = history_table(Transaction, years)
+    transfers = history_table(Transfer, years)
+    return union_all(
+        select(
+            literal(ENTRY_TRANSACTION).label("kind"),
+            transactions.c.id.label("id"),
+            transactions.c.date.label("date"),
+            signed_transaction_amount(transactions).label("amount"),
+            transactions.c.description.label("description"),
+            transactions.c.category_id.label("category_id"),
+            null().label("counterparty_id")
+        ).where(transactions.c.account_id == account_id),
+        select(
+            literal(ENTRY_TRANSFER), transfers.c.id, transfers.c.date, -transfers.c.amount,
+            transfers.c.note, null(), transfers.c.to_account_id
+        ).where(transfers.c.from_account_id == account_id),
+        select(
+            literal(ENTRY_TRANSFER), transfers.c.id, transfers.c.date, transfers.c.amount,
+            transfers.c.note, null(), transfers.c.from_account_id
+        ).where(transfers.c.to_account_id == account_id),
+    ).subquery()
+
+
+def available_entries(years: Tuple[int, ...] = ()):
+    """Movements of the available balance: every transaction, and goal contributions as outflows."""
+    transactions = history_table(Transaction, years)
+    contributions = history_table(GoalContribution, years)
+    return union_all(
+        select(transactions.c.date.label("date"), signed_transaction_amount(transactions).label("amount")),
+        select(contributions.c.date, -contributions.c.amount),
+    ).subquery()
+
+
+def all_account_entries():
+    """Movements of every account, with account_id, date and amount columns."""
+    return union_all(
+        select(
+            Transaction.account_id.label("account_id"),
+            Transaction.date.label("date"),
+            signed_transaction_amount().label("amount")
+        ).where(Transaction.account_id.is_not(None)),
+        select(Transfer.to_account_id, Transfer.date, Transfer.amount),
+        select(Transfer.from_account_id, Transfer.date, -Transfer.amount),
+    ).subquery()
+
+
+def ledger_entries(ledger_id: int, years: Tuple[int, ...] = ()):
+    """Dated movements of an account, or of the available balance for AVAILABLE_LEDGER."""
+    if ledger_id == AVAILABLE_LEDGER:
+        return available_entries(years)
+    return account_entries(ledger_id, years)
+
+
+def entries_after(entries, key: StatementKey):
+    """Condition for entries strictly after `key` in statement order."""
+    key_date, kind, entry_id = key
+    return or_(
+        entries.c.date > key_date,
+        and_(
+            entries.c.date == key_date,
+            or_(entries.c.kind > kind, and_(entries.c.kind == kind, entries.c.id > entry_id))
+        )
+    )
@@ -2,17 +2,29 @@ from contextlib import asynccontextmanager
 from fastapi import FastAPI
 from fastapi.middleware.cors import CORSMiddleware
 
-from .database import init_db, async_session
-from .seed import seed_all
-from .routers import categories, transactions, goals, budgets, recurring, analytics, settings, allocation, accounts
+from .auth import TENANTS
+from .shards import DATABASE_PREPARED_ENV, prepare_shards, shards
+from .jobs import shutdown_process_pool
+from .admission import AdmissionMiddleware
+from .routers import categories, transactions, goals, budgets, recurring, analytics, settings, allocation, accounts, events, sync, export, jobs, admission, archive
+
+
+async def prepare_database():
+    """
+    Startup work for a multi-worker runner to do once before forking:
+    schema, seed rows and requeued jobs of every tenant's database. A
+    single process does the same per shard when it first opens it.
+    """
+    await prepare_shards(TENANTS.values())
 
 
 @asynccontextmanager
 async def lifespan(app: FastAPI):
-    await init_db()
-    async with async_session() as db:
-        await seed_all(db)
+    # Shards are opened lazily by the first request of each tenant
+    shards.start()
     yield
+    await shards.stop()
+    shutdown_process_pool()
 
 
 app = FastAPI(
@@ -21,6 +33,8 @@ app = FastAPI(
     lifespan=lifespan
 )
 
+# Added before CORS so shed responses still carry CORS headers
+app.add_middleware(AdmissionMiddleware)
 app.add_middleware(
     CORSMiddleware,
     allow_origins=["*"],
@@ -38,6 +52,12 @@ app.include_router(analytics.router, prefix="/api/analytics", tags=["analytics"]
 app.include_router(settings.router, prefix="/api/settings", tags=["settings"])
 app.include_router(allocation.router, prefix="/api/allocation-rules", tags=["allocation"])
 app.include_router(accounts.router, prefix="/api/accounts", tags=["accounts"])
+app.include_router(events.router, prefix="/api/events", tags=["events"])
+app.include_router(sync.router, prefix="/api/sync", tags=["sync"])
+app.include_router(export.router, prefix="/api/export", tags=["export"])
+app.include_router(jobs.router, prefix="/api/jobs", tags=["jobs"])
+app.include_router(admission.router, prefix="/api/admission", tags=["admission"])
+app.include_router(archive.router, prefix="/api/archive", tags=["archive"])
 
 
 @app.get("/api/health")
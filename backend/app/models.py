@@ -27,7 +27,27 @@ class AccountType(str, enum.Enum):
     cash = "cash"          # Наличные
 
 
-class Account(Base):
+class JobKind(str, enum.Enum):
+    import_transactions = "import_transactions"
+    export = "export"
+    recompute_goals = "recompute_goals"
+    close_year = "close_year"
+
+
+class JobStatus(str, enum.Enum):
+    queued = "queued"
+    running = "running"
+    succeeded = "succeeded"
+    failed = "failed"
+    cancelled = "cancelled"
+
+
+class Versioned:
+    """Rows carry the global change version of their last write (assigned in sync.py)."""
+    version: Mapped[int] = mapped_column(default=0, index=True)
+
+
+class Account(Versioned, Base):
     __tablename__ = "accounts"
 
     id: Mapped[int] = mapped_column(primary_key=True)
@@ -39,7 +59,7 @@ class Account(Base):
     transactions: Mapped[List["Transaction"]] = relationship(back_populates="account")
 
 
-class Category(Base):
+class Category(Versioned, Base):
     __tablename__ = "categories"
 
     id: Mapped[int] = mapped_column(primary_key=True)
@@ -52,7 +72,7 @@ class Category(Base):
     budgets: Mapped[List["Budget"]] = relationship(back_populates="category")
 
 
-class Transaction(Base):
+class Transaction(Versioned, Base):
     __tablename__ = "transactions"
 
     id: Mapped[int] = mapped_column(primary_key=True)
@@ -68,7 +88,7 @@ class Transaction(Base):
     account: Mapped[Optional["Account"]] = relationship(back_populates="transactions")
 
 
-class Goal(Base):
+class Goal(Versioned, Base):
     __tablename__ = "goals"
 
     id: Mapped[int] = mapped_column(primary_key=True)
@@ -82,7 +102,7 @@ class Goal(Base):
     contributions: Mapped[List["GoalContribution"]] = relationship(back_populates="goal", cascade="all, delete-orphan")
 
 
-class GoalContribution(Base):
+class GoalContribution(Versioned, Base):
     __tablename__ = "goal_contributions"
 
     id: Mapped[int] = mapped_column(primary_key=True)
@@ -95,7 +115,19 @@ class GoalContribution(Base):
     goal: Mapped["Goal"] = relationship(back_populates="contributions")
 
 
-class Budget(Base):
+class CategoryEarmark(Versioned, Base):
+    __tablename__ = "category_earmarks"
+
+    id: Mapped[int] = mapped_column(primary_key=True)
+    category_id: Mapped[int] = mapped_column(ForeignKey("categories.id"), index=True)
+    allocation_rule_id: Mapped[Optional[int]] = mapped_column(ForeignKey("allocation_rules.id"), nullable=True)
+    amount: Mapped[Decimal] = mapped_column(Numeric(12, 2))
+    date: Mapped[date] = mapped_column(Date, default=date.today)
+    note: Mapped[Optional[str]] = mapped_column(Text, nullable=True)
+    created_at: Mapped[datetime] = mapped_column(DateTime, default=datetime.utcnow)
+
+
+class Budget(Versioned, Base):
     __tablename__ = "budgets"
     __table_args__ = (
         sqlalchemy.UniqueConstraint('category_id', 'month', 'year', name='uq_budget_category_period'),
@@ -111,7 +143,7 @@ class Budget(Base):
     category: Mapped["Category"] = relationship(back_populates="budgets")
 
 
-class RecurringTransaction(Base):
+class RecurringTransaction(Versioned, Base):
     __tablename__ = "recurring_transactions"
 
     id: Mapped[int] = mapped_column(primary_key=True)
@@ -127,7 +159,7 @@ class RecurringTransaction(Base):
     category: Mapped["Category"] = relationship()
 
 
-class Settings(Base):
+class Settings(Versioned, Base):
     __tablename__ = "settings"
 
     id: Mapped[int] = mapped_column(primary_key=True)
@@ -135,7 +167,7 @@ class Settings(Base):
     value: Mapped[str] = mapped_column(Text)
 
 
-class AllocationRule(Base):
+class AllocationRule(Versioned, Base):
     __tablename__ = "allocation_rules"
 
     id: Mapped[int] = mapped_column(primary_key=True)
@@ -148,16 +180,93 @@ class AllocationRule(Base):
     created_at: Mapped[datetime] = mapped_column(DateTime, default=datetime.utcnow)
 
 
-class Transfer(Base):
+class Transfer(Versioned, Base):
     __tablename__ = "transfers"
 
     id: Mapped[int] = mapped_column(primary_key=True)
-    from_account_id: Mapped[int] = mapped_column(ForeignKey("accounts.id"))
-    to_account_id: Mapped[int] = mapped_column(ForeignKey("accounts.id"))
+    from_account_id: Mapped[int] = mapped_column(ForeignKey("accounts.id"), index=True)
+    to_account_id: Mapped[int] = mapped_column(ForeignKey("accounts.id"), index=True)
     amount: Mapped[Decimal] = mapped_column(Numeric(12, 2))
-    date: Mapped[date] = mapped_column(Date, default=date.today)
+    date: Mapped[date] = mapped_column(Date, default=date.today, index=True)
     note: Mapped[Optional[str]] = mapped_column(Text, nullable=True)
     created_at: Mapped[datetime] = mapped_column(DateTime, default=datetime.utcnow)
 
     from_account: Mapped["Account"] = relationship(foreign_keys=[from_account_id])
     to_account: Mapped["Account"] = relationship(foreign_keys=[to_account_id])
+
+
+class SyncState(Base):
+    __tablename__ = "sync_state"
+
+    id: Mapped[int] = mapped_column(primary_key=True)
+    version: Mapped[int] = mapped_column(default=0)
+
+
+class Tombstone(Base):
+    __tablename__ = "tombstones"
+
+    id: Mapped[int] = mapped_column(primary_key=True)
+    entity: Mapped[str] = mapped_column(String(50))  # table name of the deleted row
+    entity_id: Mapped[int] = mapped_column()
+    version: Mapped[int] = mapped_column(index=True)
+    deleted_at: Mapped[datetime] = mapped_column(DateTime, default=datetime.utcnow)
+
+
+class BalanceCheckpoint(Base):
+    __tablename__ = "balance_checkpoints"
+    __table_args__ = (
+        sqlalchemy.UniqueConstraint('account_id', 'period_end', name='uq_checkpoint_account_period'),
+    )
+
+    id: Mapped[int] = mapped_column(primary_key=True)
+    account_id: Mapped[int] = mapped_column()  # 0 = available balance across all accounts
+    period_end: Mapped[date] = mapped_column(Date)  # last day of the month
+    balance: Mapped[Decimal] = mapped_column(Numeric(12, 2))  # closing balance including period_end
+
+
+class Job(Base):
+    __tablename__ = "jobs"
+
+    id: Mapped[int] = mapped_column(primary_key=True)
+    kind: Mapped[JobKind] = mapped_column(SQLEnum(JobKind))
+    status: Mapped[JobStatus] = mapped_column(SQLEnum(JobStatus), default=JobStatus.queued, index=True)
+    params: Mapped[str] = mapped_column(Text, default="{}")  # JSON
+    processed: Mapped[int] = mapped_column(default=0)
+    total: Mapped[Optional[int]] = mapped_column(nullable=True)
+    result: Mapped[Optional[str]] = mapped_column(Text, nullable=True)  # JSON, kept up to date while running
+    error: Mapped[Optional[str]] = mapped_column(Text, nullable=True)
+    artifact_path: Mapped[Optional[str]] = mapped_column(String(500), nullable=True)
+    cancel_requested: Mapped[bool] = mapped_column(Boolean, default=False)
+    created_at: Mapped[datetime] = mapped_column(DateTime, default=datetime.utcnow)
+    started_at: Mapped[Optional[datetime]] = mapped_column(DateTime, nullable=True)
+    finished_at: Mapped[Optional[datetime]] = mapped_column(DateTime, nullable=True)
+
+
+class WriteGeneration(Base):
+    """Shared write counter per table, bumped in the writing transaction (see app.generation)."""
+    __tablename__ = "write_generations"
+
+    table_name: Mapped[str] = mapped_column(String(100), primary_key=True)
+    generation: Mapped[int] = mapped_column(default=0)
+
+
+class ChangeEventRecord(Base):
+    """Committed change events, relayed to SSE subscribers connected to other worker processes."""
+    __tablename__ = "change_events"
+
+    id: Mapped[int] = mapped_column(primary_key=True)
+    origin: Mapped[int] = mapped_column()  # pid of the process that published it locally
+    payload: Mapped[str] = mapped_column(Text)  # ChangeEvent JSON
+
+
+class ClosedYear(Base):
+    """A year whose ledger rows were moved to its archive database (see app.archive)."""
+    __tablename__ = "closed_years"
+
+    year: Mapped[int] = mapped_column(primary_key=True)
+    archived: Mapped[bool] = mapped_column(Boolean, default=False)  # False while its rows are being moved
+    transactions: Mapped[int] = mapped_column(default=0)
+    transfers: Mapped[int] = mapped_column(default=0)
+    goal_contributions: Mapped[int] = mapped_column(default=0)
+    max_ids: Mapped[str] = mapped_column(Text, default="{}")  # JSON: highest archived id per table
+    closed_at: Mapped[Optional[datetime]] = mapped_column(DateTime, nullable=True)
@@ -1,52 +1,35 @@
-from typing import List
+from typing import List, Optional, Union
+from datetime import date
 from decimal import Decimal
-from fastapi import APIRouter, Depends, HTTPException, status
+from fastapi import APIRouter, Depends, HTTPException, status, Query, Response
+from fastapi.responses import JSONResponse
 from sqlalchemy.ext.asyncio import AsyncSession
-from sqlalchemy import select, func
+from sqlalchemy import select, func, and_, or_, text
 
-from ..database import get_db
+from ..database import get_db, get_read_db, fan_out
 from ..models import Account, Transaction, TransactionType, Transfer
-from ..schemas import AccountCreate, AccountUpdate, AccountResponse, TransferCreate, TransferResponse
+from ..schemas import (
+    AccountCreate, AccountUpdate, AccountResponse, TransferCreate, TransferResponse,
+    AccountStatement, StatementEntry, BalanceAsOf
+)
 from ..auth import verify_api_key
+from ..events import record_change
+from ..cache import ReferenceCache, get_reference_cache, reference_cache
+from ..balance import get_account_balance, get_account_balances, get_account_balance_through
+from ..ledger import account_entries, entries_after, ENTRY_TRANSACTION, ENTRY_TRANSFER
+from ..fieldsets import Fieldset
+from ..write_queue import BalanceState, write_queue
+from ..timeouts import query_budget, LIST_QUERY_BUDGET
+from ..archive import history, archived, archived_years
 
 router = APIRouter(dependencies=[Depends(verify_api_key)])
 
 
-async def get_account_balance(db: AsyncSession, account_id: int) -> Decimal:
-    """Calculate account balance from transactions and transfers."""
-    # Income to this account
-    income_result = await db.execute(
-        select(func.coalesce(func.sum(Transaction.amount), 0))
-        .where(Transaction.account_id == account_id, Transaction.type == TransactionType.income)
-    )
-    income = Decimal(str(income_result.scalar()))
-
-    # Expenses from this account
-    expense_result = await db.execute(
-        select(func.coalesce(func.sum(Transaction.amount), 0))
-        .where(Transaction.account_id == account_id, Transaction.type == TransactionType.expense)
-    )
-    expense = Decimal(str(expense_result.scalar()))
-
-    # Transfers in
-    transfers_in_result = await db.execute(
-        select(func.coalesce(func.sum(Transfer.amount), 0))
-        .where(Transfer.to_account_id == account_id)
-    )
-    transfers_in = Decimal(str(transfers_in_result.scalar()))
-
-    # Transfers out
-    transfers_out_result = await db.execute(
-        select(func.coalesce(func.sum(Transfer.amount), 0))
-        .where(Transfer.from_account_id == account_id)
-    )
-    transfers_out = Decimal(str(transfers_out_result.scalar()))
+async def account_to_response(db: AsyncSession, account: Union[Account, AccountResponse]) -> AccountResponse:
+    return account_with_balance(account, await get_account_balance(db, account.id))
 
-    return income - expense + transfers_in - transfers_out
 
-
-async def account_to_response(db: AsyncSession, account: Account) -> AccountResponse:
-    balance = await get_account_balance(db, account.id)
+def account_with_balance(account: Union[Account, AccountResponse], balance: Decimal) -> AccountResponse:
     return AccountResponse(
         id=account.id,
         name=account.name,
@@ -58,21 +41,127 @@ async def account_to_response(db: AsyncSession, account: Account) -> AccountResp
 
 
 @router.get("", response_model=List[AccountResponse])
-async def get_accounts(db: AsyncSession = Depends(get_db)):
-    result = await db.execute(select(Account).order_by(Account.is_default.desc(), Account.name))
-    accounts = result.scalars().all()
-    return [await account_to_response(db, a) for a in accounts]
+async def get_accounts(db: AsyncSession = Depends(get_read_db), refs: ReferenceCache = Depends(get_reference_cache)):
+    accounts = sorted(refs.accounts.values(), key=lambda a: (not a.is_default, a.name))
+    balances = await get_account_balances(db)
+    return [account_with_balance(a, balances.get(a.id, Decimal("0"))) for a in accounts]
 
 
 @router.get("/{account_id}", response_model=AccountResponse)
-async def get_account(account_id: int, db: AsyncSession = Depends(get_db)):
-    result = await db.execute(select(Account).where(Account.id == account_id))
-    account = result.scalar_one_or_none()
+async def get_account(
+    account_id: int,
+    db: AsyncSession = Depends(get_db),
+    refs: ReferenceCache = Depends(get_reference_cache)
+):
+    account = refs.accounts.get(account_id)
     if not account:
         raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Account not found")
     return await account_to_response(db, account)
 
 
+@router.get("/{account_id}/balance", response_model=BalanceAsOf)
+async def get_account_balance_as_of(
+    account_id: int,
+    as_of: Optional[date] = None,
+    db: AsyncSession = Depends(get_read_db),
+    refs: ReferenceCache = Depends(get_reference_cache)
+):
+    """Account balance at the end of `as_of` (default today)."""
+    if account_id not in refs.accounts:
+        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Account not found")
+    as_of = as_of or date.today()
+    return BalanceAsOf(account_id=account_id, as_of=as_of, balance=await get_account_balance(db, account_id, as_of))
+
+
+ENTRY_KINDS = {ENTRY_TRANSACTION: "transaction", ENTRY_TRANSFER: "transfer"}
+
+
+def encode_cursor(key_date: date, *ids: int) -> str:
+    return ".".join([key_date.isoformat(), *(str(i) for i in ids)])
+
+
+def decode_cursor(cursor: str, size: int) -> tuple:
+    """Inverse of encode_cursor for a key of `size` parts (a date followed by integers)."""
+    parts = cursor.split(".")
+    try:
+        if len(parts) != size:
+            raise ValueError
+        return (date.fromisoformat(parts[0]), *(int(p) for p in parts[1:]))
+    except ValueError:
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail="Invalid cursor")
+
+
+@router.get(
+    "/{account_id}/statement", response_model=AccountStatement,
+    dependencies=[Depends(query_budget(LIST_QUERY_BUDGET))]
+)
+async def get_account_statement(
+    account_id: int,
+    start_date: Optional[date] = None,
+    end_date: Optional[date] = None,
+    cursor: Optional[str] = None,
+    limit: int = Query(default=100, ge=1, le=1000),
+    db: AsyncSession = Depends(get_read_db),
+    refs: ReferenceCache = Depends(get_reference_cache)
+):
+    """
+    Transactions and transfers of an account in date order, each with the
+    running balance after it. Pass `next_cursor` back as `cursor` to get
+    the following page; it takes precedence over `start_date`.
+    """
+    if account_id not in refs.accounts:
+        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Account not found")
+
+    if cursor:
+        after = decode_cursor(cursor, 3)
+    elif start_date:
+        # Sorts before every entry on start_date, so the opening balance covers earlier days only
+        after = (start_date, -1, 0)
+    else:
+        after = None
+
+    entries = account_entries(account_id, await archived_years(after[0] if after else None, end_date))
+    order = (entries.c.date, entries.c.kind, entries.c.id)
+    query = select(
+        entries,
+        func.sum(entries.c.amount).over(order_by=order).label("running")
+    )
+    if after:
+        query = query.where(entries_after(entries, after))
+    if end_date:
+        query = query.where(entries.c.date <= end_date)
+    query = query.order_by(*order).limit(limit + 1)
+
+    # The running balances are the opening balance plus the page's sums, so both
+    # must read the same commit: one read transaction instead of fan_out
+    await db.execute(text("BEGIN"))
+    opening = await get_account_balance_through(db, account_id, after) if after else Decimal("0")
+    rows = (await db.execute(query)).all()
+
+    has_more = len(rows) > limit
+    rows = rows[:limit]
+    items = [
+        StatementEntry(
+            kind=ENTRY_KINDS[row.kind],
+            id=row.id,
+            date=row.date,
+            amount=Decimal(str(row.amount)),
+            description=row.description,
+            category_id=row.category_id,
+            counterparty_account_id=row.counterparty_id,
+            balance=opening + Decimal(str(row.running))
+        )
+        for row in rows
+    ]
+    return AccountStatement(
+        account_id=account_id,
+        opening_balance=opening,
+        closing_balance=items[-1].balance if items else opening,
+        entries=items,
+        next_cursor=encode_cursor(rows[-1].date, rows[-1].kind, rows[-1].id) if has_more else None
+    )
+
+
 @router.post("", response_model=AccountResponse, status_code=status.HTTP_201_CREATED)
 async def create_account(data: AccountCreate, db: AsyncSession = Depends(get_db)):
     # Check if this is the first account - make it default
@@ -81,8 +170,11 @@ async def create_account(data: AccountCreate, db: AsyncSession = Depends(get_db)
 
     account = Account(**data.model_dump(), is_default=is_first)
     db.add(account)
+    await db.flush()
+    record_change(db, "account", account.id, "create")
     await db.commit()
     await db.refresh(account)
+    reference_cache.invalidate()
     return await account_to_response(db, account)
 
 
@@ -101,13 +193,17 @@ async def update_account(account_id: int, data: AccountUpdate, db: AsyncSession
             select(Account).where(Account.id != account_id)
         )
         for other in (await db.execute(select(Account).where(Account.id != account_id))).scalars():
-            other.is_default = False
+            if other.is_default:
+                other.is_default = False
+                record_change(db, "account", other.id, "update")
 
     for field, value in update_data.items():
         setattr(account, field, value)
 
+    record_change(db, "account", account.id, "update")
     await db.commit()
     await db.refresh(account)
+    reference_cache.invalidate()
     return await account_to_response(db, account)
 
 
@@ -124,9 +220,10 @@ async def delete_account(account_id: int, db: AsyncSession = Depends(get_db)):
             detail="Cannot delete default account"
         )
 
-    # Check if account has transactions
+    # Check if account has transactions, archived ones included
+    transactions = await history(Transaction)
     tx_result = await db.execute(
-        select(func.count(Transaction.id)).where(Transaction.account_id == account_id)
+        select(func.count(transactions.id)).where(transactions.account_id == account_id)
     )
     if tx_result.scalar() > 0:
         raise HTTPException(
@@ -135,12 +232,18 @@ async def delete_account(account_id: int, db: AsyncSession = Depends(get_db)):
         )
 
     await db.delete(account)
+    record_change(db, "account", account_id, "delete")
     await db.commit()
+    reference_cache.invalidate()
 
 
 # Transfer endpoints
 @router.post("/transfer", response_model=TransferResponse, status_code=status.HTTP_201_CREATED)
-async def create_transfer(data: TransferCreate, db: AsyncSession = Depends(get_db)):
+async def create_transfer(
+    data: TransferCreate,
+    db: AsyncSession = Depends(get_db),
+    refs: ReferenceCache = Depends(get_reference_cache)
+):
     if data.amount <= 0:
         raise HTTPException(
             status_code=status.HTTP_400_BAD_REQUEST,
@@ -154,41 +257,37 @@ async def create_transfer(data: TransferCreate, db: AsyncSession = Depends(get_d
         )
 
     # Verify accounts exist
-    from_result = await db.execute(select(Account).where(Account.id == data.from_account_id))
-    from_account = from_result.scalar_one_or_none()
+    from_account = refs.accounts.get(data.from_account_id)
     if not from_account:
         raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Source account not found")
 
-    to_result = await db.execute(select(Account).where(Account.id == data.to_account_id))
-    to_account = to_result.scalar_one_or_none()
+    to_account = refs.accounts.get(data.to_account_id)
     if not to_account:
         raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Destination account not found")
 
-    # Check balance
-    from_balance = await get_account_balance(db, data.from_account_id)
-    if data.amount > from_balance:
-        raise HTTPException(
-            status_code=status.HTTP_400_BAD_REQUEST,
-            detail=f"Insufficient balance. Available: {from_balance}"
+    async def op(db: AsyncSession, balances: BalanceState) -> Transfer:
+        # Check balance
+        from_balance = balances.account(data.from_account_id)
+        if data.amount > from_balance:
+            raise HTTPException(
+                status_code=status.HTTP_400_BAD_REQUEST,
+                detail=f"Insufficient balance. Available: {from_balance}"
+            )
+
+        transfer = Transfer(
+            from_account_id=data.from_account_id,
+            to_account_id=data.to_account_id,
+            amount=data.amount,
+            date=data.date or __import__('datetime').date.today(),
+            note=data.note
         )
+        db.add(transfer)
+        await db.flush()
+        balances.add_transfer(transfer.from_account_id, transfer.to_account_id, transfer.amount)
+        balances.record(db, "transfer", transfer.id, "create", transfer.from_account_id, transfer.to_account_id)
+        return transfer
 
-    transfer = Transfer(
-        from_account_id=data.from_account_id,
-        to_account_id=data.to_account_id,
-        amount=data.amount,
-        date=data.date or __import__('datetime').date.today(),
-        note=data.note
-    )
-    db.add(transfer)
-    await db.commit()
-    await db.refresh(transfer)
-
-    # Reload with relationships
-    result = await db.execute(
-        select(Transfer).where(Transfer.id == transfer.id)
-    )
-    transfer = result.scalar_one()
-
+    transfer = await write_queue.submit(op)
     return TransferResponse(
         id=transfer.id,
         from_account_id=transfer.from_account_id,
@@ -202,25 +301,142 @@ async def create_transfer(data: TransferCreate, db: AsyncSession = Depends(get_d
     )
 
 
-@router.get("/transfers/list", response_model=List[TransferResponse])
-async def get_transfers(db: AsyncSession = Depends(get_db)):
-    result = await db.execute(select(Transfer).order_by(Transfer.date.desc()))
-    transfers = result.scalars().all()
-
-    responses = []
-    for t in transfers:
-        from_acc = (await db.execute(select(Account).where(Account.id == t.from_account_id))).scalar_one()
-        to_acc = (await db.execute(select(Account).where(Account.id == t.to_account_id))).scalar_one()
-        responses.append(TransferResponse(
-            id=t.id,
-            from_account_id=t.from_account_id,
-            to_account_id=t.to_account_id,
-            amount=t.amount,
-            date=t.date,
-            note=t.note,
-            created_at=t.created_at,
-            from_account=await account_to_response(db, from_acc),
-            to_account=await account_to_response(db, to_acc)
-        ))
-
-    return responses
+TRANSFER_COLUMNS = ("from_account_id", "to_account_id", "amount", "date", "note", "created_at")
+TRANSFER_RELATIONS = ("from_account", "to_account")
+
+
+def filter_transfers(
+    query,
+    account_id: Optional[int],
+    from_account_id: Optional[int],
+    to_account_id: Optional[int],
+    start_date: Optional[date],
+    end_date: Optional[date],
+    min_amount: Optional[Decimal],
+    max_amount: Optional[Decimal],
+    source=Transfer
+):
+    """Apply the filters to `query`; `source` is Transfer or an archive alias of it."""
+    if account_id is not None:
+        query = query.where(or_(source.from_account_id == account_id, source.to_account_id == account_id))
+    if from_account_id is not None:
+        query = query.where(source.from_account_id == from_account_id)
+    if to_account_id is not None:
+        query = query.where(source.to_account_id == to_account_id)
+    if start_date:
+        query = query.where(source.date >= start_date)
+    if end_date:
+        query = query.where(source.date <= end_date)
+    if min_amount is not None:
+        query = query.where(source.amount >= min_amount)
+    if max_amount is not None:
+        query = query.where(source.amount <= max_amount)
+    return query
+
+
+@router.get(
+    "/transfers/list", response_model=List[TransferResponse],
+    dependencies=[Depends(query_budget(LIST_QUERY_BUDGET))]
+)
+async def get_transfers(
+    response: Response,
+    account_id: Optional[int] = None,
+    from_account_id: Optional[int] = None,
+    to_account_id: Optional[int] = None,
+    start_date: Optional[date] = None,
+    end_date: Optional[date] = None,
+    min_amount: Optional[Decimal] = None,
+    max_amount: Optional[Decimal] = None,
+    cursor: Optional[str] = None,
+    limit: int = Query(default=100, ge=1, le=1000),
+    fields: Optional[str] = None,
+    expand: Optional[str] = None,
+    db: AsyncSession = Depends(get_read_db),
+    refs: ReferenceCache = Depends(get_reference_cache)
+):
+    """
+    Transfers, newest first. `account_id` matches either side.
+
+    When more rows are available the X-Next-Cursor response header is set;
+    pass it back as `cursor` for the next page.
+    """
+    fieldset = Fieldset.parse(fields, expand, TRANSFER_COLUMNS, TRANSFER_RELATIONS)
+    required = ["date"] + ([] if fieldset is None else [f"{name}_id" for name in fieldset.relations])
+    before = decode_cursor(cursor, 2) if cursor else None
+
+    def page(source, size: int):
+        if fieldset is None:
+            query = select(source)
+        else:
+            query = select(*fieldset.select_columns(source, required))
+        query = filter_transfers(
+            query, account_id, from_account_id, to_account_id, start_date, end_date, min_amount, max_amount, source
+        )
+        if before:
+            before_date, before_id = before
+            query = query.where(or_(
+                source.date < before_date,
+                and_(source.date == before_date, source.id < before_id)
+            ))
+        return query.order_by(source.date.desc(), source.id.desc()).limit(size)
+
+    last_date = end_date
+    if before and (last_date is None or before[0] < last_date):
+        last_date = before[0]
+    years = await archived_years(start_date, last_date)
+
+    # Nested balances are the only expensive part, so compute them once and only when asked for
+    if fieldset is None:
+        with_balances = True
+    else:
+        with_balances = any(attrs is None or "balance" in attrs for attrs in fieldset.relations.values())
+
+    def fetch(result) -> list:
+        return list(result.scalars().all() if fieldset is None else result.all())
+
+    async def read_rows(session: AsyncSession):
+        rows = fetch(await session.execute(page(Transfer, limit + 1)))
+        if years and len(rows) <= limit:
+            # The archived years continue the page where the hot rows run out (see archived())
+            rows += fetch(await session.execute(page(archived(Transfer, years), limit + 1 - len(rows))))
+        return rows
+
+    if with_balances:
+        rows, balances = await fan_out(read_rows, get_account_balances)
+    else:
+        rows, balances = await read_rows(db), {}
+
+    headers = {}
+    if len(rows) > limit:
+        rows = rows[:limit]
+        headers["X-Next-Cursor"] = encode_cursor(rows[-1].date, rows[-1].id)
+
+    def nested_account(account_id: int) -> AccountResponse:
+        account = refs.accounts[account_id]
+        if with_balances:
+            account = account.model_copy(update={"balance": balances.get(account_id, Decimal("0"))})
+        return account
+
+    if fieldset is None:
+        response.headers.update(headers)
+        return [
+            TransferResponse(
+                id=t.id,
+                from_account_id=t.from_account_id,
+                to_account_id=t.to_account_id,
+                amount=t.amount,
+                date=t.date,
+                note=t.note,
+                created_at=t.created_at,
+                from_account=nested_account(t.from_account_id),
+                to_account=nested_account(t.to_account_id)
+            )
+            for t in rows
+        ]
+
+    items = []
+    for row in rows:
+        values = row._mapping
+        related = {name: nested_account(values[f"{name}_id"]) for name in fieldset.relations}
+        items.append(fieldset.project(values, related))
+    return JSONResponse(items, headers=headers)
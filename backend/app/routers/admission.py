@@ -0,0 +1,14 @@
+from typing import List
+from fastapi import APIRouter, Depends
+
+from ..schemas import AdmissionClassStats
+from ..auth import verify_api_key
+from ..admission import admission
+
+router = APIRouter(dependencies=[Depends(verify_api_key)])
+
+
+@router.get("", response_model=List[AdmissionClassStats])
+async def get_admission_stats():
+    """Concurrency, queueing and shedding per request class since startup."""
+    return admission.stats()
@@ -1,16 +1,19 @@
-from typing import List
-from decimal import Decimal
+from typing import Dict, Iterable, List, Sequence, Tuple
+from decimal import Decimal, ROUND_HALF_UP
 from fastapi import APIRouter, Depends, HTTPException, status
 from sqlalchemy.ext.asyncio import AsyncSession
 from sqlalchemy import select, func
 
 from ..database import get_db
-from ..models import AllocationRule, Goal, Category
+from ..models import AllocationRule, Goal, GoalContribution, CategoryEarmark
 from ..schemas import (
     AllocationRuleCreate, AllocationRuleUpdate, AllocationRuleResponse,
-    AllocationCalculation
+    AllocationCalculation, AllocationApply, AllocationApplyResult
 )
 from ..auth import verify_api_key
+from ..events import record_change
+from ..cache import ReferenceCache, get_reference_cache
+from ..write_queue import BalanceState, write_queue
 
 router = APIRouter(dependencies=[Depends(verify_api_key)])
 
@@ -21,14 +24,79 @@ async def get_target_name(db: AsyncSession, target_type: str, target_id: int) ->
         target = result.scalar_one_or_none()
         return target.name if target else ""
     elif target_type == "category":
-        result = await db.execute(select(Category).where(Category.id == target_id))
-        target = result.scalar_one_or_none()
+        refs = await get_reference_cache(db)
+        target = refs.categories.get(target_id)
         return target.name if target else ""
     return ""
 
 
-async def rule_to_response(db: AsyncSession, rule: AllocationRule) -> AllocationRuleResponse:
-    target_name = await get_target_name(db, rule.target_type, rule.target_id)
+async def get_target_names(
+    db: AsyncSession,
+    targets: Iterable[Tuple[str, int]],
+    refs: ReferenceCache
+) -> Dict[Tuple[str, int], str]:
+    """Names of many rule targets at once: one query for goals, categories from the cache."""
+    targets = set(targets)
+    names = {}
+    goal_ids = [target_id for target_type, target_id in targets if target_type == "goal"]
+    if goal_ids:
+        result = await db.execute(select(Goal.id, Goal.name).where(Goal.id.in_(goal_ids)))
+        names.update({("goal", row.id): row.name for row in result})
+    for target_type, target_id in targets:
+        if target_type == "category" and target_id in refs.categories:
+            names[(target_type, target_id)] = refs.categories[target_id].name
+    return names
+
+
+async def get_active_rules(db: AsyncSession) -> List[AllocationRule]:
+    result = await db.execute(
+        select(AllocationRule)
+        .where(AllocationRule.is_active == True)
+        .order_by(AllocationRule.sort_order, AllocationRule.id)
+    )
+    return result.scalars().all()
+
+
+def split_amount(amount: Decimal, percentages: Sequence[int]) -> List[Decimal]:
+    """
+    Split `amount` by percentages into whole cents.
+
+    Uses the largest-remainder method: every share is rounded down, then
+    the cents left over go to the shares with the largest fractional parts
+    (earlier rules first on ties), so the shares always add up to exactly
+    the total percentage of the amount, rounded to the cent.
+    """
+    cents = int((amount * 100).to_integral_value(rounding=ROUND_HALF_UP))
+    quotas = [cents * p for p in percentages]  # in 1/100 cent
+    shares = [q // 100 for q in quotas]
+    total = int((Decimal(cents * sum(percentages)) / 100).to_integral_value(rounding=ROUND_HALF_UP))
+    by_remainder = sorted(range(len(quotas)), key=lambda i: (-(quotas[i] % 100), i))
+    for i in by_remainder[:total - sum(shares)]:
+        shares[i] += 1
+    return [Decimal(share).scaleb(-2) for share in shares]
+
+
+def calculate_rules(
+    rules: Sequence[AllocationRule],
+    amount: Decimal,
+    names: Dict[Tuple[str, int], str]
+) -> List[AllocationCalculation]:
+    shares = split_amount(amount, [rule.percentage for rule in rules])
+    return [
+        AllocationCalculation(
+            rule_id=rule.id,
+            rule_name=rule.name,
+            percentage=rule.percentage,
+            target_type=rule.target_type,
+            target_id=rule.target_id,
+            target_name=names.get((rule.target_type, rule.target_id), ""),
+            amount=share
+        )
+        for rule, share in zip(rules, shares)
+    ]
+
+
+def rule_to_response(rule: AllocationRule, target_name: str) -> AllocationRuleResponse:
     return AllocationRuleResponse(
         id=rule.id,
         name=rule.name,
@@ -43,40 +111,109 @@ async def rule_to_response(db: AsyncSession, rule: AllocationRule) -> Allocation
 
 
 @router.get("", response_model=List[AllocationRuleResponse])
-async def get_allocation_rules(db: AsyncSession = Depends(get_db)):
-    result = await db.execute(
-        select(AllocationRule)
-        .where(AllocationRule.is_active == True)
-        .order_by(AllocationRule.sort_order, AllocationRule.id)
-    )
-    rules = result.scalars().all()
-    return [await rule_to_response(db, r) for r in rules]
+async def get_allocation_rules(
+    db: AsyncSession = Depends(get_db),
+    refs: ReferenceCache = Depends(get_reference_cache)
+):
+    rules = await get_active_rules(db)
+    names = await get_target_names(db, [(r.target_type, r.target_id) for r in rules], refs)
+    return [rule_to_response(r, names.get((r.target_type, r.target_id), "")) for r in rules]
 
 
 @router.get("/calculate", response_model=List[AllocationCalculation])
-async def calculate_allocation(amount: Decimal, db: AsyncSession = Depends(get_db)):
-    result = await db.execute(
-        select(AllocationRule)
-        .where(AllocationRule.is_active == True)
-        .order_by(AllocationRule.sort_order, AllocationRule.id)
-    )
-    rules = result.scalars().all()
+async def calculate_allocation(
+    amount: Decimal,
+    db: AsyncSession = Depends(get_db),
+    refs: ReferenceCache = Depends(get_reference_cache)
+):
+    rules = await get_active_rules(db)
+    names = await get_target_names(db, [(r.target_type, r.target_id) for r in rules], refs)
+    return calculate_rules(rules, amount, names)
 
-    calculations = []
-    for rule in rules:
-        target_name = await get_target_name(db, rule.target_type, rule.target_id)
-        allocated_amount = amount * rule.percentage / 100
-        calculations.append(AllocationCalculation(
-            rule_id=rule.id,
-            rule_name=rule.name,
-            percentage=rule.percentage,
-            target_type=rule.target_type,
-            target_id=rule.target_id,
-            target_name=target_name,
-            amount=allocated_amount
-        ))
 
-    return calculations
+@router.post("/apply", response_model=AllocationApplyResult)
+async def apply_allocation(data: AllocationApply, refs: ReferenceCache = Depends(get_reference_cache)):
+    """
+    Split an amount by the active rules and book every part in one transaction:
+    a contribution for each goal target and an earmark for each category target.
+    Only goal contributions draw on the available balance.
+    """
+    if data.amount <= 0:
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail="Amount must be greater than 0"
+        )
+
+    async def op(db: AsyncSession, balances: BalanceState) -> AllocationApplyResult:
+        rules = await get_active_rules(db)
+        if not rules:
+            raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail="No active allocation rules")
+
+        goal_ids = [r.target_id for r in rules if r.target_type == "goal"]
+        goals: Dict[int, Goal] = {}
+        if goal_ids:
+            result = await db.execute(select(Goal).where(Goal.id.in_(goal_ids)))
+            goals = {goal.id: goal for goal in result.scalars()}
+
+        names = {("goal", goal.id): goal.name for goal in goals.values()}
+        names.update({("category", c.id): c.name for c in refs.categories.values()})
+        calculations = calculate_rules(rules, data.amount, names)
+
+        for calc in calculations:
+            if (calc.target_type, calc.target_id) not in names:
+                raise HTTPException(
+                    status_code=status.HTTP_400_BAD_REQUEST,
+                    detail=f"Target {calc.target_type} with id {calc.target_id} of rule '{calc.rule_name}' not found"
+                )
+            if calc.target_type == "goal" and calc.amount > 0 and goals[calc.target_id].completed:
+                raise HTTPException(
+                    status_code=status.HTTP_400_BAD_REQUEST,
+                    detail=f"Cannot contribute to a completed goal: {calc.target_name}"
+                )
+
+        to_goals = sum((c.amount for c in calculations if c.target_type == "goal"), Decimal("0"))
+        if to_goals > balances.available:
+            raise HTTPException(
+                status_code=status.HTTP_400_BAD_REQUEST,
+                detail=f"Insufficient balance. Available: {balances.available}, requested: {to_goals}"
+            )
+
+        earmarks = []
+        for calc in calculations:
+            if calc.amount <= 0:
+                continue
+            if calc.target_type == "goal":
+                goal = goals[calc.target_id]
+                db.add(GoalContribution(goal_id=goal.id, amount=calc.amount, note=data.note))
+                goal.current_amount += calc.amount
+                if goal.current_amount >= goal.target_amount:
+                    goal.completed = True
+            else:
+                earmark = CategoryEarmark(
+                    category_id=calc.target_id,
+                    allocation_rule_id=calc.rule_id,
+                    amount=calc.amount,
+                    note=data.note
+                )
+                db.add(earmark)
+                earmarks.append(earmark)
+
+        await db.flush()
+        balances.add_contribution(to_goals)
+        for goal_id in {c.target_id for c in calculations if c.target_type == "goal" and c.amount > 0}:
+            balances.record(db, "goal", goal_id, "update")
+        for earmark in earmarks:
+            record_change(db, "category_earmark", earmark.id, "create")
+
+        allocated = sum((c.amount for c in calculations), Decimal("0"))
+        return AllocationApplyResult(
+            amount=data.amount,
+            allocated=allocated,
+            unallocated=data.amount - allocated,
+            allocations=calculations
+        )
+
+    return await write_queue.submit(op)
 
 
 @router.get("/{rule_id}", response_model=AllocationRuleResponse)
@@ -85,7 +222,7 @@ async def get_allocation_rule(rule_id: int, db: AsyncSession = Depends(get_db)):
     rule = result.scalar_one_or_none()
     if not rule:
         raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Allocation rule not found")
-    return await rule_to_response(db, rule)
+    return rule_to_response(rule, await get_target_name(db, rule.target_type, rule.target_id))
 
 
 @router.post("", response_model=AllocationRuleResponse, status_code=status.HTTP_201_CREATED)
@@ -124,9 +261,11 @@ async def create_allocation_rule(data: AllocationRuleCreate, db: AsyncSession =
 
     rule = AllocationRule(**data.model_dump())
     db.add(rule)
+    await db.flush()
+    record_change(db, "allocation_rule", rule.id, "create")
     await db.commit()
     await db.refresh(rule)
-    return await rule_to_response(db, rule)
+    return rule_to_response(rule, await get_target_name(db, rule.target_type, rule.target_id))
 
 
 @router.patch("/{rule_id}", response_model=AllocationRuleResponse)
@@ -177,9 +316,10 @@ async def update_allocation_rule(rule_id: int, data: AllocationRuleUpdate, db: A
     for field, value in update_data.items():
         setattr(rule, field, value)
 
+    record_change(db, "allocation_rule", rule.id, "update")
     await db.commit()
     await db.refresh(rule)
-    return await rule_to_response(db, rule)
+    return rule_to_response(rule, await get_target_name(db, rule.target_type, rule.target_id))
 
 
 @router.delete("/{rule_id}", status_code=status.HTTP_204_NO_CONTENT)
@@ -190,4 +330,5 @@ async def delete_allocation_rule(rule_id: int, db: AsyncSession = Depends(get_db
         raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Allocation rule not found")
 
     await db.delete(rule)
+    record_change(db, "allocation_rule", rule_id, "delete")
     await db.commit()
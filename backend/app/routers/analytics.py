@@ -5,117 +5,140 @@ from fastapi import APIRouter, Depends, Query
 from sqlalchemy.ext.asyncio import AsyncSession
 from sqlalchemy import select, func
 
-from ..database import get_db
+from ..database import get_read_db, fan_out_scalars
 from ..models import Transaction, TransactionType, Goal, GoalContribution, Budget, Category
-from ..schemas import OverviewResponse, CategorySpending, TrendPoint, DailySpending
+from ..schemas import (
+    OverviewResponse, CategorySpending, TrendPoint, DailySpending,
+    RollingSpendingResponse, CategoryStats, MonthlySpendingResponse, SpendingAnomaly, CashFlowForecast, BalanceAsOf
+)
 from ..auth import verify_api_key
 from ..balance import get_available_balance
+from ..columnar import ResponseFormat, CompactJSONResponse
+from ..serialization import json_value
+from ..cache import ReferenceCache, get_reference_cache
+from .. import analytics_engine
+from ..cashflow import get_cash_flow_forecast
+from ..timeouts import query_budget, ANALYTICS_QUERY_BUDGET
+from ..archive import history
 
-router = APIRouter(dependencies=[Depends(verify_api_key)])
+router = APIRouter(dependencies=[Depends(verify_api_key), Depends(query_budget(ANALYTICS_QUERY_BUDGET))])
 
 
 @router.get("/overview", response_model=OverviewResponse)
 async def get_overview(
     start_date: Optional[date] = None,
-    end_date: Optional[date] = None,
-    db: AsyncSession = Depends(get_db)
+    end_date: Optional[date] = None
 ):
     if not start_date:
         start_date = date.today().replace(day=1)
     if not end_date:
         end_date = date.today()
 
-    income_query = select(func.coalesce(func.sum(Transaction.amount), 0)).where(
-        Transaction.type == TransactionType.income,
-        Transaction.date >= start_date,
-        Transaction.date <= end_date
+    source = await history(Transaction, start_date, end_date)
+    income_query = select(func.coalesce(func.sum(source.amount), 0)).where(
+        source.type == TransactionType.income,
+        source.date >= start_date,
+        source.date <= end_date
     )
-    expense_query = select(func.coalesce(func.sum(Transaction.amount), 0)).where(
-        Transaction.type == TransactionType.expense,
-        Transaction.date >= start_date,
-        Transaction.date <= end_date
+    expense_query = select(func.coalesce(func.sum(source.amount), 0)).where(
+        source.type == TransactionType.expense,
+        source.date >= start_date,
+        source.date <= end_date
     )
-    count_query = select(func.count(Transaction.id)).where(
-        Transaction.date >= start_date,
-        Transaction.date <= end_date
+    count_query = select(func.count(source.id)).where(
+        source.date >= start_date,
+        source.date <= end_date
     )
-
-    income_result = await db.execute(income_query)
-    expense_result = await db.execute(expense_query)
-    count_result = await db.execute(count_query)
-
-    total_income = Decimal(str(income_result.scalar()))
-    total_expense = Decimal(str(expense_result.scalar()))
-
     goals_query = select(func.count(Goal.id)).where(Goal.completed == False)
-    goals_result = await db.execute(goals_query)
-    active_goals = goals_result.scalar()
 
     # Total in goals (contributions)
-    contributions_result = await db.execute(
-        select(func.coalesce(func.sum(GoalContribution.amount), 0))
+    contributions = await history(GoalContribution)
+    contributions_query = select(func.coalesce(func.sum(contributions.amount), 0))
+
+    # Budgets of the current month whose spending so far exceeds the amount
+    today = date.today()
+    spent = (
+        select(Transaction.category_id, func.sum(Transaction.amount).label("spent"))
+        .where(
+            Transaction.type == TransactionType.expense,
+            Transaction.date >= today.replace(day=1),
+            Transaction.date <= today
+        )
+        .group_by(Transaction.category_id)
+        .subquery()
+    )
+    budgets_over_query = (
+        select(func.count(Budget.id))
+        .join(spent, spent.c.category_id == Budget.category_id)
+        .where(
+            Budget.month == today.month,
+            Budget.year == today.year,
+            func.round(spent.c.spent, 2) > Budget.amount
+        )
+    )
+
+    # Independent aggregates, run concurrently on separate read connections
+    income, expense, transaction_count, active_goals, in_goals, budgets_over = await fan_out_scalars(
+        income_query, expense_query, count_query, goals_query, contributions_query, budgets_over_query
     )
-    total_in_goals = Decimal(str(contributions_result.scalar()))
+
+    total_income = Decimal(str(income))
+    total_expense = Decimal(str(expense))
+    total_in_goals = Decimal(str(in_goals))
 
     # Available balance = income - expense - contributions
     available_balance = total_income - total_expense - total_in_goals
 
-    budgets_over = 0
-    budget_query = select(Budget).where(
-        Budget.month == date.today().month,
-        Budget.year == date.today().year
-    )
-    budgets_result = await db.execute(budget_query)
-    for budget in budgets_result.scalars():
-        spent_query = select(func.coalesce(func.sum(Transaction.amount), 0)).where(
-            Transaction.category_id == budget.category_id,
-            Transaction.type == TransactionType.expense,
-            Transaction.date >= date.today().replace(day=1),
-            Transaction.date <= date.today()
-        )
-        spent_result = await db.execute(spent_query)
-        spent = Decimal(str(spent_result.scalar()))
-        if spent > budget.amount:
-            budgets_over += 1
-
     return OverviewResponse(
         total_income=total_income,
         total_expense=total_expense,
         balance=total_income - total_expense,
         available_balance=available_balance,
         total_in_goals=total_in_goals,
-        transaction_count=count_result.scalar(),
+        transaction_count=transaction_count,
         active_goals=active_goals,
         budgets_over_limit=budgets_over
     )
 
 
+@router.get("/balance", response_model=BalanceAsOf)
+async def get_balance_as_of(
+    as_of: Optional[date] = None,
+    db: AsyncSession = Depends(get_read_db)
+):
+    """Available balance (income - expenses - goal contributions) at the end of `as_of` (default today)."""
+    as_of = as_of or date.today()
+    return BalanceAsOf(as_of=as_of, balance=await get_available_balance(db, as_of))
+
+
 @router.get("/by-category", response_model=List[CategorySpending])
 async def get_spending_by_category(
     start_date: Optional[date] = None,
     end_date: Optional[date] = None,
     type: TransactionType = TransactionType.expense,
-    db: AsyncSession = Depends(get_db)
+    format: ResponseFormat = ResponseFormat.rows,
+    db: AsyncSession = Depends(get_read_db)
 ):
     if not start_date:
         start_date = date.today().replace(day=1)
     if not end_date:
         end_date = date.today()
 
+    source = await history(Transaction, start_date, end_date)
     query = (
         select(
             Category.id,
             Category.name,
-            func.coalesce(func.sum(Transaction.amount), 0).label("total")
+            func.coalesce(func.sum(source.amount), 0).label("total")
         )
-        .join(Transaction, Transaction.category_id == Category.id)
+        .join(source, source.category_id == Category.id)
         .where(
-            Transaction.type == type,
-            Transaction.date >= start_date,
-            Transaction.date <= end_date
+            source.type == type,
+            source.date >= start_date,
+            source.date <= end_date
         )
         .group_by(Category.id, Category.name)
-        .order_by(func.sum(Transaction.amount).desc())
+        .order_by(func.sum(source.amount).desc())
     )
 
     result = await db.execute(query)
@@ -123,6 +146,15 @@ async def get_spending_by_category(
 
     grand_total = sum(Decimal(str(row.total)) for row in rows)
 
+    if format == ResponseFormat.columnar:
+        totals = [Decimal(str(row.total)) for row in rows]
+        return CompactJSONResponse({
+            "category_id": [row.id for row in rows],
+            "category_name": [row.name for row in rows],
+            "total": [json_value(t) for t in totals],
+            "percent": [float(t / grand_total * 100) if grand_total > 0 else 0 for t in totals],
+        })
+
     return [
         CategorySpending(
             category_id=row.id,
@@ -137,20 +169,22 @@ async def get_spending_by_category(
 @router.get("/trend", response_model=List[TrendPoint])
 async def get_trend(
     days: int = Query(default=30, ge=7, le=365),
-    db: AsyncSession = Depends(get_db)
+    format: ResponseFormat = ResponseFormat.rows,
+    db: AsyncSession = Depends(get_read_db)
 ):
     end_date = date.today()
     start_date = end_date - timedelta(days=days)
 
+    source = await history(Transaction, start_date, end_date)
     query = (
         select(
-            Transaction.date,
-            Transaction.type,
-            func.sum(Transaction.amount).label("total")
+            source.date,
+            source.type,
+            func.sum(source.amount).label("total")
         )
-        .where(Transaction.date >= start_date, Transaction.date <= end_date)
-        .group_by(Transaction.date, Transaction.type)
-        .order_by(Transaction.date)
+        .where(source.date >= start_date, source.date <= end_date)
+        .group_by(source.date, source.type)
+        .order_by(source.date)
     )
 
     result = await db.execute(query)
@@ -163,6 +197,15 @@ async def get_trend(
             data_map[date_str] = {"income": Decimal("0"), "expense": Decimal("0")}
         data_map[date_str][row.type.value] = Decimal(str(row.total))
 
+    if format == ResponseFormat.columnar:
+        dates = [(start_date + timedelta(days=i)).isoformat() for i in range((end_date - start_date).days + 1)]
+        empty = {"income": Decimal("0"), "expense": Decimal("0")}
+        return CompactJSONResponse({
+            "date": dates,
+            "income": [json_value(data_map.get(d, empty)["income"]) for d in dates],
+            "expense": [json_value(data_map.get(d, empty)["expense"]) for d in dates],
+        })
+
     current = start_date
     trend = []
     while current <= end_date:
@@ -181,23 +224,25 @@ async def get_trend(
 @router.get("/daily-spending", response_model=List[DailySpending])
 async def get_daily_spending(
     days: int = Query(default=30, ge=7, le=365),
-    db: AsyncSession = Depends(get_db)
+    format: ResponseFormat = ResponseFormat.rows,
+    db: AsyncSession = Depends(get_read_db)
 ):
     end_date = date.today()
     start_date = end_date - timedelta(days=days)
 
+    source = await history(Transaction, start_date, end_date)
     query = (
         select(
-            Transaction.date,
-            func.sum(Transaction.amount).label("total")
+            source.date,
+            func.sum(source.amount).label("total")
         )
         .where(
-            Transaction.type == TransactionType.expense,
-            Transaction.date >= start_date,
-            Transaction.date <= end_date
+            source.type == TransactionType.expense,
+            source.date >= start_date,
+            source.date <= end_date
         )
-        .group_by(Transaction.date)
-        .order_by(Transaction.date)
+        .group_by(source.date)
+        .order_by(source.date)
     )
 
     result = await db.execute(query)
@@ -205,6 +250,13 @@ async def get_daily_spending(
 
     data_map = {row.date.isoformat(): Decimal(str(row.total)) for row in rows}
 
+    if format == ResponseFormat.columnar:
+        dates = [(start_date + timedelta(days=i)).isoformat() for i in range((end_date - start_date).days + 1)]
+        return CompactJSONResponse({
+            "date": dates,
+            "amount": [json_value(data_map.get(d, Decimal("0"))) for d in dates],
+        })
+
     current = start_date
     spending = []
     while current <= end_date:
@@ -216,3 +268,72 @@ async def get_daily_spending(
         current += timedelta(days=1)
 
     return spending
+
+
+def with_category_name(item: dict, refs: ReferenceCache) -> dict:
+    # Cached engine results are shared, so names are attached to a copy
+    return {**item, "category_name": refs.category(item["category_id"]).name}
+
+
+@router.get("/stats/rolling", response_model=RollingSpendingResponse)
+async def get_rolling_spending(
+    days: int = Query(default=90, ge=7, le=730),
+    window: int = Query(default=7, ge=2, le=90),
+    db: AsyncSession = Depends(get_read_db),
+    refs: ReferenceCache = Depends(get_reference_cache)
+):
+    """Trailing `window`-day mean of daily spending per category, for each of the last `days` days."""
+    result = await analytics_engine.rolling_spending(db, days, window)
+    return {**result, "series": [with_category_name(s, refs) for s in result["series"]]}
+
+
+@router.get("/stats/categories", response_model=List[CategoryStats])
+async def get_category_stats(
+    days: int = Query(default=90, ge=7, le=730),
+    db: AsyncSession = Depends(get_read_db),
+    refs: ReferenceCache = Depends(get_reference_cache)
+):
+    """Distribution of daily spending per category over the last `days` days."""
+    stats = await analytics_engine.category_stats(db, days)
+    return [with_category_name(s, refs) for s in stats]
+
+
+@router.get("/stats/monthly", response_model=MonthlySpendingResponse)
+async def get_monthly_spending(
+    months: int = Query(default=12, ge=2, le=60),
+    db: AsyncSession = Depends(get_read_db),
+    refs: ReferenceCache = Depends(get_reference_cache)
+):
+    """Monthly spending per category with month-over-month change. The current month is month-to-date."""
+    result = await analytics_engine.monthly_spending(db, months)
+    return {**result, "series": [with_category_name(s, refs) for s in result["series"]]}
+
+
+@router.get("/stats/anomalies", response_model=List[SpendingAnomaly])
+async def get_spending_anomalies(
+    days: int = Query(default=30, ge=1, le=365),
+    window: int = Query(default=30, ge=7, le=180),
+    threshold: float = Query(default=3.0, gt=0),
+    db: AsyncSession = Depends(get_read_db),
+    refs: ReferenceCache = Depends(get_reference_cache)
+):
+    """
+    Days in the last `days` where a category's spending is at least
+    `threshold` standard deviations above its previous `window` days.
+    """
+    anomalies = await analytics_engine.spending_anomalies(db, days, window, threshold)
+    return [with_category_name(a, refs) for a in anomalies]
+
+
+@router.get("/cash-flow", response_model=CashFlowForecast)
+async def get_cash_flow(
+    days: int = Query(default=90, ge=1, le=730),
+    db: AsyncSession = Depends(get_read_db),
+    refs: ReferenceCache = Depends(get_reference_cache)
+):
+    """
+    Daily projected balances for the next `days` days from active recurring
+    rules, overall and per account. Day 0 is today, including any recurring
+    occurrences that are due but not processed yet.
+    """
+    return await get_cash_flow_forecast(db, refs, days)
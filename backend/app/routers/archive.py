@@ -0,0 +1,18 @@
+from typing import List
+from fastapi import APIRouter, Depends
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy import select
+
+from ..database import get_read_db
+from ..models import ClosedYear
+from ..schemas import ClosedYearResponse
+from ..auth import verify_api_key
+
+router = APIRouter(dependencies=[Depends(verify_api_key)])
+
+
+@router.get("", response_model=List[ClosedYearResponse])
+async def get_closed_years(db: AsyncSession = Depends(get_read_db)):
+    """Closed years; entries dated in them can no longer be written. Close more with POST /api/jobs/close-year."""
+    result = await db.execute(select(ClosedYear).order_by(ClosedYear.year))
+    return result.scalars().all()
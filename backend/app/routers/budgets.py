@@ -1,38 +1,194 @@
-from typing import List, Optional
-from datetime import date
+from typing import Any, Dict, List, Optional
+from datetime import date, datetime, timedelta
 from decimal import Decimal
+import numpy as np
 from fastapi import APIRouter, Depends, HTTPException, status, Query
+from fastapi.responses import JSONResponse
 from sqlalchemy.ext.asyncio import AsyncSession
-from sqlalchemy import select, func
-from sqlalchemy.orm import selectinload
+from sqlalchemy import select, func, case, cast, literal, null, union_all, Integer
+from sqlalchemy.dialects.sqlite import insert as sqlite_insert
 
-from ..database import get_db
-from ..models import Budget, Transaction, TransactionType
-from ..schemas import BudgetCreate, BudgetUpdate, BudgetResponse
+from ..database import get_db, get_read_db, ShardLocal
+from ..models import Budget, Transaction, TransactionType, RecurringTransaction
+from ..schemas import (
+    BudgetCreate, BudgetUpdate, BudgetResponse, BudgetCopy, BudgetCopyResult, BudgetMatrixResponse
+)
 from ..auth import verify_api_key
+from ..events import record_change
+from ..cache import ReferenceCache, get_reference_cache
+from ..fieldsets import Fieldset
+from ..generation import GenerationCache, mark_written
+from ..sync import reserve_versions
+from ..archive import history
+from .recurring import get_next_date
 
 router = APIRouter(dependencies=[Depends(verify_api_key)])
 
+CENTS = Decimal("0.01")
 
-async def get_budget_with_spending(budget: Budget, db: AsyncSession) -> BudgetResponse:
-    start_date = date(budget.year, budget.month, 1)
-    if budget.month == 12:
-        end_date = date(budget.year + 1, 1, 1)
+
+def month_bounds(year: int, month: int):
+    """First day of the month and first day of the following month."""
+    start_date = date(year, month, 1)
+    if month == 12:
+        end_date = date(year + 1, 1, 1)
     else:
-        end_date = date(budget.year, budget.month + 1, 1)
+        end_date = date(year, month + 1, 1)
+    return start_date, end_date
+
+
+async def get_spent_by_category(
+    db: AsyncSession,
+    year: int,
+    month: int,
+    category_ids: Optional[List[int]] = None
+) -> Dict[int, Decimal]:
+    """Expense totals per category for one month, in a single grouped query."""
+    start_date, end_date = month_bounds(year, month)
+    source = await history(Transaction, start_date, end_date)
+    query = (
+        select(source.category_id, func.sum(source.amount).label("spent"))
+        .where(
+            source.type == TransactionType.expense,
+            source.date >= start_date,
+            source.date < end_date
+        )
+        .group_by(source.category_id)
+    )
+    if category_ids is not None:
+        query = query.where(source.category_id.in_(category_ids))
+    result = await db.execute(query)
+    return {row.category_id: Decimal(str(row.spent)) for row in result}
+
+
+FORECAST_HISTORY_YEARS = 3
+
+
+async def get_history_remaining(
+    db: AsyncSession,
+    year: int,
+    month: int,
+    after_day: int,
+    category_ids: List[int]
+) -> Dict[int, List[Decimal]]:
+    """
+    Spending after `after_day` of the same month in previous years, per category.
+
+    One grouped query; each list holds one total per earlier year in which
+    the category had any spending that month.
+    """
+    first = date(year - FORECAST_HISTORY_YEARS, month, 1)
+    source = await history(Transaction, first, date(year, month, 1))
+    day = cast(func.strftime("%d", source.date), Integer)
+    query = (
+        select(
+            source.category_id,
+            func.sum(case((day > after_day, source.amount), else_=0)).label("rest")
+        )
+        .where(
+            source.type == TransactionType.expense,
+            source.category_id.in_(category_ids),
+            func.strftime("%m", source.date) == f"{month:02d}",
+            source.date >= first,
+            source.date < date(year, month, 1)
+        )
+        .group_by(source.category_id, func.strftime("%Y", source.date))
+    )
+    result = await db.execute(query)
+    remaining: Dict[int, List[Decimal]] = {}
+    for row in result:
+        remaining.setdefault(row.category_id, []).append(Decimal(str(row.rest)))
+    return remaining
+
+
+async def get_scheduled_by_category(
+    db: AsyncSession,
+    start_date: date,
+    end_date: date,
+    category_ids: List[int]
+) -> Dict[int, Decimal]:
+    """Expense occurrences of active recurring rules dated in [start_date, end_date), per category."""
+    result = await db.execute(
+        select(RecurringTransaction).where(
+            RecurringTransaction.is_active == True,
+            RecurringTransaction.type == TransactionType.expense,
+            RecurringTransaction.category_id.in_(category_ids),
+            RecurringTransaction.next_date < end_date
+        )
+    )
+    scheduled: Dict[int, Decimal] = {}
+    for recurring in result.scalars():
+        occurrence = recurring.next_date
+        while occurrence < end_date:
+            if occurrence >= start_date:
+                scheduled[recurring.category_id] = scheduled.get(recurring.category_id, Decimal("0")) + recurring.amount
+            next_occurrence = get_next_date(occurrence, recurring.interval)
+            if next_occurrence == occurrence:
+                break
+            occurrence = next_occurrence
+    return scheduled
+
+
+async def get_projected_by_category(
+    db: AsyncSession,
+    year: int,
+    month: int,
+    spent_map: Dict[int, Decimal],
+    category_ids: List[int]
+) -> Dict[int, Decimal]:
+    """
+    Projected month-end spending for every category at once.
 
-    spent_query = select(func.coalesce(func.sum(Transaction.amount), 0)).where(
-        Transaction.category_id == budget.category_id,
-        Transaction.type == TransactionType.expense,
-        Transaction.date >= start_date,
-        Transaction.date < end_date
+    The unspent part of the month is estimated from the current run-rate,
+    blended with what was spent in the rest of the same month in earlier
+    years (the run-rate weighs more as the month progresses), plus
+    recurring expenses still scheduled this month. Past months project to
+    what was actually spent.
+    """
+    if not category_ids:
+        return {}
+    start_date, end_date = month_bounds(year, month)
+    today = date.today()
+    if end_date <= today:
+        return {c: spent_map.get(c, Decimal("0")) for c in category_ids}
+
+    days_in_month = (end_date - start_date).days
+    elapsed = max((today - start_date).days + 1, 0)
+    history = await get_history_remaining(db, year, month, elapsed, category_ids)
+    scheduled_map = await get_scheduled_by_category(
+        db, max(start_date, today + timedelta(days=1)), end_date, category_ids
     )
-    result = await db.execute(spent_query)
-    spent = Decimal(str(result.scalar()))
 
-    remaining = budget.amount - spent
-    percent_used = float(spent / budget.amount * 100) if budget.amount > 0 else 0
+    spent = np.array([float(spent_map.get(c, 0)) for c in category_ids])
+    scheduled = np.array([float(scheduled_map.get(c, 0)) for c in category_ids])
+    past = np.array([float(np.mean(history[c])) if c in history else np.nan for c in category_ids])
+
+    run_rate = spent / elapsed * (days_in_month - elapsed) if elapsed else np.zeros_like(spent)
+    weight = elapsed / days_in_month
+    rest = np.where(np.isnan(past), run_rate, weight * run_rate + (1 - weight) * np.nan_to_num(past))
+    projected = np.round(spent + rest + scheduled, 2)
+    return {c: Decimal(str(p)).quantize(CENTS) for c, p in zip(category_ids, projected.tolist())}
+
 
+def spending_fields(amount: Decimal, spent: Decimal, projected: Optional[Decimal] = None) -> Dict[str, Any]:
+    percent_used = float(spent / amount * 100) if amount > 0 else 0
+    fields = {
+        "spent": spent,
+        "remaining": amount - spent,
+        "percent_used": min(percent_used, 100.0)
+    }
+    if projected is not None:
+        fields["projected_spent"] = projected
+        fields["projected_overrun"] = projected > amount
+    return fields
+
+
+def budget_to_response(
+    budget: Budget,
+    spent: Decimal,
+    refs: ReferenceCache,
+    projected: Optional[Decimal] = None
+) -> BudgetResponse:
     return BudgetResponse(
         id=budget.id,
         category_id=budget.category_id,
@@ -40,48 +196,233 @@ async def get_budget_with_spending(budget: Budget, db: AsyncSession) -> BudgetRe
         month=budget.month,
         year=budget.year,
         created_at=budget.created_at,
-        category=budget.category,
-        spent=spent,
-        remaining=remaining,
-        percent_used=min(percent_used, 100.0)
+        category=refs.category(budget.category_id),
+        **spending_fields(budget.amount, spent, projected)
     )
 
 
+async def get_budgets_with_spending(
+    budgets: List[Budget],
+    db: AsyncSession,
+    refs: ReferenceCache,
+    year: int,
+    month: int
+) -> List[BudgetResponse]:
+    """Responses for budgets of one month: one spend query and one batched forecast."""
+    category_ids = [b.category_id for b in budgets]
+    spent_map = await get_spent_by_category(db, year, month, category_ids)
+    projected_map = await get_projected_by_category(db, year, month, spent_map, category_ids)
+    return [
+        budget_to_response(b, spent_map.get(b.category_id, Decimal("0")), refs, projected_map[b.category_id])
+        for b in budgets
+    ]
+
+
+async def get_budget_with_spending(budget: Budget, db: AsyncSession, refs: ReferenceCache) -> BudgetResponse:
+    responses = await get_budgets_with_spending([budget], db, refs, budget.year, budget.month)
+    return responses[0]
+
+
+BUDGET_COLUMNS = (
+    "category_id", "amount", "month", "year", "created_at",
+    "spent", "remaining", "percent_used", "projected_spent", "projected_overrun"
+)
+BUDGET_FORECAST_FIELDS = ("projected_spent", "projected_overrun")
+BUDGET_SPENDING_FIELDS = ("spent", "remaining", "percent_used") + BUDGET_FORECAST_FIELDS
+BUDGET_RELATIONS = ("category",)
+
+
 @router.get("", response_model=List[BudgetResponse])
 async def get_budgets(
     month: Optional[int] = Query(default=None, ge=1, le=12),
     year: Optional[int] = None,
-    db: AsyncSession = Depends(get_db)
+    fields: Optional[str] = None,
+    expand: Optional[str] = None,
+    db: AsyncSession = Depends(get_read_db),
+    refs: ReferenceCache = Depends(get_reference_cache)
 ):
-    query = select(Budget).options(selectinload(Budget.category))
-
     if month is None:
         month = date.today().month
     if year is None:
         year = date.today().year
 
-    query = query.where(Budget.month == month, Budget.year == year)
-    result = await db.execute(query)
-    budgets = result.scalars().all()
+    fieldset = Fieldset.parse(fields, expand, BUDGET_COLUMNS, BUDGET_RELATIONS)
+    if fieldset is None:
+        result = await db.execute(select(Budget).where(Budget.month == month, Budget.year == year))
+        return await get_budgets_with_spending(result.scalars().all(), db, refs, year, month)
 
-    return [await get_budget_with_spending(b, db) for b in budgets]
+    with_spending = fieldset.wants_any(BUDGET_SPENDING_FIELDS)
+    required = ["category_id"] if with_spending or "category" in fieldset.relations else []
+    if with_spending:
+        required.append("amount")
+    result = await db.execute(
+        select(*fieldset.select_columns(Budget, required)).where(Budget.month == month, Budget.year == year)
+    )
+    rows = result.all()
+    spent_map = await get_spent_by_category(db, year, month) if with_spending else {}
+    projected_map = {}
+    if fieldset.wants_any(BUDGET_FORECAST_FIELDS):
+        projected_map = await get_projected_by_category(
+            db, year, month, spent_map, [row.category_id for row in rows]
+        )
 
+    items = []
+    for row in rows:
+        values = dict(row._mapping)
+        if with_spending:
+            values.update(spending_fields(
+                values["amount"],
+                spent_map.get(values["category_id"], Decimal("0")),
+                projected_map.get(values["category_id"])
+            ))
+        related = {}
+        if "category" in fieldset.relations:
+            related["category"] = refs.category(values["category_id"])
+        items.append(fieldset.project(values, related))
+    return JSONResponse(items)
 
-@router.get("/{budget_id}", response_model=BudgetResponse)
-async def get_budget(budget_id: int, db: AsyncSession = Depends(get_db)):
+
+MATRIX_MAX_MONTHS = 60
+MATRIX_SOURCE_TABLES = ("budgets", "transactions", "categories")
+
+matrix_cache = ShardLocal(GenerationCache)
+
+
+def parse_period(value: str, name: str) -> int:
+    """'YYYY-MM' -> months since year 0, so periods can be compared and counted."""
+    try:
+        year, month = (int(part) for part in value.split("-"))
+        if not 1 <= month <= 12:
+            raise ValueError
+    except ValueError:
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail=f"{name} must be a month in YYYY-MM format"
+        )
+    return year * 12 + month - 1
+
+
+async def build_budget_matrix(db: AsyncSession, refs: ReferenceCache, first: int, last: int) -> BudgetMatrixResponse:
+    months = [(p // 12, p % 12 + 1) for p in range(first, last + 1)]
+    start_date = date(*months[0], 1)
+    end_date = month_bounds(*months[-1])[1]
+    period = Budget.year * 12 + Budget.month - 1
+    budgeted = select(Budget.category_id).where(period >= first, period <= last)
+
+    source = await history(Transaction, start_date, end_date)
+    tx_year = cast(func.strftime("%Y", source.date), Integer)
+    tx_month = cast(func.strftime("%m", source.date), Integer)
+    cells = union_all(
+        select(
+            Budget.category_id.label("category_id"),
+            Budget.year.label("year"),
+            Budget.month.label("month"),
+            Budget.amount.label("budget"),
+            literal(0).label("spent")
+        ).where(period >= first, period <= last),
+        select(
+            source.category_id,
+            tx_year,
+            tx_month,
+            null(),
+            source.amount
+        ).where(
+            source.type == TransactionType.expense,
+            source.date >= start_date,
+            source.date < end_date,
+            source.category_id.in_(budgeted)
+        )
+    ).subquery()
     result = await db.execute(
-        select(Budget)
-        .options(selectinload(Budget.category))
-        .where(Budget.id == budget_id)
+        select(
+            cells.c.category_id,
+            cells.c.year,
+            cells.c.month,
+            func.sum(cells.c.budget).label("budget"),
+            func.sum(cells.c.spent).label("spent")
+        ).group_by(cells.c.category_id, cells.c.year, cells.c.month)
+    )
+
+    column = {m: i for i, m in enumerate(months)}
+    rows: Dict[int, Dict[str, list]] = {}
+    for cell in result:
+        row = rows.setdefault(cell.category_id, {
+            "budget": [None] * len(months),
+            "spent": [Decimal("0.00")] * len(months),
+        })
+        i = column[(cell.year, cell.month)]
+        row["budget"][i] = Decimal(str(cell.budget)).quantize(CENTS) if cell.budget is not None else None
+        row["spent"][i] = Decimal(str(cell.spent)).quantize(CENTS)
+
+    total_budget = [Decimal("0.00")] * len(months)
+    total_spent = [Decimal("0.00")] * len(months)
+    for row in rows.values():
+        row["variance"] = [b - s if b is not None else None for b, s in zip(row["budget"], row["spent"])]
+        for i, (b, s) in enumerate(zip(row["budget"], row["spent"])):
+            total_budget[i] += b or 0
+            total_spent[i] += s
+
+    return BudgetMatrixResponse(
+        months=[f"{y:04d}-{m:02d}" for y, m in months],
+        rows=[
+            {"category_id": category_id, "category": refs.category(category_id), **rows[category_id]}
+            for category_id in sorted(rows, key=lambda c: refs.category(c).name)
+        ],
+        total_budget=total_budget,
+        total_spent=total_spent,
+        total_variance=[b - s for b, s in zip(total_budget, total_spent)]
+    )
+
+
+@router.get("/matrix", response_model=BudgetMatrixResponse)
+async def get_budget_matrix(
+    from_month: Optional[str] = Query(default=None, alias="from"),
+    to_month: Optional[str] = Query(default=None, alias="to"),
+    db: AsyncSession = Depends(get_read_db),
+    refs: ReferenceCache = Depends(get_reference_cache)
+):
+    """
+    Category x month grid of budget, spent and variance (budget - spent)
+    for `from`..`to` inclusive, as YYYY-MM. Defaults to the current year.
+
+    Categories appear if they have a budget anywhere in the range; months
+    without a budget have a null budget and variance.
+    """
+    year = date.today().year
+    first = parse_period(from_month, "from") if from_month else year * 12
+    last = parse_period(to_month, "to") if to_month else year * 12 + 11
+    if last < first:
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail="from must not be after to")
+    if last - first + 1 > MATRIX_MAX_MONTHS:
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail=f"Range cannot exceed {MATRIX_MAX_MONTHS} months"
+        )
+
+    return await matrix_cache.get_or_compute(
+        (first, last), MATRIX_SOURCE_TABLES, lambda: build_budget_matrix(db, refs, first, last)
     )
+
+
+@router.get("/{budget_id}", response_model=BudgetResponse)
+async def get_budget(
+    budget_id: int,
+    db: AsyncSession = Depends(get_db),
+    refs: ReferenceCache = Depends(get_reference_cache)
+):
+    result = await db.execute(select(Budget).where(Budget.id == budget_id))
     budget = result.scalar_one_or_none()
     if not budget:
         raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Budget not found")
-    return await get_budget_with_spending(budget, db)
+    return await get_budget_with_spending(budget, db, refs)
 
 
 @router.post("", response_model=BudgetResponse, status_code=status.HTTP_201_CREATED)
-async def create_budget(data: BudgetCreate, db: AsyncSession = Depends(get_db)):
+async def create_budget(
+    data: BudgetCreate,
+    db: AsyncSession = Depends(get_db),
+    refs: ReferenceCache = Depends(get_reference_cache)
+):
     if data.amount <= 0:
         raise HTTPException(
             status_code=status.HTTP_400_BAD_REQUEST,
@@ -103,31 +444,102 @@ async def create_budget(data: BudgetCreate, db: AsyncSession = Depends(get_db)):
 
     budget = Budget(**data.model_dump())
     db.add(budget)
+    await db.flush()
+    record_change(db, "budget", budget.id, "create")
     await db.commit()
     await db.refresh(budget)
+    return await get_budget_with_spending(budget, db, refs)
+
+
+@router.post("/copy", response_model=BudgetCopyResult, status_code=status.HTTP_201_CREATED)
+async def copy_budgets(
+    data: BudgetCopy,
+    db: AsyncSession = Depends(get_db),
+    refs: ReferenceCache = Depends(get_reference_cache)
+):
+    """
+    Copy every budget of the source month to the target month.
+
+    Categories that already have a budget in the target month are skipped.
+    With `rollover`, each copied amount is increased by what was left
+    unspent of the source budget.
+    """
+    for month in (data.source_month, data.target_month):
+        if not 1 <= month <= 12:
+            raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail="Month must be between 1 and 12")
+    if (data.source_month, data.source_year) == (data.target_month, data.target_year):
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail="Source and target period must differ"
+        )
+
+    in_source = (Budget.month == data.source_month, Budget.year == data.source_year)
+    source_count = (await db.execute(select(func.count(Budget.id)).where(*in_source))).scalar()
+    if not source_count:
+        return BudgetCopyResult(created=0, skipped=0, budgets=[])
+
+    amount = Budget.amount
+    if data.rollover:
+        start_date, end_date = month_bounds(data.source_year, data.source_month)
+        source = await history(Transaction, start_date, end_date)
+        spent = (
+            select(source.category_id, func.sum(source.amount).label("spent"))
+            .where(
+                source.type == TransactionType.expense,
+                source.date >= start_date,
+                source.date < end_date
+            )
+            .group_by(source.category_id)
+            .subquery()
+        )
+        amount = func.round(Budget.amount + func.max(Budget.amount - func.coalesce(spent.c.spent, 0), 0), 2)
+
+    # Versions are reserved for every source row; rows skipped on conflict just leave gaps
+    first_version = await reserve_versions(db, source_count)
+    rows = select(
+        Budget.category_id,
+        amount,
+        literal(data.target_month),
+        literal(data.target_year),
+        literal(datetime.utcnow()),
+        first_version - 1 + func.row_number().over(order_by=Budget.id)
+    ).where(*in_source)
+    if data.rollover:
+        rows = rows.outerjoin(spent, spent.c.category_id == Budget.category_id)
 
     result = await db.execute(
-        select(Budget)
-        .options(selectinload(Budget.category))
-        .where(Budget.id == budget.id)
+        sqlite_insert(Budget)
+        .from_select(["category_id", "amount", "month", "year", "created_at", "version"], rows)
+        .on_conflict_do_nothing(index_elements=["category_id", "month", "year"])
+        .returning(Budget.id)
+    )
+    created_ids = result.scalars().all()
+    mark_written(db, "budgets")
+    for budget_id in created_ids:
+        record_change(db, "budget", budget_id, "create")
+    await db.commit()
+
+    result = await db.execute(select(Budget).where(Budget.id.in_(created_ids)).order_by(Budget.id))
+    budgets = await get_budgets_with_spending(
+        result.scalars().all(), db, refs, data.target_year, data.target_month
     )
-    budget = result.scalar_one()
-    return await get_budget_with_spending(budget, db)
+    return BudgetCopyResult(created=len(created_ids), skipped=source_count - len(created_ids), budgets=budgets)
 
 
 @router.patch("/{budget_id}", response_model=BudgetResponse)
-async def update_budget(budget_id: int, data: BudgetUpdate, db: AsyncSession = Depends(get_db)):
+async def update_budget(
+    budget_id: int,
+    data: BudgetUpdate,
+    db: AsyncSession = Depends(get_db),
+    refs: ReferenceCache = Depends(get_reference_cache)
+):
     if data.amount is not None and data.amount <= 0:
         raise HTTPException(
             status_code=status.HTTP_400_BAD_REQUEST,
             detail="Budget amount must be greater than 0"
         )
 
-    result = await db.execute(
-        select(Budget)
-        .options(selectinload(Budget.category))
-        .where(Budget.id == budget_id)
-    )
+    result = await db.execute(select(Budget).where(Budget.id == budget_id))
     budget = result.scalar_one_or_none()
     if not budget:
         raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Budget not found")
@@ -136,9 +548,10 @@ async def update_budget(budget_id: int, data: BudgetUpdate, db: AsyncSession = D
     for field, value in update_data.items():
         setattr(budget, field, value)
 
+    record_change(db, "budget", budget.id, "update")
     await db.commit()
     await db.refresh(budget)
-    return await get_budget_with_spending(budget, db)
+    return await get_budget_with_spending(budget, db, refs)
 
 
 @router.delete("/{budget_id}", status_code=status.HTTP_204_NO_CONTENT)
@@ -149,4 +562,5 @@ async def delete_budget(budget_id: int, db: AsyncSession = Depends(get_db)):
         raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Budget not found")
 
     await db.delete(budget)
+    record_change(db, "budget", budget_id, "delete")
     await db.commit()
@@ -7,20 +7,21 @@ from ..database import get_db
 from ..models import Category, Transaction, Budget, RecurringTransaction
 from ..schemas import CategoryCreate, CategoryUpdate, CategoryResponse
 from ..auth import verify_api_key
+from ..events import record_change
+from ..cache import ReferenceCache, get_reference_cache, reference_cache
+from ..archive import history
 
 router = APIRouter(dependencies=[Depends(verify_api_key)])
 
 
 @router.get("", response_model=List[CategoryResponse])
-async def get_categories(db: AsyncSession = Depends(get_db)):
-    result = await db.execute(select(Category).order_by(Category.name))
-    return result.scalars().all()
+async def get_categories(refs: ReferenceCache = Depends(get_reference_cache)):
+    return sorted(refs.categories.values(), key=lambda c: c.name)
 
 
 @router.get("/{category_id}", response_model=CategoryResponse)
-async def get_category(category_id: int, db: AsyncSession = Depends(get_db)):
-    result = await db.execute(select(Category).where(Category.id == category_id))
-    category = result.scalar_one_or_none()
+async def get_category(category_id: int, refs: ReferenceCache = Depends(get_reference_cache)):
+    category = refs.categories.get(category_id)
     if not category:
         raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Category not found")
     return category
@@ -30,8 +31,11 @@ async def get_category(category_id: int, db: AsyncSession = Depends(get_db)):
 async def create_category(data: CategoryCreate, db: AsyncSession = Depends(get_db)):
     category = Category(**data.model_dump())
     db.add(category)
+    await db.flush()
+    record_change(db, "category", category.id, "create")
     await db.commit()
     await db.refresh(category)
+    reference_cache.invalidate()
     return category
 
 
@@ -46,8 +50,10 @@ async def update_category(category_id: int, data: CategoryUpdate, db: AsyncSessi
     for field, value in update_data.items():
         setattr(category, field, value)
 
+    record_change(db, "category", category.id, "update")
     await db.commit()
     await db.refresh(category)
+    reference_cache.invalidate()
     return category
 
 
@@ -59,7 +65,8 @@ async def delete_category(category_id: int, db: AsyncSession = Depends(get_db)):
         raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Category not found")
 
     # Check for related records
-    tx_check = await db.execute(select(Transaction.id).where(Transaction.category_id == category_id).limit(1))
+    transactions = await history(Transaction)
+    tx_check = await db.execute(select(transactions.id).where(transactions.category_id == category_id).limit(1))
     if tx_check.scalar_one_or_none():
         raise HTTPException(
             status_code=status.HTTP_400_BAD_REQUEST,
@@ -81,4 +88,6 @@ async def delete_category(category_id: int, db: AsyncSession = Depends(get_db)):
         )
 
     await db.delete(category)
+    record_change(db, "category", category_id, "delete")
     await db.commit()
+    reference_cache.invalidate()
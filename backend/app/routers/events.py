@@ -0,0 +1,34 @@
+import asyncio
+from fastapi import APIRouter, Depends, Request
+from fastapi.responses import StreamingResponse
+
+from ..auth import verify_stream_api_key
+from ..events import broker
+
+router = APIRouter(dependencies=[Depends(verify_stream_api_key)])
+
+KEEPALIVE_SECONDS = 15
+
+
+@router.get("")
+async def stream_events(request: Request):
+    subscription = broker.subscribe()
+
+    async def stream():
+        try:
+            yield "retry: 3000\n\n"
+            while not await request.is_disconnected():
+                try:
+                    change = await asyncio.wait_for(subscription.get(), timeout=KEEPALIVE_SECONDS)
+                except asyncio.TimeoutError:
+                    yield ": keep-alive\n\n"
+                    continue
+                yield f"id: {change.seq}\nevent: change\ndata: {change.to_json()}\n\n"
+        finally:
+            broker.unsubscribe(subscription)
+
+    return StreamingResponse(
+        stream(),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+    )
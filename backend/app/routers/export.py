@@ -0,0 +1,52 @@
+import os
+import tempfile
+from datetime import date
+from typing import Optional
+
+from fastapi import APIRouter, Depends, Query
+from fastapi.responses import FileResponse, StreamingResponse
+from starlette.background import BackgroundTask
+
+from ..auth import verify_api_key
+from ..export import ExportDataset, ExportFormat, stream_arrow, write_export
+from ..shards import held_shard_stream
+
+router = APIRouter(dependencies=[Depends(verify_api_key)])
+
+ARROW_MEDIA_TYPE = "application/vnd.apache.arrow.stream"
+PARQUET_MEDIA_TYPE = "application/vnd.apache.parquet"
+
+
+@router.get("/{dataset}")
+async def export_dataset(
+    dataset: ExportDataset,
+    format: ExportFormat = ExportFormat.arrow,
+    start_date: Optional[date] = None,
+    end_date: Optional[date] = None
+):
+    """
+    Bulk export of a ledger table for offline analysis.
+
+    `arrow` streams an Arrow IPC stream batch by batch; `parquet` is written
+    to a temporary file first because the footer needs the whole table.
+    """
+    if format == ExportFormat.arrow:
+        return StreamingResponse(
+            held_shard_stream(stream_arrow(dataset, start_date, end_date)),
+            media_type=ARROW_MEDIA_TYPE,
+            headers={"Content-Disposition": f'attachment; filename="{dataset.value}.arrow"'}
+        )
+
+    fd, path = tempfile.mkstemp(suffix=".parquet")
+    os.close(fd)
+    try:
+        await write_export(dataset, path, format, start_date, end_date)
+    except Exception:
+        os.unlink(path)
+        raise
+    return FileResponse(
+        path,
+        media_type=PARQUET_MEDIA_TYPE,
+        filename=f"{dataset.value}.parquet",
+        background=BackgroundTask(os.unlink, path)
+    )
@@ -5,14 +5,16 @@ from sqlalchemy.ext.asyncio import AsyncSession
 from sqlalchemy import select
 from sqlalchemy.orm import selectinload
 
-from ..database import get_db
+from ..database import get_db, get_read_db
 from ..models import Goal, GoalContribution
 from ..schemas import (
     GoalCreate, GoalUpdate, GoalResponse,
     GoalContributionCreate, GoalContributionResponse
 )
 from ..auth import verify_api_key
-from ..balance import get_available_balance
+from ..events import record_change
+from ..write_queue import BalanceState, write_queue
+from ..archive import history
 
 router = APIRouter(dependencies=[Depends(verify_api_key)])
 
@@ -34,7 +36,7 @@ def goal_to_response(goal: Goal) -> GoalResponse:
 
 
 @router.get("", response_model=List[GoalResponse])
-async def get_goals(db: AsyncSession = Depends(get_db)):
+async def get_goals(db: AsyncSession = Depends(get_read_db)):
     result = await db.execute(select(Goal).order_by(Goal.created_at.desc()))
     goals = result.scalars().all()
     return [goal_to_response(g) for g in goals]
@@ -53,6 +55,8 @@ async def get_goal(goal_id: int, db: AsyncSession = Depends(get_db)):
 async def create_goal(data: GoalCreate, db: AsyncSession = Depends(get_db)):
     goal = Goal(**data.model_dump())
     db.add(goal)
+    await db.flush()
+    record_change(db, "goal", goal.id, "create")
     await db.commit()
     await db.refresh(goal)
     return goal_to_response(goal)
@@ -69,6 +73,7 @@ async def update_goal(goal_id: int, data: GoalUpdate, db: AsyncSession = Depends
     for field, value in update_data.items():
         setattr(goal, field, value)
 
+    record_change(db, "goal", goal.id, "update")
     await db.commit()
     await db.refresh(goal)
     return goal_to_response(goal)
@@ -82,11 +87,12 @@ async def delete_goal(goal_id: int, db: AsyncSession = Depends(get_db)):
         raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Goal not found")
 
     await db.delete(goal)
+    record_change(db, "goal", goal_id, "delete")
     await db.commit()
 
 
 @router.post("/{goal_id}/contribute", response_model=GoalResponse)
-async def contribute_to_goal(goal_id: int, data: GoalContributionCreate, db: AsyncSession = Depends(get_db)):
+async def contribute_to_goal(goal_id: int, data: GoalContributionCreate):
     # Validate amount
     if data.amount <= 0:
         raise HTTPException(
@@ -94,47 +100,52 @@ async def contribute_to_goal(goal_id: int, data: GoalContributionCreate, db: Asy
             detail="Amount must be greater than 0"
         )
 
-    # Check available balance
-    available = await get_available_balance(db)
-    if data.amount > available:
-        raise HTTPException(
-            status_code=status.HTTP_400_BAD_REQUEST,
-            detail=f"Insufficient balance. Available: {available}, requested: {data.amount}"
-        )
-
-    result = await db.execute(select(Goal).where(Goal.id == goal_id))
-    goal = result.scalar_one_or_none()
-    if not goal:
-        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Goal not found")
-
-    if goal.completed:
-        raise HTTPException(
-            status_code=status.HTTP_400_BAD_REQUEST,
-            detail="Cannot contribute to a completed goal"
-        )
-
-    contribution = GoalContribution(goal_id=goal_id, amount=data.amount, note=data.note)
-    db.add(contribution)
-
-    goal.current_amount += data.amount
-    if goal.current_amount >= goal.target_amount:
-        goal.completed = True
-
-    await db.commit()
-    await db.refresh(goal)
+    async def op(db: AsyncSession, balances: BalanceState) -> Goal:
+        # Check available balance
+        if data.amount > balances.available:
+            raise HTTPException(
+                status_code=status.HTTP_400_BAD_REQUEST,
+                detail=f"Insufficient balance. Available: {balances.available}, requested: {data.amount}"
+            )
+
+        result = await db.execute(select(Goal).where(Goal.id == goal_id))
+        goal = result.scalar_one_or_none()
+        if not goal:
+            raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Goal not found")
+
+        if goal.completed:
+            raise HTTPException(
+                status_code=status.HTTP_400_BAD_REQUEST,
+                detail="Cannot contribute to a completed goal"
+            )
+
+        contribution = GoalContribution(goal_id=goal_id, amount=data.amount, note=data.note)
+        db.add(contribution)
+
+        goal.current_amount += data.amount
+        if goal.current_amount >= goal.target_amount:
+            goal.completed = True
+
+        await db.flush()
+        balances.add_contribution(data.amount)
+        balances.record(db, "goal", goal.id, "update")
+        return goal
+
+    goal = await write_queue.submit(op)
     return goal_to_response(goal)
 
 
 @router.get("/{goal_id}/history", response_model=List[GoalContributionResponse])
-async def get_goal_history(goal_id: int, db: AsyncSession = Depends(get_db)):
+async def get_goal_history(goal_id: int, db: AsyncSession = Depends(get_read_db)):
     result = await db.execute(select(Goal).where(Goal.id == goal_id))
     goal = result.scalar_one_or_none()
     if not goal:
         raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Goal not found")
 
+    contributions = await history(GoalContribution)
     result = await db.execute(
-        select(GoalContribution)
-        .where(GoalContribution.goal_id == goal_id)
-        .order_by(GoalContribution.date.desc())
+        select(contributions)
+        .where(contributions.goal_id == goal_id)
+        .order_by(contributions.date.desc())
     )
     return result.scalars().all()
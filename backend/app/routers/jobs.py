@@ -0,0 +1,152 @@
+import asyncio
+import json
+import os
+import shutil
+from datetime import date
+from typing import List, Optional
+
+from fastapi import APIRouter, Depends, HTTPException, status, Query, UploadFile, File
+from fastapi.responses import FileResponse
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy import select
+
+from ..database import get_db
+from ..models import Job, JobKind, JobStatus
+from ..schemas import ExportJobCreate, CloseYearJobCreate, JobResponse
+from ..auth import verify_api_key
+from ..export import ExportDataset, ExportFormat
+from ..jobs import FINISHED_STATUSES, create_job, cancel_job, job_runner, jobs_dir
+
+router = APIRouter(dependencies=[Depends(verify_api_key)])
+
+
+def job_to_response(job: Job) -> JobResponse:
+    progress = None
+    if job.total:
+        progress = round(min(job.processed / job.total * 100, 100.0), 1)
+    elif job.total == 0 and job.status == JobStatus.succeeded:
+        progress = 100.0
+    return JobResponse(
+        id=job.id,
+        kind=job.kind,
+        status=job.status,
+        processed=job.processed,
+        total=job.total,
+        progress_percent=progress,
+        result=json.loads(job.result) if job.result else None,
+        error=job.error,
+        has_artifact=job.artifact_path is not None,
+        cancel_requested=job.cancel_requested,
+        created_at=job.created_at,
+        started_at=job.started_at,
+        finished_at=job.finished_at
+    )
+
+
+async def get_job_or_404(db: AsyncSession, job_id: int) -> Job:
+    result = await db.execute(select(Job).where(Job.id == job_id))
+    job = result.scalar_one_or_none()
+    if not job:
+        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Job not found")
+    return job
+
+
+async def submit(db: AsyncSession, job: Job) -> JobResponse:
+    await db.commit()
+    await db.refresh(job)
+    job_runner.notify()
+    return job_to_response(job)
+
+
+@router.get("", response_model=List[JobResponse])
+async def get_jobs(
+    status: Optional[JobStatus] = None,
+    kind: Optional[JobKind] = None,
+    limit: int = Query(default=50, ge=1, le=500),
+    db: AsyncSession = Depends(get_db)
+):
+    query = select(Job)
+    if status:
+        query = query.where(Job.status == status)
+    if kind:
+        query = query.where(Job.kind == kind)
+    result = await db.execute(query.order_by(Job.id.desc()).limit(limit))
+    return [job_to_response(job) for job in result.scalars().all()]
+
+
+@router.post("/import", response_model=JobResponse, status_code=status.HTTP_202_ACCEPTED)
+async def submit_import(file: UploadFile = File(...), db: AsyncSession = Depends(get_db)):
+    """Queue an import of a transactions CSV (see app.importer for the columns)."""
+    job = await create_job(db, JobKind.import_transactions, {})
+    input_path = os.path.join(jobs_dir(), f"job-{job.id}-input.csv")
+    os.makedirs(jobs_dir(), exist_ok=True)
+    with open(input_path, "wb") as out:
+        await asyncio.to_thread(shutil.copyfileobj, file.file, out)
+    job.params = json.dumps({"input_path": input_path, "filename": file.filename})
+    return await submit(db, job)
+
+
+@router.post("/export", response_model=JobResponse, status_code=status.HTTP_202_ACCEPTED)
+async def submit_export(data: ExportJobCreate, db: AsyncSession = Depends(get_db)):
+    try:
+        ExportDataset(data.dataset)
+        ExportFormat(data.format)
+    except ValueError as exc:
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail=str(exc))
+
+    job = await create_job(db, JobKind.export, data.model_dump(mode="json"))
+    return await submit(db, job)
+
+
+@router.post("/recompute-goals", response_model=JobResponse, status_code=status.HTTP_202_ACCEPTED)
+async def submit_recompute_goals(db: AsyncSession = Depends(get_db)):
+    job = await create_job(db, JobKind.recompute_goals, {})
+    return await submit(db, job)
+
+
+@router.post("/close-year", response_model=JobResponse, status_code=status.HTTP_202_ACCEPTED)
+async def submit_close_year(data: CloseYearJobCreate, db: AsyncSession = Depends(get_db)):
+    """Queue closing every year up to `through_year`, moving their entries to yearly archives (see app.archive)."""
+    if data.through_year >= date.today().year:
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail="Only past years can be closed")
+    job = await create_job(db, JobKind.close_year, data.model_dump())
+    return await submit(db, job)
+
+
+@router.get("/{job_id}", response_model=JobResponse)
+async def get_job(job_id: int, db: AsyncSession = Depends(get_db)):
+    return job_to_response(await get_job_or_404(db, job_id))
+
+
+@router.post("/{job_id}/cancel", response_model=JobResponse)
+async def cancel(job_id: int, db: AsyncSession = Depends(get_db)):
+    """Cancel a queued job, or ask a running one to stop; work it already committed is kept."""
+    cancelled = await cancel_job(db, job_id)
+    job = await get_job_or_404(db, job_id)
+    if not cancelled:
+        raise HTTPException(status_code=status.HTTP_409_CONFLICT, detail="Job already finished")
+    return job_to_response(job)
+
+
+@router.get("/{job_id}/artifact")
+async def get_job_artifact(job_id: int, db: AsyncSession = Depends(get_db)):
+    job = await get_job_or_404(db, job_id)
+    if job.status != JobStatus.succeeded:
+        raise HTTPException(status_code=status.HTTP_409_CONFLICT, detail=f"Job is {job.status.value}")
+    if not job.artifact_path or not os.path.exists(job.artifact_path):
+        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Job has no artifact")
+    return FileResponse(job.artifact_path, filename=os.path.basename(job.artifact_path))
+
+
+@router.delete("/{job_id}", status_code=status.HTTP_204_NO_CONTENT)
+async def delete_job(job_id: int, db: AsyncSession = Depends(get_db)):
+    job = await get_job_or_404(db, job_id)
+    if job.status not in FINISHED_STATUSES:
+        raise HTTPException(status_code=status.HTTP_409_CONFLICT, detail="Job is still active")
+
+    paths = [job.artifact_path, json.loads(job.params).get("input_path")]
+    await db.delete(job)
+    await db.commit()
+    for path in paths:
+        if path and os.path.exists(path):
+            os.unlink(path)
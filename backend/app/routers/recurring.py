@@ -1,15 +1,18 @@
-from typing import List
+from typing import List, Optional
 from datetime import date, timedelta
 from dateutil.relativedelta import relativedelta
 from fastapi import APIRouter, Depends, HTTPException, status
+from fastapi.responses import JSONResponse
 from sqlalchemy.ext.asyncio import AsyncSession
 from sqlalchemy import select
-from sqlalchemy.orm import selectinload
 
-from ..database import get_db
+from ..database import get_db, get_read_db
 from ..models import RecurringTransaction, Transaction, RecurrenceInterval
 from ..schemas import RecurringTransactionCreate, RecurringTransactionUpdate, RecurringTransactionResponse
 from ..auth import verify_api_key
+from ..events import record_change
+from ..cache import ReferenceCache, get_reference_cache
+from ..fieldsets import Fieldset
 
 router = APIRouter(dependencies=[Depends(verify_api_key)])
 
@@ -26,49 +29,85 @@ def get_next_date(current_date: date, interval: RecurrenceInterval) -> date:
     return current_date
 
 
+def recurring_to_response(recurring: RecurringTransaction, refs: ReferenceCache) -> RecurringTransactionResponse:
+    return RecurringTransactionResponse(
+        id=recurring.id,
+        amount=recurring.amount,
+        type=recurring.type,
+        description=recurring.description,
+        category_id=recurring.category_id,
+        interval=recurring.interval,
+        next_date=recurring.next_date,
+        is_active=recurring.is_active,
+        created_at=recurring.created_at,
+        category=refs.category(recurring.category_id)
+    )
+
+
+RECURRING_COLUMNS = ("amount", "type", "description", "category_id", "interval", "next_date", "is_active", "created_at")
+RECURRING_RELATIONS = ("category",)
+
+
 @router.get("", response_model=List[RecurringTransactionResponse])
-async def get_recurring_transactions(db: AsyncSession = Depends(get_db)):
+async def get_recurring_transactions(
+    fields: Optional[str] = None,
+    expand: Optional[str] = None,
+    db: AsyncSession = Depends(get_read_db),
+    refs: ReferenceCache = Depends(get_reference_cache)
+):
+    fieldset = Fieldset.parse(fields, expand, RECURRING_COLUMNS, RECURRING_RELATIONS)
+    if fieldset is None:
+        result = await db.execute(select(RecurringTransaction).order_by(RecurringTransaction.next_date))
+        return [recurring_to_response(r, refs) for r in result.scalars().all()]
+
+    required = ["category_id"] if "category" in fieldset.relations else []
     result = await db.execute(
-        select(RecurringTransaction)
-        .options(selectinload(RecurringTransaction.category))
-        .order_by(RecurringTransaction.next_date)
+        select(*fieldset.select_columns(RecurringTransaction, required)).order_by(RecurringTransaction.next_date)
     )
-    return result.scalars().all()
+    items = []
+    for row in result.all():
+        values = row._mapping
+        related = {}
+        if "category" in fieldset.relations:
+            related["category"] = refs.category(values["category_id"])
+        items.append(fieldset.project(values, related))
+    return JSONResponse(items)
 
 
 @router.get("/{recurring_id}", response_model=RecurringTransactionResponse)
-async def get_recurring_transaction(recurring_id: int, db: AsyncSession = Depends(get_db)):
-    result = await db.execute(
-        select(RecurringTransaction)
-        .options(selectinload(RecurringTransaction.category))
-        .where(RecurringTransaction.id == recurring_id)
-    )
+async def get_recurring_transaction(
+    recurring_id: int,
+    db: AsyncSession = Depends(get_db),
+    refs: ReferenceCache = Depends(get_reference_cache)
+):
+    result = await db.execute(select(RecurringTransaction).where(RecurringTransaction.id == recurring_id))
     recurring = result.scalar_one_or_none()
     if not recurring:
         raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Recurring transaction not found")
-    return recurring
+    return recurring_to_response(recurring, refs)
 
 
 @router.post("", response_model=RecurringTransactionResponse, status_code=status.HTTP_201_CREATED)
-async def create_recurring_transaction(data: RecurringTransactionCreate, db: AsyncSession = Depends(get_db)):
+async def create_recurring_transaction(
+    data: RecurringTransactionCreate,
+    db: AsyncSession = Depends(get_db),
+    refs: ReferenceCache = Depends(get_reference_cache)
+):
     recurring = RecurringTransaction(**data.model_dump())
     db.add(recurring)
+    await db.flush()
+    record_change(db, "recurring", recurring.id, "create")
     await db.commit()
     await db.refresh(recurring)
-
-    result = await db.execute(
-        select(RecurringTransaction)
-        .options(selectinload(RecurringTransaction.category))
-        .where(RecurringTransaction.id == recurring.id)
-    )
-    return result.scalar_one()
+    return recurring_to_response(recurring, refs)
 
 
 @router.patch("/{recurring_id}", response_model=RecurringTransactionResponse)
 async def update_recurring_transaction(
     recurring_id: int,
     data: RecurringTransactionUpdate,
-    db: AsyncSession = Depends(get_db)
+    db: AsyncSession = Depends(get_db),
+    refs: ReferenceCache = Depends(get_reference_cache)
 ):
     result = await db.execute(select(RecurringTransaction).where(RecurringTransaction.id == recurring_id))
     recurring = result.scalar_one_or_none()
@@ -79,15 +118,10 @@ async def update_recurring_transaction(
     for field, value in update_data.items():
         setattr(recurring, field, value)
 
+    record_change(db, "recurring", recurring.id, "update")
     await db.commit()
     await db.refresh(recurring)
-
-    result = await db.execute(
-        select(RecurringTransaction)
-        .options(selectinload(RecurringTransaction.category))
-        .where(RecurringTransaction.id == recurring.id)
-    )
-    return result.scalar_one()
+    return recurring_to_response(recurring, refs)
 
 
 @router.delete("/{recurring_id}", status_code=status.HTTP_204_NO_CONTENT)
@@ -98,6 +132,7 @@ async def delete_recurring_transaction(recurring_id: int, db: AsyncSession = Dep
         raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Recurring transaction not found")
 
     await db.delete(recurring)
+    record_change(db, "recurring", recurring_id, "delete")
     await db.commit()
 
 
@@ -116,6 +151,7 @@ async def process_recurring_transactions(db: AsyncSession = Depends(get_db)):
 
     created_count = 0
     limit_reached = False
+    created = []
 
     for recurring in recurring_list:
         while recurring.next_date <= today:
@@ -133,10 +169,16 @@ async def process_recurring_transactions(db: AsyncSession = Depends(get_db)):
             db.add(transaction)
             recurring.next_date = get_next_date(recurring.next_date, recurring.interval)
             created_count += 1
+            created.append(transaction)
 
         if limit_reached:
             break
 
+    await db.flush()
+    for transaction in created:
+        record_change(db, "transaction", transaction.id, "create")
+    for recurring in recurring_list:
+        record_change(db, "recurring", recurring.id, "update")
     await db.commit()
     return {
         "processed": len(recurring_list),
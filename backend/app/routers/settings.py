@@ -7,23 +7,22 @@ from ..database import get_db
 from ..models import Settings
 from ..schemas import SettingResponse, SettingUpdate
 from ..auth import verify_api_key
+from ..events import record_change
+from ..cache import ReferenceCache, get_reference_cache, reference_cache
 
 router = APIRouter(dependencies=[Depends(verify_api_key)])
 
 
 @router.get("", response_model=List[SettingResponse])
-async def get_settings(db: AsyncSession = Depends(get_db)):
-    result = await db.execute(select(Settings))
-    return result.scalars().all()
+async def get_settings(refs: ReferenceCache = Depends(get_reference_cache)):
+    return [SettingResponse(key=key, value=value) for key, value in refs.settings.items()]
 
 
 @router.get("/{key}", response_model=SettingResponse)
-async def get_setting(key: str, db: AsyncSession = Depends(get_db)):
-    result = await db.execute(select(Settings).where(Settings.key == key))
-    setting = result.scalar_one_or_none()
-    if not setting:
+async def get_setting(key: str, refs: ReferenceCache = Depends(get_reference_cache)):
+    if key not in refs.settings:
         raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Setting not found")
-    return setting
+    return SettingResponse(key=key, value=refs.settings[key])
 
 
 @router.put("/{key}", response_model=SettingResponse)
@@ -37,6 +36,9 @@ async def update_setting(key: str, data: SettingUpdate, db: AsyncSession = Depen
         setting = Settings(key=key, value=data.value)
         db.add(setting)
 
+    await db.flush()
+    record_change(db, "setting", setting.id, "update")
     await db.commit()
     await db.refresh(setting)
+    reference_cache.invalidate()
     return setting
@@ -0,0 +1,24 @@
+from fastapi import APIRouter, Depends, Query
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from ..database import get_read_db
+from ..schemas import SyncResponse
+from ..auth import verify_api_key
+from ..sync import get_changes
+
+router = APIRouter(dependencies=[Depends(verify_api_key)])
+
+
+@router.get("", response_model=SyncResponse)
+async def sync_changes(
+    since: int = Query(default=0, ge=0),
+    limit: int = Query(default=500, ge=1, le=5000),
+    db: AsyncSession = Depends(get_read_db)
+):
+    """
+    Rows created, updated or deleted after the `since` cursor, oldest first.
+
+    Pass the returned cursor as `since` on the next call until has_more is
+    false. Apply changes and deletions in version order.
+    """
+    return await get_changes(db, since, limit)
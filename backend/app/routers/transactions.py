@@ -1,105 +1,216 @@
-from typing import List, Optional
-from datetime import date
+from typing import Dict, List, Optional
+from datetime import date, datetime
 from decimal import Decimal
 from fastapi import APIRouter, Depends, HTTPException, status, Query
+from fastapi.responses import JSONResponse
 from sqlalchemy.ext.asyncio import AsyncSession
-from sqlalchemy import select, func
-from sqlalchemy.orm import selectinload
-
-from ..database import get_db
-from ..models import Transaction, TransactionType
-from ..schemas import TransactionCreate, TransactionUpdate, TransactionResponse, TransactionSummary
+from sqlalchemy import select, func, update, delete, insert, literal
+
+from ..database import get_db, get_read_db, fan_out_scalars
+from ..models import Transaction, TransactionType, Tombstone
+from ..schemas import (
+    TransactionCreate, TransactionUpdate, TransactionResponse, TransactionSummary,
+    TransactionFilter, TransactionBulkUpdate, TransactionBulkDelete, TransactionBulkResult
+)
 from ..auth import verify_api_key
-from ..balance import get_available_balance
+from ..write_queue import BalanceState, write_queue
+from ..cache import ReferenceCache, get_reference_cache
+from ..fieldsets import Fieldset
+from ..columnar import ResponseFormat, CompactJSONResponse, to_columns, dictionary_encode
+from ..sync import reserve_versions
+from ..generation import mark_written
+from ..ledger import AVAILABLE_LEDGER
+from ..checkpoints import invalidate_backdated
+from ..timeouts import query_budget, LIST_QUERY_BUDGET
+from ..archive import history, archived, archived_years, ensure_open
 
 router = APIRouter(dependencies=[Depends(verify_api_key)])
 
 
-@router.get("", response_model=List[TransactionResponse])
-async def get_transactions(
+def transaction_to_response(transaction: Transaction, refs: ReferenceCache) -> TransactionResponse:
+    return TransactionResponse(
+        id=transaction.id,
+        amount=transaction.amount,
+        type=transaction.type,
+        description=transaction.description,
+        date=transaction.date,
+        category_id=transaction.category_id,
+        account_id=transaction.account_id,
+        created_at=transaction.created_at,
+        category=refs.category(transaction.category_id),
+        account=refs.account(transaction.account_id)
+    )
+
+
+def filter_transactions(
+    query,
     type: Optional[TransactionType] = None,
     category_id: Optional[int] = None,
     account_id: Optional[int] = None,
     start_date: Optional[date] = None,
     end_date: Optional[date] = None,
-    limit: int = Query(default=100, le=1000),
-    offset: int = 0,
-    db: AsyncSession = Depends(get_db)
+    description: Optional[str] = None,
+    source=Transaction
 ):
-    query = select(Transaction).options(
-        selectinload(Transaction.category),
-        selectinload(Transaction.account)
-    )
-
+    """Apply the filters to `query`; `source` is Transaction or its history() alias."""
     if type:
-        query = query.where(Transaction.type == type)
+        query = query.where(source.type == type)
     if category_id:
-        query = query.where(Transaction.category_id == category_id)
+        query = query.where(source.category_id == category_id)
     if account_id:
-        query = query.where(Transaction.account_id == account_id)
+        query = query.where(source.account_id == account_id)
     if start_date:
-        query = query.where(Transaction.date >= start_date)
+        query = query.where(source.date >= start_date)
     if end_date:
-        query = query.where(Transaction.date <= end_date)
-
-    query = query.order_by(Transaction.date.desc(), Transaction.id.desc()).limit(limit).offset(offset)
-    result = await db.execute(query)
-    return result.scalars().all()
-
-
-@router.get("/summary", response_model=TransactionSummary)
-async def get_transaction_summary(
+        query = query.where(source.date <= end_date)
+    if description:
+        query = query.where(source.description.contains(description, autoescape=True))
+    return query
+
+
+def transactions_to_columnar(rows, fieldset: Fieldset, refs: ReferenceCache) -> CompactJSONResponse:
+    """
+    One array per column; category and account become codes into small lookup tables.
+
+    `rows` must come from a SELECT of the fieldset's columns (plus the
+    relation foreign keys), so nothing is materialized per row beyond the
+    result tuples themselves.
+    """
+    names = list(rows[0]._fields) if rows else []
+    all_columns = to_columns(rows, names)
+    payload = {
+        "count": len(rows),
+        "columns": {name: all_columns.get(name, []) for name in fieldset.columns},
+    }
+    lookups = {"category": refs.categories.get, "account": refs.accounts.get}
+    table_attrs = {"category": ("id", "name", "type", "icon"), "account": ("id", "name", "type")}
+    for relation, attrs in fieldset.relations.items():
+        keys = [row._mapping[f"{relation}_id"] for row in rows]
+        codes, table = dictionary_encode(keys, lookups[relation], sorted(attrs) if attrs else table_attrs[relation])
+        payload["columns"][relation] = codes
+        payload[f"{relation}_table"] = table
+    return CompactJSONResponse(payload)
+
+
+TRANSACTION_COLUMNS = ("amount", "type", "description", "date", "category_id", "account_id", "created_at")
+TRANSACTION_RELATIONS = ("category", "account")
+
+
+@router.get("", response_model=List[TransactionResponse], dependencies=[Depends(query_budget(LIST_QUERY_BUDGET))])
+async def get_transactions(
+    type: Optional[TransactionType] = None,
+    category_id: Optional[int] = None,
+    account_id: Optional[int] = None,
     start_date: Optional[date] = None,
     end_date: Optional[date] = None,
-    db: AsyncSession = Depends(get_db)
+    description: Optional[str] = None,
+    limit: int = Query(default=100, le=1000),
+    offset: int = 0,
+    fields: Optional[str] = None,
+    expand: Optional[str] = None,
+    format: ResponseFormat = ResponseFormat.rows,
+    db: AsyncSession = Depends(get_read_db),
+    refs: ReferenceCache = Depends(get_reference_cache)
+):
+    fieldset = Fieldset.parse(fields, expand, TRANSACTION_COLUMNS, TRANSACTION_RELATIONS)
+    if fieldset is None and format == ResponseFormat.columnar:
+        # The category/account codes and lookup tables already carry the foreign keys
+        columns = [c for c in TRANSACTION_COLUMNS if c not in ("category_id", "account_id")]
+        fieldset = Fieldset.parse(",".join(columns), ",".join(TRANSACTION_RELATIONS), TRANSACTION_COLUMNS, TRANSACTION_RELATIONS)
+
+    required = [] if fieldset is None else [f"{name}_id" for name in fieldset.relations]
+    criteria = (type, category_id, account_id, start_date, end_date, description)
+
+    def page(source, limit: int, offset: int):
+        if fieldset is None:
+            query = select(source)
+        else:
+            query = select(*fieldset.select_columns(source, required))
+        query = filter_transactions(query, *criteria, source=source)
+        return query.order_by(source.date.desc(), source.id.desc()).limit(limit).offset(offset)
+
+    def fetch(result) -> list:
+        return list(result.scalars().all() if fieldset is None else result.all())
+
+    rows = fetch(await db.execute(page(Transaction, limit, offset)))
+    years = await archived_years(start_date, end_date)
+    if years and len(rows) < limit:
+        # The archived years continue the page where the hot rows run out (see archived())
+        if rows:
+            hot_total = offset + len(rows)
+        else:
+            hot_total = (await db.execute(filter_transactions(select(func.count(Transaction.id)), *criteria))).scalar()
+        rows += fetch(await db.execute(page(archived(Transaction, years), limit - len(rows), max(0, offset - hot_total))))
+
+    if fieldset is None:
+        return [transaction_to_response(t, refs) for t in rows]
+
+    if format == ResponseFormat.columnar:
+        return transactions_to_columnar(rows, fieldset, refs)
+
+    items = []
+    for row in rows:
+        values = row._mapping
+        related = {}
+        if "category" in fieldset.relations:
+            related["category"] = refs.category(values["category_id"])
+        if "account" in fieldset.relations:
+            related["account"] = refs.account(values["account_id"])
+        items.append(fieldset.project(values, related))
+    return JSONResponse(items)
+
+
+@router.get("/summary", response_model=TransactionSummary, dependencies=[Depends(query_budget(LIST_QUERY_BUDGET))])
+async def get_transaction_summary(
+    start_date: Optional[date] = None,
+    end_date: Optional[date] = None
 ):
-    income_query = select(func.coalesce(func.sum(Transaction.amount), 0)).where(
-        Transaction.type == TransactionType.income
+    source = await history(Transaction, start_date, end_date)
+    income_query = select(func.coalesce(func.sum(source.amount), 0)).where(
+        source.type == TransactionType.income
     )
-    expense_query = select(func.coalesce(func.sum(Transaction.amount), 0)).where(
-        Transaction.type == TransactionType.expense
+    expense_query = select(func.coalesce(func.sum(source.amount), 0)).where(
+        source.type == TransactionType.expense
     )
-    count_query = select(func.count(Transaction.id))
+    count_query = select(func.count(source.id))
 
     if start_date:
-        income_query = income_query.where(Transaction.date >= start_date)
-        expense_query = expense_query.where(Transaction.date >= start_date)
-        count_query = count_query.where(Transaction.date >= start_date)
+        income_query = income_query.where(source.date >= start_date)
+        expense_query = expense_query.where(source.date >= start_date)
+        count_query = count_query.where(source.date >= start_date)
     if end_date:
-        income_query = income_query.where(Transaction.date <= end_date)
-        expense_query = expense_query.where(Transaction.date <= end_date)
-        count_query = count_query.where(Transaction.date <= end_date)
+        income_query = income_query.where(source.date <= end_date)
+        expense_query = expense_query.where(source.date <= end_date)
+        count_query = count_query.where(source.date <= end_date)
 
-    income_result = await db.execute(income_query)
-    expense_result = await db.execute(expense_query)
-    count_result = await db.execute(count_query)
+    income, expense, count = await fan_out_scalars(income_query, expense_query, count_query)
 
-    total_income = Decimal(str(income_result.scalar()))
-    total_expense = Decimal(str(expense_result.scalar()))
+    total_income = Decimal(str(income))
+    total_expense = Decimal(str(expense))
 
     return TransactionSummary(
         total_income=total_income,
         total_expense=total_expense,
         balance=total_income - total_expense,
-        count=count_result.scalar()
+        count=count
     )
 
 
 @router.get("/{transaction_id}", response_model=TransactionResponse)
-async def get_transaction(transaction_id: int, db: AsyncSession = Depends(get_db)):
-    result = await db.execute(
-        select(Transaction)
-        .options(selectinload(Transaction.category), selectinload(Transaction.account))
-        .where(Transaction.id == transaction_id)
-    )
+async def get_transaction(
+    transaction_id: int,
+    db: AsyncSession = Depends(get_db),
+    refs: ReferenceCache = Depends(get_reference_cache)
+):
+    result = await db.execute(select(Transaction).where(Transaction.id == transaction_id))
     transaction = result.scalar_one_or_none()
     if not transaction:
         raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Transaction not found")
-    return transaction
+    return transaction_to_response(transaction, refs)
 
 
 @router.post("", response_model=TransactionResponse, status_code=status.HTTP_201_CREATED)
-async def create_transaction(data: TransactionCreate, db: AsyncSession = Depends(get_db)):
+async def create_transaction(data: TransactionCreate, refs: ReferenceCache = Depends(get_reference_cache)):
     # Validate amount
     if data.amount <= 0:
         raise HTTPException(
@@ -107,92 +218,252 @@ async def create_transaction(data: TransactionCreate, db: AsyncSession = Depends
             detail="Amount must be greater than 0"
         )
 
-    # Check balance for expense
-    if data.type == TransactionType.expense:
-        available = await get_available_balance(db)
-        if data.amount > available:
+    async def op(db: AsyncSession, balances: BalanceState) -> Transaction:
+        # Check balance for expense
+        if data.type == TransactionType.expense and data.amount > balances.available:
             raise HTTPException(
                 status_code=status.HTTP_400_BAD_REQUEST,
-                detail=f"Insufficient balance. Available: {available}, requested: {data.amount}"
+                detail=f"Insufficient balance. Available: {balances.available}, requested: {data.amount}"
             )
 
-    transaction = Transaction(**data.model_dump())
-    db.add(transaction)
-    await db.commit()
-    await db.refresh(transaction)
+        transaction = Transaction(**data.model_dump())
+        db.add(transaction)
+        await db.flush()
+        balances.add_transaction(transaction.type, transaction.amount, transaction.account_id)
+        balances.record(db, "transaction", transaction.id, "create", transaction.account_id)
+        return transaction
 
-    result = await db.execute(
-        select(Transaction)
-        .options(selectinload(Transaction.category), selectinload(Transaction.account))
-        .where(Transaction.id == transaction.id)
-    )
-    return result.scalar_one()
+    transaction = await write_queue.submit(op)
+    return transaction_to_response(transaction, refs)
 
 
 @router.patch("/{transaction_id}", response_model=TransactionResponse)
-async def update_transaction(transaction_id: int, data: TransactionUpdate, db: AsyncSession = Depends(get_db)):
-    result = await db.execute(select(Transaction).where(Transaction.id == transaction_id))
-    transaction = result.scalar_one_or_none()
-    if not transaction:
-        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Transaction not found")
+async def update_transaction(
+    transaction_id: int,
+    data: TransactionUpdate,
+    refs: ReferenceCache = Depends(get_reference_cache)
+):
+    async def op(db: AsyncSession, balances: BalanceState) -> Transaction:
+        result = await db.execute(select(Transaction).where(Transaction.id == transaction_id))
+        transaction = result.scalar_one_or_none()
+        if not transaction:
+            raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Transaction not found")
+
+        # Validate amount if provided
+        if data.amount is not None and data.amount <= 0:
+            raise HTTPException(
+                status_code=status.HTTP_400_BAD_REQUEST,
+                detail="Amount must be greater than 0"
+            )
 
-    # Validate amount if provided
-    if data.amount is not None and data.amount <= 0:
-        raise HTTPException(
-            status_code=status.HTTP_400_BAD_REQUEST,
-            detail="Amount must be greater than 0"
-        )
+        # Check balance for expense updates
+        new_type = data.type if data.type is not None else transaction.type
+        new_amount = data.amount if data.amount is not None else transaction.amount
 
-    # Check balance for expense updates
-    new_type = data.type if data.type is not None else transaction.type
-    new_amount = data.amount if data.amount is not None else transaction.amount
+        if new_type == TransactionType.expense:
+            available = balances.available
+            # Add back current transaction amount if it was expense (we're modifying it)
+            if transaction.type == TransactionType.expense:
+                available += transaction.amount
+            # Subtract if it was income (we're losing that income)
+            elif transaction.type == TransactionType.income:
+                available -= transaction.amount
 
-    if new_type == TransactionType.expense:
-        available = await get_available_balance(db)
-        # Add back current transaction amount if it was expense (we're modifying it)
-        if transaction.type == TransactionType.expense:
-            available += transaction.amount
-        # Subtract if it was income (we're losing that income)
-        elif transaction.type == TransactionType.income:
-            available -= transaction.amount
+            if new_amount > available:
+                raise HTTPException(
+                    status_code=status.HTTP_400_BAD_REQUEST,
+                    detail=f"Insufficient balance. Available: {available}, requested: {new_amount}"
+                )
 
-        if new_amount > available:
-            raise HTTPException(
-                status_code=status.HTTP_400_BAD_REQUEST,
-                detail=f"Insufficient balance. Available: {available}, requested: {new_amount}"
-            )
+        old_account_id = transaction.account_id
+        balances.remove_transaction(transaction.type, transaction.amount, transaction.account_id)
 
-    update_data = data.model_dump(exclude_unset=True)
-    for field, value in update_data.items():
-        setattr(transaction, field, value)
+        update_data = data.model_dump(exclude_unset=True)
+        for field, value in update_data.items():
+            setattr(transaction, field, value)
 
-    await db.commit()
-    await db.refresh(transaction)
+        await db.flush()
+        balances.add_transaction(transaction.type, transaction.amount, transaction.account_id)
+        balances.record(db, "transaction", transaction.id, "update", old_account_id, transaction.account_id)
+        return transaction
 
-    result = await db.execute(
-        select(Transaction)
-        .options(selectinload(Transaction.category), selectinload(Transaction.account))
-        .where(Transaction.id == transaction.id)
-    )
-    return result.scalar_one()
+    transaction = await write_queue.submit(op)
+    return transaction_to_response(transaction, refs)
 
 
 @router.delete("/{transaction_id}", status_code=status.HTTP_204_NO_CONTENT)
-async def delete_transaction(transaction_id: int, db: AsyncSession = Depends(get_db)):
-    result = await db.execute(select(Transaction).where(Transaction.id == transaction_id))
-    transaction = result.scalar_one_or_none()
-    if not transaction:
-        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Transaction not found")
+async def delete_transaction(transaction_id: int):
+    async def op(db: AsyncSession, balances: BalanceState):
+        result = await db.execute(select(Transaction).where(Transaction.id == transaction_id))
+        transaction = result.scalar_one_or_none()
+        if not transaction:
+            raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Transaction not found")
+
+        # Check if deleting income would cause negative balance
+        if transaction.type == TransactionType.income:
+            balance_after_delete = balances.available - transaction.amount
+            if balance_after_delete < 0:
+                raise HTTPException(
+                    status_code=status.HTTP_400_BAD_REQUEST,
+                    detail=f"Cannot delete this income. It would cause negative balance: {balance_after_delete}"
+                )
+
+        await db.delete(transaction)
+        await db.flush()
+        balances.remove_transaction(transaction.type, transaction.amount, transaction.account_id)
+        balances.record(db, "transaction", transaction_id, "delete", transaction.account_id)
+
+    await write_queue.submit(op)
+
+
+def require_filter(criteria: TransactionFilter):
+    if not criteria.model_dump(exclude_none=True):
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail="At least one filter is required"
+        )
+
+
+async def get_bulk_impact(db: AsyncSession, criteria: TransactionFilter):
+    """Count, total and earliest date of the matching transactions, per account and type."""
+    query = select(
+        Transaction.account_id,
+        Transaction.type,
+        func.count(Transaction.id).label("count"),
+        func.sum(Transaction.amount).label("total"),
+        func.min(Transaction.date).label("earliest")
+    ).group_by(Transaction.account_id, Transaction.type)
+    result = await db.execute(filter_transactions(query, **criteria.model_dump()))
+    return result.all()
+
+
+def matched_versions(criteria: TransactionFilter, first_version: int):
+    """Matching transaction ids, each paired with its own version counting up from `first_version`."""
+    query = select(
+        Transaction.id,
+        (first_version - 1 + func.row_number().over(order_by=Transaction.id)).label("version")
+    )
+    return filter_transactions(query, **criteria.model_dump())
 
-    # Check if deleting income would cause negative balance
-    if transaction.type == TransactionType.income:
-        available = await get_available_balance(db)
-        balance_after_delete = available - transaction.amount
+
+def earliest_by_ledger(impact, *extra_ledgers: Optional[int]) -> Dict[int, date]:
+    earliest: Dict[int, date] = {}
+    first = min(row.earliest for row in impact)
+    for ledger_id in extra_ledgers:
+        if ledger_id is not None:
+            earliest[ledger_id] = first
+    for row in impact:
+        if row.account_id is not None:
+            earliest[row.account_id] = min(earliest.get(row.account_id, row.earliest), row.earliest)
+    return earliest
+
+
+@router.post("/bulk-update", response_model=TransactionBulkResult)
+async def bulk_update_transactions(
+    data: TransactionBulkUpdate,
+    refs: ReferenceCache = Depends(get_reference_cache)
+):
+    """
+    Re-categorize and/or re-assign every transaction matching the filter with one UPDATE.
+
+    Neither change moves the available balance; re-assigning moves the
+    matched totals between account balances. Setting account_id to null
+    unassigns the transactions.
+    """
+    require_filter(data.filter)
+    changes = data.model_dump(exclude_unset=True, exclude={"filter"})
+    if not changes:
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail="Nothing to update")
+    if "category_id" in changes and changes["category_id"] not in refs.categories:
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail="Category not found")
+    if changes.get("account_id") is not None and changes["account_id"] not in refs.accounts:
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail="Account not found")
+
+    async def op(db: AsyncSession, balances: BalanceState) -> TransactionBulkResult:
+        impact = await get_bulk_impact(db, data.filter)
+        count = sum(row.count for row in impact)
+        if not count:
+            return TransactionBulkResult(affected=0)
+        await ensure_open(min(row.earliest for row in impact))
+
+        matched = matched_versions(data.filter, await reserve_versions(db, count)).subquery()
+        result = await db.execute(
+            update(Transaction)
+            .where(Transaction.id == matched.c.id)
+            .values(**changes, version=matched.c.version)
+            .returning(Transaction.id)
+            .execution_options(synchronize_session="fetch")
+        )
+        ids = result.scalars().all()
+        mark_written(db, "transactions")
+
+        accounts = set()
+        if "account_id" in changes:
+            new_account_id = changes["account_id"]
+            for row in impact:
+                total = Decimal(str(row.total))
+                balances.remove_transaction(row.type, total, row.account_id)
+                balances.add_transaction(row.type, total, new_account_id)
+                accounts.add(row.account_id)
+            accounts.add(new_account_id)
+            await invalidate_backdated(db, earliest_by_ledger(impact, new_account_id))
+
+        for transaction_id in ids:
+            balances.record(db, "transaction", transaction_id, "update", *accounts)
+        return TransactionBulkResult(affected=len(ids))
+
+    return await write_queue.submit(op)
+
+
+@router.post("/bulk-delete", response_model=TransactionBulkResult)
+async def bulk_delete_transactions(data: TransactionBulkDelete):
+    """
+    Delete every transaction matching the filter with one DELETE.
+
+    The whole set is checked at once: it is rejected if removing its
+    income (net of its expenses) would leave a negative balance.
+    """
+    require_filter(data.filter)
+
+    async def op(db: AsyncSession, balances: BalanceState) -> TransactionBulkResult:
+        impact = await get_bulk_impact(db, data.filter)
+        count = sum(row.count for row in impact)
+        if not count:
+            return TransactionBulkResult(affected=0)
+        await ensure_open(min(row.earliest for row in impact))
+
+        balance_after_delete = balances.available
+        for row in impact:
+            total = Decimal(str(row.total))
+            balance_after_delete += -total if row.type == TransactionType.income else total
         if balance_after_delete < 0:
             raise HTTPException(
                 status_code=status.HTTP_400_BAD_REQUEST,
-                detail=f"Cannot delete this income. It would cause negative balance: {balance_after_delete}"
+                detail=f"Cannot delete these transactions. It would cause negative balance: {balance_after_delete}"
+            )
+
+        matched = matched_versions(data.filter, await reserve_versions(db, count)).subquery()
+        await db.execute(
+            insert(Tombstone).from_select(
+                ["entity", "entity_id", "version", "deleted_at"],
+                select(literal(Transaction.__tablename__), matched.c.id, matched.c.version, literal(datetime.utcnow()))
             )
+        )
+        result = await db.execute(
+            filter_transactions(delete(Transaction), **data.filter.model_dump())
+            .returning(Transaction.id)
+            .execution_options(synchronize_session="fetch")
+        )
+        ids = result.scalars().all()
+        mark_written(db, "transactions")
+
+        for row in impact:
+            balances.remove_transaction(row.type, Decimal(str(row.total)), row.account_id)
+        await invalidate_backdated(db, earliest_by_ledger(impact, AVAILABLE_LEDGER))
+
+        accounts = {row.account_id for row in impact}
+        for transaction_id in ids:
+            balances.record(db, "transaction", transaction_id, "delete", *accounts)
+        return TransactionBulkResult(affected=len(ids))
 
-    await db.delete(transaction)
-    await db.commit()
+    return await write_queue.submit(op)
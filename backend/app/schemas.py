@@ -1,9 +1,9 @@
 from datetime import date, datetime
 from decimal import Decimal
-from typing import Optional, List
+from typing import Optional, List, Dict, Any
 from pydantic import BaseModel, ConfigDict
 
-from .models import TransactionType, RecurrenceInterval, AccountType
+from .models import TransactionType, RecurrenceInterval, AccountType, JobKind, JobStatus
 
 
 # Category schemas
@@ -55,6 +55,31 @@ class AccountResponse(AccountBase):
     model_config = ConfigDict(from_attributes=True)
 
 
+class BalanceAsOf(BaseModel):
+    account_id: Optional[int] = None  # None for the available balance
+    as_of: date
+    balance: Decimal
+
+
+class StatementEntry(BaseModel):
+    kind: str
+    id: int
+    date: date
+    amount: Decimal
+    description: Optional[str]
+    category_id: Optional[int]
+    counterparty_account_id: Optional[int]
+    balance: Decimal
+
+
+class AccountStatement(BaseModel):
+    account_id: int
+    opening_balance: Decimal
+    closing_balance: Decimal
+    entries: List[StatementEntry]
+    next_cursor: Optional[str] = None
+
+
 # Transaction schemas
 class TransactionBase(BaseModel):
     amount: Decimal
@@ -94,6 +119,29 @@ class TransactionSummary(BaseModel):
     count: int
 
 
+class TransactionFilter(BaseModel):
+    type: Optional[TransactionType] = None
+    category_id: Optional[int] = None
+    account_id: Optional[int] = None
+    start_date: Optional[date] = None
+    end_date: Optional[date] = None
+    description: Optional[str] = None
+
+
+class TransactionBulkUpdate(BaseModel):
+    filter: TransactionFilter
+    category_id: Optional[int] = None
+    account_id: Optional[int] = None
+
+
+class TransactionBulkDelete(BaseModel):
+    filter: TransactionFilter
+
+
+class TransactionBulkResult(BaseModel):
+    affected: int
+
+
 # Goal schemas
 class GoalBase(BaseModel):
     name: str
@@ -162,10 +210,42 @@ class BudgetResponse(BudgetBase):
     spent: Decimal = Decimal("0.00")
     remaining: Decimal = Decimal("0.00")
     percent_used: float = 0.0
+    projected_spent: Decimal = Decimal("0.00")
+    projected_overrun: bool = False
 
     model_config = ConfigDict(from_attributes=True)
 
 
+class BudgetCopy(BaseModel):
+    source_month: int
+    source_year: int
+    target_month: int
+    target_year: int
+    rollover: bool = False
+
+
+class BudgetCopyResult(BaseModel):
+    created: int
+    skipped: int
+    budgets: List[BudgetResponse]
+
+
+class BudgetMatrixRow(BaseModel):
+    category_id: int
+    category: CategoryResponse
+    budget: List[Optional[Decimal]]
+    spent: List[Decimal]
+    variance: List[Optional[Decimal]]
+
+
+class BudgetMatrixResponse(BaseModel):
+    months: List[str]
+    rows: List[BudgetMatrixRow]
+    total_budget: List[Decimal]
+    total_spent: List[Decimal]
+    total_variance: List[Decimal]
+
+
 # Recurring transaction schemas
 class RecurringTransactionBase(BaseModel):
     amount: Decimal
@@ -229,6 +309,76 @@ class DailySpending(BaseModel):
     amount: Decimal
 
 
+class RollingCategorySeries(BaseModel):
+    category_id: int
+    category_name: str
+    mean: List[float]
+
+
+class RollingSpendingResponse(BaseModel):
+    window: int
+    dates: List[str]
+    series: List[RollingCategorySeries]
+
+
+class CategoryStats(BaseModel):
+    category_id: int
+    category_name: str
+    total: float
+    daily_mean: float
+    daily_std: float
+    p50: float
+    p90: float
+    p95: float
+    active_days: int
+
+
+class MonthlyCategorySeries(BaseModel):
+    category_id: int
+    category_name: str
+    totals: List[float]
+    change: List[Optional[float]]
+    change_percent: List[Optional[float]]
+
+
+class MonthlySpendingResponse(BaseModel):
+    months: List[str]
+    series: List[MonthlyCategorySeries]
+
+
+class BalanceSeries(BaseModel):
+    opening: float
+    balance: List[float]
+
+
+class AccountBalanceSeries(BalanceSeries):
+    account_id: int
+    account_name: str
+
+
+class CashFlowForecast(BaseModel):
+    start_date: date
+    days: int
+    dates: List[str]
+    income: List[float]
+    expense: List[float]
+    overall: BalanceSeries
+    unassigned: BalanceSeries
+    accounts: List[AccountBalanceSeries]
+    lowest_balance: float
+    lowest_balance_date: date
+
+
+class SpendingAnomaly(BaseModel):
+    date: str
+    category_id: int
+    category_name: str
+    amount: float
+    baseline_mean: float
+    baseline_std: float
+    z_score: float
+
+
 # Settings schemas
 class SettingResponse(BaseModel):
     key: str
@@ -280,6 +430,18 @@ class AllocationCalculation(BaseModel):
     amount: Decimal
 
 
+class AllocationApply(BaseModel):
+    amount: Decimal
+    note: Optional[str] = None
+
+
+class AllocationApplyResult(BaseModel):
+    amount: Decimal
+    allocated: Decimal
+    unallocated: Decimal
+    allocations: List[AllocationCalculation]
+
+
 # Transfer schemas
 class TransferCreate(BaseModel):
     from_account_id: int
@@ -301,3 +463,71 @@ class TransferResponse(BaseModel):
     to_account: AccountResponse
 
     model_config = ConfigDict(from_attributes=True)
+
+
+# Sync schemas
+class SyncDeletion(BaseModel):
+    entity: str
+    id: int
+    version: int
+
+
+class SyncResponse(BaseModel):
+    cursor: int
+    has_more: bool
+    changes: Dict[str, List[Dict[str, Any]]]
+    deleted: List[SyncDeletion]
+
+
+# Job schemas
+class ExportJobCreate(BaseModel):
+    dataset: str
+    format: str = "parquet"
+    start_date: Optional[date] = None
+    end_date: Optional[date] = None
+
+
+class CloseYearJobCreate(BaseModel):
+    through_year: int
+
+
+class JobResponse(BaseModel):
+    id: int
+    kind: JobKind
+    status: JobStatus
+    processed: int
+    total: Optional[int]
+    progress_percent: Optional[float]
+    result: Optional[Dict[str, Any]]
+    error: Optional[str]
+    has_artifact: bool
+    cancel_requested: bool
+    created_at: datetime
+    started_at: Optional[datetime]
+    finished_at: Optional[datetime]
+
+
+# Admission schemas
+class AdmissionClassStats(BaseModel):
+    name: str
+    limit: int
+    max_queue: int
+    target_delay_ms: float
+    active: int
+    queued: int
+    admitted: int
+    shed: int
+    avg_wait_ms: float
+    service_time_ms: float
+
+
+# Archive schemas
+class ClosedYearResponse(BaseModel):
+    year: int
+    archived: bool
+    transactions: int
+    transfers: int
+    goal_contributions: int
+    closed_at: Optional[datetime]
+
+    model_config = ConfigDict(from_attributes=True)
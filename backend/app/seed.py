@@ -35,7 +35,7 @@ async def seed_categories(db: AsyncSession):
         category = Category(**cat_data)
         db.add(category)
 
-    await db.commit()
+    await db.flush()
 
 
 async def seed_settings(db: AsyncSession):
@@ -47,7 +47,7 @@ async def seed_settings(db: AsyncSession):
         setting = Settings(**setting_data)
         db.add(setting)
 
-    await db.commit()
+    await db.flush()
 
 
 async def seed_accounts(db: AsyncSession):
@@ -62,7 +62,7 @@ async def seed_accounts(db: AsyncSession):
         is_default=True
     )
     db.add(default_account)
-    await db.commit()
+    await db.flush()
 
 
 async def seed_all(db: AsyncSession):
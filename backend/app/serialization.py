@@ -0,0 +1,15 @@
+import enum
+from datetime import date, datetime
+from decimal import Decimal
+from typing import Any
+
+
+def json_value(value: Any) -> Any:
+    """Encode a column value the way the response models do (Decimal as string, ISO dates)."""
+    if isinstance(value, Decimal):
+        return str(value)
+    if isinstance(value, (date, datetime)):
+        return value.isoformat()
+    if isinstance(value, enum.Enum):
+        return value.value
+    return value
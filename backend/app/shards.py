@@ -0,0 +1,234 @@
+"""
+Database-per-tenant sharding.
+
+Every API key belongs to a tenant (see app.auth) and every tenant has its
+own SQLite file, so households never wait on each other's write lock.
+verify_api_key routes each request: it takes the tenant's shard from the
+registry and makes it current, after which `async_session()`,
+`read_session()` and the ShardLocal singletons (write queue, caches, job
+runner, event broker, ...) all resolve to that tenant.
+
+Shards are opened on first use. Opening prepares the database (schema,
+seed rows) and starts the shard's background tasks in a context of its
+own, so they stay routed to their tenant. A shard is closed again once it
+has been idle for SHARD_IDLE_SECONDS, or earlier when more than
+MAX_OPEN_SHARDS are open; shards with requests in flight (streamed
+bodies included, see held_shard_stream), running jobs or SSE subscribers
+are never closed.
+"""
+import asyncio
+import contextvars
+import os
+import re
+import time
+from collections import OrderedDict
+from typing import AsyncIterator, Awaitable, Dict, Iterable, Optional
+
+from sqlalchemy import text
+
+from .database import DATABASE_PATH, Shard, current_shard, init_db, async_session, use_shard
+from .seed import seed_all
+from .sync import backfill_versions
+from .cache import reference_cache
+from .generation import generations
+from .write_queue import write_queue
+from .checkpoints import checkpoint_builder
+from .events import broker, event_relay
+from .jobs import job_runner, requeue_interrupted
+
+DEFAULT_TENANT = "default"
+TENANT_NAME = re.compile(r"^[A-Za-z0-9_-]{1,64}$")
+
+SHARDS_DIR = os.environ.get("FINANCE_SHARDS_DIR", "./shards")
+MAX_OPEN_SHARDS = int(os.environ.get("FINANCE_MAX_OPEN_SHARDS", "32"))
+SHARD_IDLE_SECONDS = 600
+EVICTION_INTERVAL = 60
+
+# Set by the multi-worker runner (gunicorn.conf.py) once it has prepared every shard
+DATABASE_PREPARED_ENV = "FINANCE_TRACKER_DATABASE_PREPARED"
+
+
+def shard_path(tenant: str) -> str:
+    # The default tenant keeps the database of the single-tenant setup
+    if tenant == DEFAULT_TENANT:
+        return DATABASE_PATH
+    return os.path.join(SHARDS_DIR, f"{tenant}.db")
+
+
+async def prepare_database(requeue: bool = True):
+    """
+    Bring the current shard's database up to date: schema, version backfill
+    and seed rows. Safe to run from several processes at once.
+
+    With `requeue`, jobs left running by a previous run are queued again;
+    only do that while no other process can be running this shard's jobs.
+    """
+    await init_db()
+    async with async_session() as db:
+        # One transaction under the write lock, so concurrent openers seed only once
+        await db.execute(text("BEGIN IMMEDIATE"))
+        await backfill_versions(db)
+        await seed_all(db)
+        await db.commit()
+    if requeue:
+        await requeue_interrupted()
+
+
+class OpenShard:
+    """A shard plus the bookkeeping the registry needs to decide when to close it."""
+
+    def __init__(self, tenant: str):
+        path = shard_path(tenant)
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        self.shard = Shard(tenant, path)
+        self.context = contextvars.Context()
+        self.context.run(use_shard, self.shard)
+        self.active = 0
+        self.last_used = time.monotonic()
+
+    def run(self, coro) -> Awaitable:
+        """Run `coro` routed to this shard, outside any request's context."""
+        return asyncio.create_task(coro, context=self.context.copy())
+
+    @property
+    def busy(self) -> bool:
+        subscribed = broker.peek(self.shard)
+        runner = job_runner.peek(self.shard)
+        return (
+            self.active > 0
+            or bool(subscribed and subscribed.subscribers)
+            or bool(runner and runner.busy)
+        )
+
+    async def open(self):
+        await prepare_database(requeue=not os.environ.get(DATABASE_PREPARED_ENV))
+        async with async_session() as db:
+            await reference_cache.get().load(db)
+        await checkpoint_builder.refresh()
+        write_queue.start()
+        event_relay.start()
+        await job_runner.start()
+
+    async def close(self):
+        shard = self.shard
+        runner = job_runner.peek(shard)
+        if runner is not None:
+            await runner.stop()
+        relay = event_relay.peek(shard)
+        if relay is not None:
+            await relay.stop()
+        queue = write_queue.peek(shard)
+        if queue is not None:
+            await queue.stop()
+        builder = checkpoint_builder.peek(shard)
+        if builder is not None:
+            await builder.wait()
+        watcher = generations.peek(shard)
+        if watcher is not None:
+            watcher.close()
+        await shard.dispose()
+
+
+class ShardRegistry:
+    """LRU of open shards, keyed by tenant."""
+
+    def __init__(self, max_open: int = MAX_OPEN_SHARDS, idle_seconds: float = SHARD_IDLE_SECONDS):
+        self.max_open = max_open
+        self.idle_seconds = idle_seconds
+        self._open: "OrderedDict[str, OpenShard]" = OrderedDict()
+        self._opening: Dict[str, asyncio.Task] = {}
+        self._task: Optional[asyncio.Task] = None
+
+    def start(self):
+        if self._task is None or self._task.done():
+            self._task = asyncio.create_task(self._evict_periodically())
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+        while self._open:
+            _, entry = self._open.popitem()
+            await entry.run(entry.close())
+
+    async def acquire(self, tenant: str) -> OpenShard:
+        """Open the tenant's shard if needed, route the calling context to it and count it as in use."""
+        while True:
+            entry = self._open.get(tenant)
+            if entry is not None:
+                break
+            task = self._opening.get(tenant)
+            if task is None:
+                task = self._opening[tenant] = asyncio.create_task(self._open_shard(tenant))
+                task.add_done_callback(lambda _: self._opening.pop(tenant, None))
+            # Loops in case the shard was evicted again before this request got to it
+            await asyncio.shield(task)
+
+        self._open.move_to_end(tenant)
+        entry.active += 1
+        entry.last_used = time.monotonic()
+        use_shard(entry.shard)
+        return entry
+
+    def release(self, entry: OpenShard):
+        entry.active -= 1
+        entry.last_used = time.monotonic()
+
+    async def _open_shard(self, tenant: str):
+        entry = OpenShard(tenant)
+        try:
+            await entry.run(entry.open())
+        except BaseException:
+            await entry.run(entry.close())
+            raise
+        self._open[tenant] = entry
+        await self.evict(keep=tenant)
+
+    async def evict(self, keep: Optional[str] = None):
+        """Close shards idle for too long, then least recently used ones while over capacity."""
+        now = time.monotonic()
+        for tenant, entry in list(self._open.items()):
+            if tenant == keep:
+                continue
+            over_capacity = len(self._open) > self.max_open
+            idle = now - entry.last_used > self.idle_seconds
+            if (over_capacity or idle) and not entry.busy and self._open.get(tenant) is entry:
+                del self._open[tenant]
+                await entry.run(entry.close())
+
+    async def _evict_periodically(self):
+        while True:
+            await asyncio.sleep(EVICTION_INTERVAL)
+            await self.evict()
+
+
+shards = ShardRegistry()
+
+
+async def held_shard_stream(body: AsyncIterator) -> AsyncIterator:
+    """
+    Stream `body` with the current tenant's shard counted as in use.
+
+    Dependencies such as verify_api_key exit before a StreamingResponse
+    sends its body, so a streamed body has to hold the shard itself or it
+    could be closed mid-response. Acquiring here (rather than in the
+    endpoint) also keeps the count right when the body is never started.
+    """
+    entry = await shards.acquire(current_shard().tenant)
+    try:
+        async for chunk in body:
+            yield chunk
+    finally:
+        shards.release(entry)
+
+
+async def prepare_shards(tenants: Iterable[str]):
+    """Prepare every tenant's database once, e.g. before forking workers."""
+    for tenant in sorted(set(tenants)):
+        entry = OpenShard(tenant)
+        await entry.run(prepare_database())
+        await entry.shard.dispose()
@@ -0,0 +1,123 @@
+from typing import Any, Dict, List
+
+from sqlalchemy import event, select, update, insert
+from sqlalchemy.engine import Connection
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy.orm import Session
+
+from .models import (
+    Versioned, SyncState, Tombstone,
+    Account, Category, Transaction, Goal, GoalContribution, Budget,
+    RecurringTransaction, Settings, AllocationRule, Transfer, CategoryEarmark
+)
+from .serialization import json_value
+from .archive import ARCHIVED_MODELS, history
+
+# Every versioned model, keyed by the table name used in sync payloads and tombstones
+SYNC_MODELS = {
+    model.__tablename__: model
+    for model in (
+        Account, Category, Transaction, Goal, GoalContribution, Budget,
+        RecurringTransaction, Settings, AllocationRule, Transfer, CategoryEarmark
+    )
+}
+
+
+def reserve_versions_sync(conn: Connection, count: int) -> int:
+    """
+    Reserve `count` consecutive change versions and return the first one.
+
+    The counter UPDATE takes SQLite's write lock, so versions are handed out
+    in commit order and a client cursor never skips a row committed later
+    with a lower version.
+    """
+    result = conn.execute(update(SyncState).where(SyncState.id == 1).values(version=SyncState.version + count))
+    if result.rowcount == 0:
+        conn.execute(insert(SyncState).values(id=1, version=count))
+    last = conn.execute(select(SyncState.version).where(SyncState.id == 1)).scalar_one()
+    return last - count + 1
+
+
+async def reserve_versions(db: AsyncSession, count: int) -> int:
+    """Async variant for set-based statements that bypass the ORM flush hook."""
+    conn = await db.connection()
+    return await conn.run_sync(reserve_versions_sync, count)
+
+
+@event.listens_for(Session, "before_flush")
+def _stamp_versions(session: Session, flush_context, instances):
+    changed = [obj for obj in session.new if isinstance(obj, Versioned)]
+    changed += [
+        obj for obj in session.dirty
+        if isinstance(obj, Versioned) and session.is_modified(obj, include_collections=False)
+    ]
+    deleted = [obj for obj in session.deleted if isinstance(obj, Versioned)]
+    if not changed and not deleted:
+        return
+
+    version = reserve_versions_sync(session.connection(), len(changed) + len(deleted))
+    for obj in changed:
+        obj.version = version
+        version += 1
+    for obj in deleted:
+        session.add(Tombstone(entity=obj.__tablename__, entity_id=obj.id, version=version))
+        version += 1
+
+
+async def backfill_versions(db: AsyncSession):
+    """Give rows written before versioning existed (version 0) unique versions. The caller commits."""
+    for model in SYNC_MODELS.values():
+        legacy = await db.execute(select(model.id).where(model.version == 0).order_by(model.id))
+        ids = legacy.scalars().all()
+        if not ids:
+            continue
+        first = await reserve_versions(db, len(ids))
+        await db.execute(
+            update(model),
+            [{"id": row_id, "version": first + i} for i, row_id in enumerate(ids)]
+        )
+
+
+def row_to_dict(obj: Versioned) -> Dict[str, Any]:
+    return {c.key: json_value(getattr(obj, c.key)) for c in obj.__table__.columns}
+
+
+async def get_changes(db: AsyncSession, since: int, limit: int) -> Dict[str, Any]:
+    """
+    One page of changes with version > since, across all entity types.
+
+    Each table contributes at most `limit` rows in version order, and the
+    merged result is cut at `limit`, so the page is exactly the `limit`
+    lowest-versioned changes and the last version is a safe next cursor.
+    """
+    candidates: List[tuple] = []
+    for name, model in SYNC_MODELS.items():
+        # Archived rows keep their versions, so a client syncing from scratch still gets them
+        source = await history(model) if model in ARCHIVED_MODELS else model
+        result = await db.execute(
+            select(source).where(source.version > since).order_by(source.version).limit(limit)
+        )
+        candidates += [(obj.version, name, obj) for obj in result.scalars()]
+
+    result = await db.execute(
+        select(Tombstone).where(Tombstone.version > since).order_by(Tombstone.version).limit(limit)
+    )
+    candidates += [(t.version, None, t) for t in result.scalars()]
+
+    candidates.sort(key=lambda c: c[0])
+    page = candidates[:limit]
+
+    changes: Dict[str, List[Dict[str, Any]]] = {}
+    deleted: List[Dict[str, Any]] = []
+    for version, name, obj in page:
+        if name is None:
+            deleted.append({"entity": obj.entity, "id": obj.entity_id, "version": version})
+        else:
+            changes.setdefault(name, []).append(row_to_dict(obj))
+
+    return {
+        "cursor": page[-1][0] if page else since,
+        "has_more": len(candidates) > limit,
+        "changes": changes,
+        "deleted": deleted,
+    }
@@ -0,0 +1,118 @@
+"""
+Time budgets for read queries.
+
+aiosqlite runs every statement on the connection's own thread, and that
+thread keeps going after the request that issued the statement has
+given up (client gone, task cancelled). A runaway report would hold its
+read connection until SQLite finished. Each read connection therefore
+gets a progress handler that SQLite calls every PROGRESS_STEPS virtual
+machine instructions; it aborts the statement ("interrupted") once the
+budget of the request that issued it has run out or its client has
+disconnected.
+
+Routes opt in with `Depends(query_budget(seconds))`. The budget travels
+in a context variable, so reads fanned out to other read sessions by
+the route are covered too.
+"""
+import asyncio
+import time
+from contextvars import ContextVar
+from typing import Optional
+
+from fastapi import HTTPException, Request, status
+from sqlalchemy.exc import OperationalError
+
+PROGRESS_STEPS = 1000
+DISCONNECT_POLL_INTERVAL = 0.5
+RETRY_AFTER_SECONDS = 30
+
+ANALYTICS_QUERY_BUDGET = 10.0
+LIST_QUERY_BUDGET = 5.0
+
+BUDGET_SLOT_KEY = "query_budget_slot"
+
+
+class QueryBudget:
+    """Deadline of one request's reads; `cancelled` is set when its client disconnects."""
+
+    def __init__(self, seconds: float):
+        self.seconds = seconds
+        self.deadline = time.monotonic() + seconds
+        self.cancelled = False
+
+    def exhausted(self) -> bool:
+        return self.cancelled or time.monotonic() > self.deadline
+
+
+_current_budget: ContextVar[Optional[QueryBudget]] = ContextVar("query_budget", default=None)
+
+
+class _BudgetSlot:
+    """
+    Progress handler of one read connection.
+
+    Called on the connection's thread, so it only reads the budget the
+    event loop handed over before the statement started.
+    """
+
+    def __init__(self):
+        self.budget: Optional[QueryBudget] = None
+
+    def __call__(self) -> int:
+        budget = self.budget
+        return 1 if budget is not None and budget.exhausted() else 0
+
+
+def install_budget_handler(dbapi_connection, connection_record):
+    """Listener for the "connect" event of every read engine."""
+    slot = _BudgetSlot()
+    connection_record.info[BUDGET_SLOT_KEY] = slot
+    # set_progress_handler must run on the aiosqlite thread that owns the connection
+    dbapi_connection.await_(dbapi_connection.driver_connection.set_progress_handler(slot, PROGRESS_STEPS))
+
+
+def attach_budget(conn, cursor, statement, parameters, context, executemany):
+    """Listener for the "before_cursor_execute" event of every read engine."""
+    slot = conn.connection.info.get(BUDGET_SLOT_KEY)
+    if slot is not None:
+        slot.budget = _current_budget.get()
+
+
+def is_interrupted(exc: OperationalError) -> bool:
+    return "interrupted" in str(exc.orig)
+
+
+async def _watch_disconnect(request: Request, budget: QueryBudget):
+    while not await request.is_disconnected():
+        await asyncio.sleep(DISCONNECT_POLL_INTERVAL)
+    budget.cancelled = True
+
+
+def query_budget(seconds: float):
+    """
+    Dependency limiting the route's read queries to `seconds` in total.
+
+    A query still running at the deadline is interrupted and the request
+    fails with 503 and a Retry-After header. Queries of a request whose
+    client disconnected are interrupted as well.
+    """
+
+    async def dependency(request: Request):
+        budget = QueryBudget(seconds)
+        token = _current_budget.set(budget)
+        watcher = asyncio.create_task(_watch_disconnect(request, budget))
+        try:
+            yield budget
+        except OperationalError as exc:
+            if not is_interrupted(exc) or not budget.exhausted():
+                raise
+            raise HTTPException(
+                status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+                detail=f"Query exceeded its {seconds:g}s time budget; retry later or narrow the date range",
+                headers={"Retry-After": str(RETRY_AFTER_SECONDS)}
+            )
+        finally:
+            watcher.cancel()
+            _current_budget.reset(token)
+
+    return dependency
@@ -0,0 +1,155 @@
+import asyncio
+from dataclasses import dataclass, field
+from decimal import Decimal
+from typing import Any, Awaitable, Callable, Dict, List, Optional
+
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy import text
+
+from .database import async_session, ShardLocal
+from .models import TransactionType
+from .balance import get_available_balance, get_account_balances
+from .events import PENDING_EVENTS_KEY, record_change
+
+
+class BalanceState:
+    """
+    Running balances for one write batch.
+
+    Loaded once when the batch starts (inside the batch's write lock) and
+    then adjusted in memory by every operation, so each balance check sees
+    the effect of the operations queued before it without re-summing history.
+    """
+
+    def __init__(self, available: Decimal, accounts: Dict[int, Decimal]):
+        self.available = available
+        self.accounts = accounts
+
+    @classmethod
+    async def load(cls, db: AsyncSession) -> "BalanceState":
+        return cls(await get_available_balance(db), await get_account_balances(db))
+
+    def account(self, account_id: int) -> Decimal:
+        return self.accounts.get(account_id, Decimal("0"))
+
+    def snapshot(self):
+        return self.available, dict(self.accounts)
+
+    def restore(self, snapshot):
+        self.available, self.accounts = snapshot[0], dict(snapshot[1])
+
+    def add_transaction(self, type: TransactionType, amount: Decimal, account_id: Optional[int], sign: int = 1):
+        delta = amount if type == TransactionType.income else -amount
+        delta *= sign
+        self.available += delta
+        if account_id is not None:
+            self.accounts[account_id] = self.account(account_id) + delta
+
+    def remove_transaction(self, type: TransactionType, amount: Decimal, account_id: Optional[int]):
+        self.add_transaction(type, amount, account_id, sign=-1)
+
+    def add_contribution(self, amount: Decimal):
+        self.available -= amount
+
+    def add_transfer(self, from_account_id: int, to_account_id: int, amount: Decimal):
+        self.accounts[from_account_id] = self.account(from_account_id) - amount
+        self.accounts[to_account_id] = self.account(to_account_id) + amount
+
+    def record(self, db: AsyncSession, entity: str, id: int, op: str, *account_ids: Optional[int]):
+        """Record a change event carrying the balances as they stand after this operation."""
+        accounts = {a: self.account(a) for a in account_ids if a is not None}
+        record_change(db, entity, id, op, balance=self.available, accounts=accounts)
+
+
+WriteOp = Callable[[AsyncSession, BalanceState], Awaitable[Any]]
+
+
+@dataclass
+class _PendingWrite:
+    op: WriteOp
+    future: asyncio.Future
+    result: Any = None
+    error: Optional[BaseException] = field(default=None)
+
+
+class WriteQueue:
+    """
+    Single-writer pipeline for balance-checked mutations.
+
+    Callers submit an operation and await its result. One background task
+    drains everything queued so far, runs the operations in order inside a
+    single BEGIN IMMEDIATE transaction (each in its own savepoint, so a
+    rejected operation does not affect its neighbours) and commits once.
+    Futures are resolved only after that commit succeeds.
+    """
+
+    def __init__(self, max_batch: int = 100):
+        self.max_batch = max_batch
+        self._queue: Optional[asyncio.Queue] = None
+        self._task: Optional[asyncio.Task] = None
+
+    def start(self):
+        if self._task is None or self._task.done():
+            self._queue = asyncio.Queue()
+            self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+    async def submit(self, op: WriteOp) -> Any:
+        self.start()
+        future = asyncio.get_running_loop().create_future()
+        await self._queue.put(_PendingWrite(op, future))
+        return await future
+
+    async def _run(self):
+        while True:
+            batch = [await self._queue.get()]
+            while len(batch) < self.max_batch and not self._queue.empty():
+                batch.append(self._queue.get_nowait())
+            await self._process(batch)
+
+    async def _process(self, batch: List[_PendingWrite]):
+        try:
+            async with async_session() as db:
+                await db.execute(text("BEGIN IMMEDIATE"))
+                state = await BalanceState.load(db)
+
+                # Each operation records into its own list; only those of operations that succeeded are published
+                batch_events = []
+                for item in batch:
+                    snapshot = state.snapshot()
+                    op_events = db.info[PENDING_EVENTS_KEY] = []
+                    try:
+                        async with db.begin_nested():
+                            item.result = await item.op(db, state)
+                    except Exception as exc:
+                        state.restore(snapshot)
+                        item.error = exc
+                    else:
+                        batch_events.extend(op_events)
+
+                db.info[PENDING_EVENTS_KEY] = batch_events
+                await db.commit()
+        except Exception as exc:
+            for item in batch:
+                if not item.future.done():
+                    item.future.set_exception(exc)
+            return
+
+        for item in batch:
+            if item.future.done():
+                continue
+            if item.error is not None:
+                item.future.set_exception(item.error)
+            else:
+                item.future.set_result(item.result)
+
+
+write_queue = ShardLocal(WriteQueue)
@@ -0,0 +1,35 @@
+"""
+Production runner: gunicorn supervising uvicorn workers.
+
+    gunicorn -c backend/gunicorn.conf.py backend.app.main:app
+
+The app is preloaded in the master, which prepares every tenant's
+database once (schema, seed rows, interrupted jobs) before forking the
+workers; each worker then opens tenant shards as requests arrive.
+Workers keep their caches coherent through the shared write generations
+(app.generation) and relay change events to each other's SSE subscribers
+(app.events), so any number of them can serve the same database.
+
+`kill -HUP` replaces the workers gracefully. Because the app is
+preloaded, code changes need a full restart.
+"""
+import asyncio
+import importlib
+import multiprocessing
+import os
+
+bind = os.environ.get("FINANCE_TRACKER_BIND", "0.0.0.0:8000")
+# SQLite still has a single writer, so more workers mainly add read and CPU capacity
+workers = int(os.environ.get("FINANCE_TRACKER_WORKERS", min(4, multiprocessing.cpu_count())))
+worker_class = "uvicorn.workers.UvicornWorker"
+preload_app = True
+timeout = 60
+graceful_timeout = 30
+keepalive = 5
+
+
+def on_starting(server):
+    main = importlib.import_module(server.app.app_uri.partition(":")[0])
+    asyncio.run(main.prepare_database())
+    # Inherited by the forked workers, whose lifespan then skips the preparation
+    os.environ[main.DATABASE_PREPARED_ENV] = "1"
@@ -0,0 +1,28 @@
+import time
+
+import pytest
+from fastapi.testclient import TestClient
+
+from backend.app.auth import API_KEY
+from backend.app.main import app
+
+
+@pytest.fixture
+def client(tmp_path, monkeypatch):
+    """API client on a fresh default-tenant database in a temporary directory."""
+    monkeypatch.chdir(tmp_path)
+    with TestClient(app, headers={"X-API-Key": API_KEY}) as client:
+        yield client
+
+
+def run_job(client, path, body, timeout=10.0):
+    """Submit a job and wait for it to finish; returns the finished job."""
+    response = client.post(path, json=body)
+    assert response.status_code == 202, response.text
+    job = response.json()
+    deadline = time.monotonic() + timeout
+    while job["status"] not in ("succeeded", "failed", "cancelled"):
+        assert time.monotonic() < deadline, job
+        time.sleep(0.05)
+        job = client.get(f"/api/jobs/{job['id']}").json()
+    return job
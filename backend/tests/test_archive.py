@@ -0,0 +1,41 @@
+from decimal import Decimal
+
+from .conftest import run_job
+
+SALARY, FOOD = 1, 5  # seeded income and expense categories
+
+
+def add_transaction(client, type, category_id, amount, day):
+    response = client.post("/api/transactions", json={
+        "amount": amount, "type": type, "date": day, "category_id": category_id
+    })
+    assert response.status_code == 201, response.text
+
+
+def close_through(client, year):
+    job = run_job(client, "/api/jobs/close-year", {"through_year": year})
+    assert job["status"] == "succeeded", job
+
+
+def test_budgets_read_archived_spending(client):
+    response = client.post("/api/budgets", json={"category_id": FOOD, "amount": "400", "month": 12, "year": 2024})
+    assert response.status_code == 201, response.text
+    add_transaction(client, "income", SALARY, "1000", "2024-11-01")
+    add_transaction(client, "expense", FOOD, "50", "2024-11-30")
+    add_transaction(client, "expense", FOOD, "100", "2024-12-05")
+    add_transaction(client, "expense", FOOD, "200", "2024-12-20")
+
+    close_through(client, 2024)
+    assert client.get("/api/archive").json()[-1]["archived"] is True
+
+    matrix = client.get("/api/budgets/matrix", params={"from": "2024-12", "to": "2024-12"}).json()
+    (row,) = matrix["rows"]
+    assert Decimal(row["spent"][0]) == Decimal("300")
+    assert Decimal(matrix["total_spent"][0]) == Decimal("300")
+
+    response = client.post("/api/budgets/copy", json={
+        "source_month": 12, "source_year": 2024, "target_month": 1, "target_year": 2025, "rollover": True
+    })
+    assert response.status_code == 201, response.text
+    (budget,) = response.json()["budgets"]
+    assert Decimal(budget["amount"]) == Decimal("500")
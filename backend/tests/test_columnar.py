@@ -0,0 +1,35 @@
+from datetime import date
+
+AMOUNTS = ("0.10", "1234567.89")
+
+
+def add_transactions(client):
+    today = date.today().isoformat()
+    for amount in AMOUNTS:
+        for type, category_id in (("income", 1), ("expense", 5)):
+            response = client.post("/api/transactions", json={
+                "amount": amount, "type": type, "category_id": category_id, "date": today
+            })
+            assert response.status_code == 201, response.text
+
+
+def test_transaction_columns_match_rows(client):
+    add_transactions(client)
+    rows = client.get("/api/transactions").json()
+    columns = client.get("/api/transactions", params={"format": "columnar"}).json()["columns"]
+
+    assert columns["amount"] == [row["amount"] for row in rows]
+    assert sorted(set(columns["amount"])) == sorted(AMOUNTS)
+
+
+def test_analytics_columns_match_rows(client):
+    add_transactions(client)
+    for path, fields in (
+        ("/api/analytics/by-category", ("total",)),
+        ("/api/analytics/trend", ("income", "expense")),
+        ("/api/analytics/daily-spending", ("amount",)),
+    ):
+        rows = client.get(path).json()
+        columns = client.get(path, params={"format": "columnar"}).json()
+        for field in fields:
+            assert columns[field] == [row[field] for row in rows], (path, field)
@@ -0,0 +1,45 @@
+import asyncio
+
+from backend.app.events import broker, record_change
+from backend.app.shards import OpenShard
+from backend.app.write_queue import write_queue
+
+
+def test_write_queue_publishes_only_after_the_batch_commits(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    subscription = None
+    published_during_batch = []
+
+    async def create(db, state):
+        record_change(db, "category", 1, "update")
+
+    async def reject(db, state):
+        record_change(db, "category", 2, "update")
+        raise ValueError("rejected")
+
+    async def observe(db, state):
+        # The savepoints of the two operations before this one have been released or rolled back by now
+        published_during_batch.append(subscription.queue.qsize())
+
+    async def batch():
+        nonlocal subscription
+        subscription = broker.get().subscribe()
+        queue = write_queue.get()
+        return await asyncio.gather(
+            queue.submit(create), queue.submit(reject), queue.submit(observe), return_exceptions=True
+        )
+
+    async def main():
+        entry = OpenShard("default")
+        await entry.run(entry.open())
+        try:
+            return await entry.run(batch())
+        finally:
+            await entry.run(entry.close())
+
+    results = asyncio.run(main())
+
+    assert results[0] is None and isinstance(results[1], ValueError) and results[2] is None
+    assert published_during_batch == [0]
+    published = [subscription.queue.get_nowait() for _ in range(subscription.queue.qsize())]
+    assert [(change.entity, change.id) for change in published] == [("category", 1)]
@@ -0,0 +1,20 @@
+from decimal import Decimal
+
+import pyarrow as pa
+
+AMOUNTS = ("0.10", "1234567.89", "0.29", "100.00")
+
+
+def test_arrow_export_amounts_are_exact_decimals(client):
+    for amount in AMOUNTS:
+        response = client.post("/api/transactions", json={
+            "amount": amount, "type": "income", "category_id": 1, "date": "2026-01-15"
+        })
+        assert response.status_code == 201, response.text
+
+    response = client.get("/api/export/transactions", params={"format": "arrow"})
+    assert response.status_code == 200, response.text
+    table = pa.ipc.open_stream(response.content).read_all()
+
+    assert table.schema.field("amount").type == pa.decimal128(12, 2)
+    assert table.column("amount").to_pylist() == [Decimal(a) for a in AMOUNTS]
@@ -0,0 +1,19 @@
+import pytest
+
+from backend.app.importer import _parse_row
+
+
+@pytest.mark.parametrize("amount", ["0", "0.004", "-0.001", "-0.005", "1e30", "abc", "NaN"])
+def test_rejects_amounts_that_round_to_zero_or_are_invalid(amount):
+    with pytest.raises(ValueError, match="Invalid amount"):
+        _parse_row({"date": "2026-01-02", "amount": amount, "category": "Salary"})
+
+
+@pytest.mark.parametrize("amount, expected, type", [
+    ("0.006", "0.01", "income"),
+    ("-0.006", "0.01", "expense"),
+    ("1,234.567", "1234.57", "income"),
+])
+def test_rounds_amounts_to_cents(amount, expected, type):
+    row = _parse_row({"date": "2026-01-02", "amount": amount, "category": "Salary"})
+    assert row[1:3] == (expected, type)
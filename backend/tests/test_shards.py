@@ -0,0 +1,29 @@
+import asyncio
+
+from backend.app.shards import held_shard_stream, shards
+
+
+def test_streamed_body_holds_its_shard(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    busy_while_streaming = []
+
+    async def main():
+        # Like a request whose dependency released the shard before the body streams
+        entry = await shards.acquire("default")
+        shards.release(entry)
+        assert not entry.busy
+
+        async def body():
+            busy_while_streaming.append(entry.busy)
+            yield b"chunk"
+
+        try:
+            chunks = [chunk async for chunk in held_shard_stream(body())]
+            return entry, chunks
+        finally:
+            await shards.stop()
+
+    entry, chunks = asyncio.run(main())
+    assert chunks == [b"chunk"]
+    assert busy_while_streaming == [True]
+    assert entry.active == 0
@@ -16,6 +16,7 @@ let
   publicPort = 8882;
   backendPort = 8001;
   backendHost = "127.0.0.1";
+  backendWorkers = 4;
 
   allowedIPs = [
     "127.0.0.1"
@@ -172,6 +173,7 @@ in
       environment = {
         FINANCE_TRACKER_LOG_DIR = logDir;
         FINANCE_TRACKER_LOG_FILE = "app.log";
+        FINANCE_TRACKER_WORKERS = toString backendWorkers;
         PYTHONPATH = projectPath;
         LD_LIBRARY_PATH = libPath;
       };
@@ -191,7 +193,9 @@ in
         TimeoutStartSec = "infinity";
 
         EnvironmentFile = config.sops.templates."finance-tracker-env".path;
-        ExecStart = "${projectPath}/venv/bin/uvicorn backend.app.main:app --host ${backendHost} --port ${toString backendPort}";
+        ExecStart = "${projectPath}/venv/bin/gunicorn -c ${projectPath}/backend/gunicorn.conf.py --bind ${backendHost}:${toString backendPort} backend.app.main:app";
+        # Graceful worker restart; code changes still need a full restart (the app is preloaded)
+        ExecReload = "${pkgs.coreutils}/bin/kill -HUP $MAINPID";
         Restart = "always";
         RestartSec = "10";
 